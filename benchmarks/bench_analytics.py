@@ -0,0 +1,90 @@
+"""Benchmark the bulk jobs of sc2monitor with several worker processes.
+
+Seeds a SQLite database with players and matches (1M matches by default)
+and times `recompute_statistics` and `rebuild_ema` for each number of
+worker processes (see the config key `analytics_processes`).
+
+Usage: python benchmarks/bench_analytics.py [--matches N] [--players N]
+                                            [--processes 1,2,4,8,16]
+"""
+import argparse
+import logging
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+
+import sc2monitor.model as model
+from sc2monitor.controller import Controller
+
+
+def seed(engine, players, matches, batch=50000):
+    """Fill the database with synthetic players and matches."""
+    start = datetime(2020, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(model.Player.__table__.insert(), [
+            dict(id=idx + 1, player_id=100000 + idx // 2, realm=1,
+                 server=model.Server.Europe,
+                 race=model.Race(1 + idx % 2), mmr=4000)
+            for idx in range(players)])
+
+    rows = []
+    for idx in range(matches):
+        rows.append(dict(
+            player_id=random.randint(1, players),
+            result=model.Result.Win if idx % 2 else model.Result.Loss,
+            datetime=start + timedelta(minutes=idx),
+            mmr=4000 + random.randint(-500, 500),
+            mmr_change=random.choice([-21, 21]),
+            guess=False, max_length=180))
+        if len(rows) >= batch:
+            with engine.begin() as conn:
+                conn.execute(model.Match.__table__.insert(), rows)
+            rows = []
+    if rows:
+        with engine.begin() as conn:
+            conn.execute(model.Match.__table__.insert(), rows)
+
+
+def main():
+    """Seed a database and time the bulk jobs per number of processes."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--matches', type=int, default=1000000)
+    parser.add_argument('--players', type=int, default=10000)
+    parser.add_argument('--processes', default='1,2,4,8,16')
+    parser.add_argument('--chunk-size', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = 'sqlite:///' + os.path.join(directory, 'bench.db')
+        engine = create_engine(db)
+        model.Base.metadata.create_all(engine)
+        start = time.perf_counter()
+        seed(engine, args.players, args.matches)
+        engine.dispose()
+        print(f'Seeded {args.matches} matches for {args.players} players'
+              f' in {time.perf_counter() - start:.1f}s'
+              f' ({os.cpu_count()} CPUs)')
+
+        print(f"{'processes':<12}{'statistics [s]':>16}{'ema [s]':>12}")
+        ctrl = Controller(db=db, cache_matches=args.matches)
+        ctrl.create_db_session()
+        for processes in map(int, args.processes.split(',')):
+            start = time.perf_counter()
+            ctrl.recompute_statistics(args.chunk_size, processes)
+            statistics = time.perf_counter() - start
+            start = time.perf_counter()
+            ctrl.rebuild_ema(chunk_size=args.chunk_size, processes=processes)
+            ema = time.perf_counter() - start
+            print(f'{processes:<12}{statistics:>16.2f}{ema:>12.2f}')
+        ctrl.close_db_session()
+
+
+if __name__ == '__main__':
+    main()
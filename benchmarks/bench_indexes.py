@@ -0,0 +1,164 @@
+"""Benchmark the hot queries of sc2monitor with and without indexes.
+
+Seeds a SQLite database with players and matches (1M matches by default)
+and times the queries the controller runs on every refresh, once without
+the secondary indexes and unique constraints and once after
+`model.migrate` added them.
+
+Usage: python benchmarks/bench_indexes.py [--matches N] [--players N]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import MetaData, Table, create_engine, desc, select
+
+import sc2monitor.model as model
+
+
+def seed(engine, players, matches, batch=50000):
+    """Fill the database with synthetic players, seasons, logs and runs."""
+    start = datetime(2020, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(model.Player.__table__.insert(), [
+            dict(id=idx + 1, player_id=100000 + idx // 2, realm=1,
+                 server=model.Server.Europe,
+                 race=model.Race(1 + idx % 2), mmr=4000)
+            for idx in range(players)])
+        conn.execute(model.Season.__table__.insert(), [
+            dict(season_id=season, server=server, year=2020, number=season)
+            for season in range(1, 50) for server in model.Server
+            if server != model.Server.Unknown])
+        conn.execute(model.Log.__table__.insert(), [
+            dict(logger='bench', level='INFO', msg='message',
+                 datetime=start + timedelta(minutes=idx))
+            for idx in range(min(matches, 100000))])
+        conn.execute(model.Run.__table__.insert(), [
+            dict(datetime=start + timedelta(minutes=idx), duration=1.0)
+            for idx in range(min(matches, 100000))])
+
+    rows = []
+    for idx in range(matches):
+        rows.append(dict(
+            player_id=random.randint(1, players),
+            result=model.Result.Win if idx % 2 else model.Result.Loss,
+            datetime=start + timedelta(minutes=idx),
+            mmr=4000 + random.randint(-500, 500),
+            ema_mmr=4000.0))
+        if len(rows) >= batch:
+            with engine.begin() as conn:
+                conn.execute(model.Match.__table__.insert(), rows)
+            rows = []
+    if rows:
+        with engine.begin() as conn:
+            conn.execute(model.Match.__table__.insert(), rows)
+
+
+def hot_queries(players):
+    """Return the queries issued per player/run by the controller."""
+    match = model.Match.__table__
+    player = model.Player.__table__
+    season = model.Season.__table__
+    log = model.Log.__table__
+    run = model.Run.__table__
+
+    def player_ids():
+        return random.sample(range(1, players + 1), 100)
+
+    return {
+        'last match of player': lambda: [
+            select([match]).where(match.c.player_id == pid)
+            .order_by(desc(match.c.datetime)).limit(1)
+            for pid in player_ids()],
+        'last 100 matches of player': lambda: [
+            select([match]).where(match.c.player_id == pid)
+            .order_by(desc(match.c.datetime)).limit(100)
+            for pid in player_ids()],
+        'player by identity and race': lambda: [
+            select([player]).where(
+                (player.c.player_id == 100000 + (pid - 1) // 2)
+                & (player.c.realm == 1)
+                & (player.c.server == model.Server.Europe)
+                & (player.c.race == model.Race(1 + (pid - 1) % 2)))
+            for pid in player_ids()],
+        'latest season of server': lambda: [
+            select([season]).where(season.c.server == server)
+            .order_by(desc(season.c.season_id)).limit(1)
+            for server in [model.Server.Europe] * 100],
+        'log retention scan': lambda: [
+            select([log.c.id]).order_by(desc(log.c.datetime))
+            .offset(500).limit(1)],
+        'run retention scan': lambda: [
+            select([run.c.id]).order_by(desc(run.c.datetime))
+            .offset(500).limit(1)],
+    }
+
+
+def time_queries(engine, queries, repeat=3):
+    """Time each query group and return the best of `repeat` runs."""
+    results = {}
+    with engine.connect() as conn:
+        for name, build in queries.items():
+            statements = build()
+            best = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for statement in statements:
+                    conn.execute(statement).fetchall()
+                best = min(best, time.perf_counter() - start)
+            results[name] = best / len(statements)
+    return results
+
+
+def create_tables(engine):
+    """Create the tables without indexes like a pre-migration database.
+
+    SQLite cannot drop the index of a unique constraint of a table, so
+    the tables are created without them.
+    """
+    metadata = MetaData()
+    for table in model.Base.metadata.sorted_tables:
+        Table(table.name, metadata,
+              *[column.copy() for column in table.columns])
+    metadata.create_all(engine)
+
+
+def main():
+    """Seed a database and compare query times before and after migrate."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--matches', type=int, default=1000000)
+    parser.add_argument('--players', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = 'sqlite:///' + os.path.join(directory, 'bench.db')
+        engine = create_engine(db)
+        create_tables(engine)
+
+        start = time.perf_counter()
+        seed(engine, args.players, args.matches)
+        print(f'Seeded {args.matches} matches for {args.players} players'
+              f' in {time.perf_counter() - start:.1f}s')
+
+        queries = hot_queries(args.players)
+        before = time_queries(engine, queries)
+
+        start = time.perf_counter()
+        model.migrate(engine)
+        print(f'Migration took {time.perf_counter() - start:.1f}s')
+        after = time_queries(engine, queries)
+
+        print(f"{'query':<30}{'before [ms]':>14}{'after [ms]':>14}")
+        for name in queries:
+            print(f'{name:<30}{before[name] * 1000:>14.3f}'
+                  f'{after[name] * 1000:>14.3f}')
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Benchmark the decoding of ladder responses of the SC2 api.
+
+Builds a synthetic ladder response with the fields returned by the api
+and reports the parse time and the peak memory per response of every
+available JSON decoder. The streaming decoder keeps only the fields used
+by the sc2monitor and needs ijson to be installed.
+
+Usage: python benchmarks/bench_json.py [--teams N] [--repeat N]
+"""
+import argparse
+import io
+import json
+import random
+import time
+import tracemalloc
+
+from sc2monitor.decoding import LADDER_FIELDS, Projection, ijson, orjson
+
+
+def ladder_response(teams, seed=0):
+    """Return a ladder response of the api encoded as JSON."""
+    rng = random.Random(seed)
+    races = ['PROTOSS', 'TERRAN', 'ZERG', 'RANDOM']
+    ladder_teams = []
+    for idx in range(teams):
+        members = [{'id': str(rng.randint(1, 10 ** 7)), 'realm': 1,
+                    'region': 2, 'displayName': f'player{idx}',
+                    'clanTag': f'C{idx % 50}',
+                    'favoriteRace': rng.choice(races)}]
+        ladder_teams.append({
+            'teamMembers': members,
+            'previousRank': rng.randint(0, teams),
+            'points': rng.randint(0, 2000),
+            'wins': rng.randint(0, 200),
+            'losses': rng.randint(0, 200),
+            'mmr': rng.randint(2000, 6000),
+            'joinTimestamp': 1600000000 + idx})
+    return json.dumps({
+        'ladderTeams': ladder_teams,
+        'allLadderMemberships': [
+            {'ladderId': str(idx), 'localizedGameMode': '1v1 Diamond',
+             'rank': idx} for idx in range(10)],
+        'ranksAndPools': [{'rank': 1, 'mmr': 5000, 'bonusPool': 0}],
+        'league': 'DIAMOND', 'currentLadderMembership': {
+            'ladderId': '1', 'localizedGameMode': '1v1 Diamond'}}).encode()
+
+
+def stream(body):
+    """Decode with ijson keeping only the projected fields."""
+    projection = Projection(LADDER_FIELDS)
+    for _, event, value in ijson.parse(io.BytesIO(body), use_float=True):
+        projection.feed(event, value)
+    return projection.result
+
+
+def decoders():
+    """Return the decoders to compare by name."""
+    result = {'json': json.loads}
+    if orjson is not None:
+        result['orjson'] = orjson.loads
+    if ijson is not None:
+        result['ijson streaming'] = stream
+    return result
+
+
+def measure(decode, body, repeat):
+    """Return the parse time and the peak memory of a decoder."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        decode(body)
+    duration = (time.perf_counter() - start) / repeat
+
+    tracemalloc.start()
+    data = decode(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del data
+    return duration, peak
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--teams', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    body = ladder_response(args.teams)
+    print(f'ladder response of {args.teams} teams: {len(body)} bytes')
+    for name, decode in decoders().items():
+        duration, peak = measure(decode, body, args.repeat)
+        print(f'{name:>20}: {duration * 1000:8.3f} ms, '
+              f'{peak / 1024:8.1f} KiB peak')
+    if ijson is None:
+        print('ijson is not installed, skipped streaming.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""Benchmark the parsing of API payloads into ladder and match records.
+
+Builds synthetic ladder and match history payloads for many players
+(10k by default), runs them through the parsing of `SC2API` and reports
+the time and the memory held by the parsed records, as well as the time
+of the enum lookups used while parsing.
+
+Usage: python benchmarks/bench_parsing.py [--players N] [--ladder-size N]
+"""
+import argparse
+import asyncio
+import random
+import time
+import tracemalloc
+from datetime import datetime
+
+import sc2monitor.model as model
+from sc2monitor.sc2api import SC2API
+
+
+class Controller:
+    """Bare controller providing the config read by the API wrapper."""
+
+    def get_config(self, key, **kwargs):
+        """Return an empty config value."""
+        return ''
+
+
+def payloads(players, ladder_size, seed=0):
+    """Return ladder and match history payloads by profile id."""
+    rng = random.Random(seed)
+    races = ['PROTOSS', 'TERRAN', 'ZERG', 'RANDOM']
+    leagues = ['BRONZE', 'SILVER', 'GOLD', 'PLATINUM', 'DIAMOND', 'MASTER']
+    start = int(datetime(2020, 1, 1).timestamp())
+    ladders = {}
+    histories = {}
+    for first in range(0, players, ladder_size):
+        profiles = range(first, min(first + ladder_size, players))
+        teams = [{'teamMembers': [{'id': str(profile), 'realm': 1,
+                                   'displayName': f'player{profile}',
+                                   'favoriteRace': rng.choice(races)}],
+                  'mmr': rng.randint(2000, 6000),
+                  'wins': rng.randint(0, 200),
+                  'losses': rng.randint(0, 200),
+                  'joinTimestamp': start}
+                 for profile in profiles]
+        teams.sort(key=lambda team: -team['mmr'])
+        league = rng.choice(leagues)
+        for rank, team in enumerate(teams, start=1):
+            profile = int(team['teamMembers'][0]['id'])
+            ladders[profile] = {
+                'league': league,
+                'ranksAndPools': [{'rank': rank, 'mmr': team['mmr']}],
+                'ladderTeams': teams}
+            histories[profile] = {'matches': [
+                {'type': rng.choice(['1v1', '1v1', '1v1', '2v2']),
+                 'decision': rng.choice(['WIN', 'LOSS', 'TIE']),
+                 'date': start + 600 * idx}
+                for idx in range(25)]}
+    return ladders, histories
+
+
+def make_api(ladders, histories):
+    """Return an API wrapper answering requests with the payloads."""
+    api = SC2API(Controller())
+
+    async def perform_api_request(url, **kwargs):
+        parts = url.split('/')
+        if parts[-1] == 'matches':
+            return histories[int(parts[-2])], 200
+        return ladders[int(parts[-3])], 200
+
+    async def get_access_token():
+        return 'token'
+
+    api._perform_api_request = perform_api_request
+    api.get_access_token = get_access_token
+    return api
+
+
+async def parse(api, profiles):
+    """Parse the ladder and the match history of every profile."""
+    entries = []
+    histories = []
+    for profile in profiles:
+        async for entry in api._get_ladder_data(
+                model.Server.Europe, 1, profile, 1):
+            entries.append(entry)
+        histories.append(await api._get_match_history(
+            model.Server.Europe, 1, profile))
+    return entries, histories
+
+
+def bench_parse(api, profiles):
+    """Time the parsing and measure the memory of the parsed records."""
+    start = time.perf_counter()
+    asyncio.run(parse(api, profiles))
+    duration = time.perf_counter() - start
+
+    tracemalloc.start()
+    records = asyncio.run(parse(api, profiles))
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+    return duration, size
+
+
+def bench_enums(calls):
+    """Time the lookup of enum members from API strings."""
+    timings = {}
+    for cls, values in [
+            (model.Result, ['WIN', 'LOSS', 'TIE', 'OBSERVER']),
+            (model.Race, ['PROTOSS', 'TERRAN', 'ZERG', 'RANDOM']),
+            (model.League, ['BRONZE', 'GOLD', 'DIAMOND', 'GRANDMASTER'])]:
+        values = values * (calls // len(values))
+        get = cls.get
+        start = time.perf_counter()
+        for value in values:
+            get(value)
+        timings[cls.__name__] = time.perf_counter() - start
+    return timings
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--players', type=int, default=10000)
+    parser.add_argument('--ladder-size', type=int, default=100)
+    parser.add_argument('--calls', type=int, default=1000000)
+    args = parser.parse_args()
+
+    ladders, histories = payloads(args.players, args.ladder_size)
+    api = make_api(ladders, histories)
+    duration, size = bench_parse(api, sorted(ladders))
+    print(f'parse {args.players} players: {duration:8.3f} s, '
+          f'{size / 2 ** 20:8.2f} MiB held by records')
+    for name, duration in bench_enums(args.calls).items():
+        print(f'{name}.get x {args.calls}: {duration:8.3f} s')
+
+
+if __name__ == '__main__':
+    main()
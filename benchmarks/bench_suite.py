@@ -0,0 +1,432 @@
+"""Benchmark the hot paths of the collector at several scales.
+
+Runs each benchmark on synthetic inputs at the selected scales and writes
+the timings as JSON, so results of different commits can be compared:
+
+    python benchmarks/bench_suite.py --output base.json
+    python benchmarks/bench_suite.py --compare base.json
+
+Scales are given as players x matches per player (small 100x25, medium
+10kx100, large 100kx1000). Parsing the ladder covers all players, the
+benchmarks running per player use a sample of --sample players and the
+full run against the mock api uses --run-players players. With
+--cassette a run recorded by the sc2monitor (config key cassette) is
+replayed as fast as possible as benchmark replay.
+
+Usage: python benchmarks/bench_suite.py [--scales small,medium]
+           [--only NAME,...] [--repeat N] [--output FILE]
+           [--compare FILE] [--threshold RATIO] [--cassette FILE]
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import sc2monitor.model as model
+from sc2monitor.controller import Controller, RaceUpdate
+from sc2monitor.sc2api import LadderEntry, MatchEntry
+
+# The mock api is kept with the tests, outside of the package.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'test'))
+from mockapi import MockAPI, SyntheticLadder  # noqa: E402
+
+SCALES = {'small': (100, 25), 'medium': (10000, 100),
+          'large': (100000, 1000)}
+START = datetime(2020, 1, 1)
+LADDER_SIZE = 100
+
+
+class Context:
+    """Sizes of a benchmark run at a scale."""
+
+    def __init__(self, scale, players, matches, sample, run_players,
+                 cassette=''):
+        """Init the sizes."""
+        self.scale = scale
+        self.cassette = cassette
+        self.players = players
+        self.matches = matches
+        self.sample = min(sample, players)
+        self.run_players = min(run_players, players)
+        self.rng = random.Random(0)
+
+
+def controller(directory, **config):
+    """Return a controller on a fresh SQLite database."""
+    ctrl = Controller(db=f'sqlite:///{directory}/bench.db', **config)
+    ctrl.create_db_session()
+    return ctrl
+
+
+def seed(ctrl, players, matches):
+    """Add players with matches to the database of a controller."""
+    session = ctrl.db_session
+    rows = [model.Player(player_id=profile, realm=1,
+                         server=model.Server.Europe,
+                         race=model.Race.Zerg, mmr=4000, ladder_id=1,
+                         wins=matches // 2, losses=matches - matches // 2,
+                         last_played=START + timedelta(minutes=10 * matches))
+            for profile in range(1, players + 1)]
+    session.add_all(rows)
+    session.commit()
+    session.execute(model.Match.__table__.insert(), [
+        dict(player_id=player.id,
+             result=model.Result.Win if idx % 2 else model.Result.Loss,
+             datetime=START + timedelta(minutes=10 * idx),
+             mmr=4000 + idx % 50, mmr_change=21, guess=False,
+             ema_mmr=4000.0, emvar_mmr=0.0, max_length=600)
+        for player in rows for idx in range(matches)])
+    session.commit()
+    return rows
+
+
+def entry(mmr=4100, wins=0, losses=0):
+    """Return a ladder entry."""
+    return LadderEntry(mmr=mmr, race=model.Race.Zerg, games=wins + losses,
+                       wins=wins, losses=losses, name='player',
+                       joined=START, ladder_id=1,
+                       league=model.League.Diamond)
+
+
+def timed(function, *args):
+    """Return the duration of a call."""
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def bench_ladder_parsing(ctx, directory):
+    """Parse the ladder of every player."""
+    ctrl = controller(directory)
+    api = ctrl.sc2api
+    races = ['PROTOSS', 'TERRAN', 'ZERG', 'RANDOM']
+    ladders = {}
+    for first in range(1, ctx.players + 1, LADDER_SIZE):
+        teams = [{'teamMembers': [{'id': str(profile), 'realm': 1,
+                                   'displayName': f'player{profile}',
+                                   'favoriteRace': ctx.rng.choice(races)}],
+                  'mmr': ctx.rng.randint(2000, 6000), 'wins': 10,
+                  'losses': 10, 'joinTimestamp': int(START.timestamp())}
+                 for profile in range(
+                     first, min(first + LADDER_SIZE, ctx.players + 1))]
+        teams.sort(key=lambda team: -team['mmr'])
+        for rank, team in enumerate(teams, start=1):
+            ladders[int(team['teamMembers'][0]['id'])] = {
+                'league': 'DIAMOND', 'ladderTeams': teams,
+                'ranksAndPools': [{'rank': rank, 'mmr': team['mmr']}]}
+
+    async def perform_api_request(url, **kwargs):
+        return ladders[int(url.split('/')[-3])], 200
+
+    async def get_access_token():
+        return 'token'
+
+    api._perform_api_request = perform_api_request
+    api.get_access_token = get_access_token
+
+    async def parse():
+        for profile in ladders:
+            async for _ in api._get_ladder_data(
+                    model.Server.Europe, 1, profile, 1):
+                pass
+
+    seconds = timed(asyncio.run, parse())
+    ctrl.close_db_session()
+    return seconds, len(ladders)
+
+
+def bench_check_match_history(ctx, directory):
+    """Assign the match history to the races of players."""
+    ctrl = controller(directory)
+    history = [MatchEntry(model.Result.Win if idx % 2 else model.Result.Loss,
+                          START + timedelta(minutes=10 * idx))
+               for idx in range(ctx.matches, 0, -1)]
+
+    async def get_match_history(player):
+        return history
+
+    ctrl.sc2api.get_match_history = get_match_history
+    players = [[model.Player(id=idx, last_played=START, race=race)
+                for race in (model.Race.Zerg, model.Race.Terran)]
+               for idx in range(ctx.sample)]
+    updates = [[RaceUpdate(player, entry(), ctx.matches // 4,
+                           ctx.matches // 4) for player in races]
+               for races in players]
+
+    async def check():
+        for race_updates in updates:
+            await ctrl.check_match_history(race_updates)
+
+    seconds = timed(asyncio.run, check())
+    ctrl.close_db_session()
+    return seconds, ctx.sample
+
+
+def bench_guess_games(ctx, directory):
+    """Guess the games missing in the match history."""
+    updates = [RaceUpdate(model.Player(id=idx, last_played=START),
+                          entry(), ctx.matches // 2,
+                          ctx.matches - ctx.matches // 2)
+               for idx in range(ctx.sample)]
+    last_played = START + timedelta(days=1)
+    logger = logging.getLogger('sc2monitor.controller')
+    logger.disabled = True
+    try:
+        seconds = timed(lambda: [Controller.guess_games(update, last_played)
+                                 for update in updates])
+    finally:
+        logger.disabled = False
+    return seconds, ctx.sample * ctx.matches
+
+
+def bench_guess_mmr_changes(ctx, directory):
+    """Add the new games of players with their estimated MMR."""
+    ctrl = controller(directory, cache_matches=ctx.matches)
+    players = seed(ctrl, ctx.sample, ctx.matches)
+    ctrl.load_last_matches()
+    new_games = max(1, ctx.matches // 5)
+    updates = []
+    for player in players:
+        update = RaceUpdate(player, entry(4100, new_games, 0), 0, 0)
+        update.wins = new_games
+        update.games = [MatchEntry(model.Result.Win, player.last_played
+                                   + timedelta(minutes=10 * (idx + 1)))
+                        for idx in range(new_games)]
+        updates.append(update)
+    seconds = timed(lambda: [ctrl.guess_mmr_changes(update)
+                             for update in updates])
+    ctrl.close_db_session()
+    return seconds, ctx.sample * new_games
+
+
+def bench_calc_statistics(ctx, directory):
+    """Compute the statistics of players from their matches.
+
+    No window is kept in memory yet, like in every run of a new process.
+    """
+    ctrl = controller(directory, cache_matches=ctx.matches,
+                      analyze_matches=ctx.matches)
+    players = seed(ctrl, ctx.sample, ctx.matches)
+    seconds = timed(lambda: [ctrl.calc_statistics(player)
+                             for player in players])
+    ctrl.close_db_session()
+    return seconds, ctx.sample
+
+
+def bench_calc_statistics_warm(ctx, directory):
+    """Update the statistics of players by a new match each.
+
+    The windows are kept in memory from the previous run (serve mode).
+    """
+    ctrl = controller(directory, cache_matches=ctx.matches + 1,
+                      analyze_matches=ctx.matches)
+    players = seed(ctrl, ctx.sample, ctx.matches)
+    for player in players:
+        ctrl.calc_statistics(player)
+    matches = [model.Match(player=player, result=model.Result.Win,
+                           datetime=player.last_played, mmr=4100,
+                           mmr_change=21, max_length=600)
+               for player in players]
+    ctrl.db_session.add_all(matches)
+    ctrl.db_session.commit()
+    seconds = timed(lambda: [ctrl.calc_statistics(player, [match])
+                             for player, match in zip(players, matches)])
+    ctrl.close_db_session()
+    return seconds, ctx.sample
+
+
+def bench_update_ema_mmr(ctx, directory):
+    """Recompute the exponential moving average MMR of players."""
+    ctrl = controller(directory)
+    players = seed(ctrl, ctx.sample, ctx.matches)
+    seconds = timed(lambda: [ctrl.update_ema_mmr(player)
+                             for player in players])
+    ctrl.close_db_session()
+    return seconds, ctx.sample * ctx.matches
+
+
+def bench_prune_matches(ctx, directory):
+    """Delete the matches of players beyond cache_matches."""
+    keep = max(1, ctx.matches * 4 // 5)
+    ctrl = controller(directory, cache_matches=keep)
+    players = seed(ctrl, ctx.sample, ctx.matches)
+    seconds = timed(lambda: [ctrl.prune_matches(player)
+                             for player in players])
+    ctrl.close_db_session()
+    return seconds, ctx.sample * (ctx.matches - keep)
+
+
+def bench_run(ctx, directory):
+    """Run the collector against the mock api (after a first run)."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    ladder = SyntheticLadder(ctx.run_players, seed=0)
+    ladder.step(120)
+    api = MockAPI(ladder)
+
+    async def run():
+        await api.start(port=port)
+        try:
+            async with Controller(
+                    db=f'sqlite:///{directory}/bench.db', api_key='key',
+                    api_secret='secret',
+                    api_base_url=f'http://127.0.0.1:{port}') as ctrl:
+                for url in ladder.profile_urls():
+                    ctrl.add_player(url)
+                await ctrl.run()
+                ladder.step(60)
+                start = time.perf_counter()
+                await ctrl.run()
+                return time.perf_counter() - start
+        finally:
+            await api.stop()
+
+    return asyncio.run(run()), ctx.run_players
+
+
+def bench_replay(ctx, directory):
+    """Replay a recorded run of the collector (twice, timing the second)."""
+    with gzip.open(ctx.cassette, 'rt', encoding='utf-8') as f:
+        urls = {json.loads(line)['url'] for line in list(f)[1:]}
+    profiles = {tuple(url.split('/')[-5:-2]) for url in urls
+                if url.endswith('/ladder/summary')}
+
+    async def run():
+        async with Controller(
+                db=f'sqlite:///{directory}/bench.db', api_key='key',
+                api_secret='secret', cassette=ctx.cassette,
+                cassette_mode='replay-fast') as ctrl:
+            for region, realm, profile in profiles:
+                ctrl.add_player('https://starcraft2.com/en-gb/profile/'
+                                f'{region}/{realm}/{profile}')
+            await ctrl.run()
+            start = time.perf_counter()
+            await ctrl.run()
+            return time.perf_counter() - start
+
+    return asyncio.run(run()), len(profiles)
+
+
+BENCHMARKS = {name[6:]: function for name, function in globals().items()
+              if name.startswith('bench_')}
+
+
+def commit():
+    """Return the current git commit or None."""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(scales, names, repeat, sample, run_players,
+                   cassette=''):
+    """Run benchmarks and return their results."""
+    results = []
+    for scale in scales:
+        players, matches = SCALES[scale]
+        ctx = Context(scale, players, matches, sample, run_players, cassette)
+        for name in names:
+            timings = []
+            for _ in range(repeat):
+                with tempfile.TemporaryDirectory() as directory:
+                    seconds, items = BENCHMARKS[name](ctx, directory)
+                timings.append(seconds)
+            median = statistics.median(timings)
+            result = dict(name=name, scale=scale, players=players,
+                          matches=matches, items=items,
+                          seconds=timings, best=min(timings), median=median,
+                          per_item=median / items if items else None)
+            results.append(result)
+            print(f'{name:22} {scale:7} {items:9d} items'
+                  f' {median:9.4f} s  {result["per_item"] * 1e6:10.2f}'
+                  ' us/item', file=sys.stderr)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print the ratios to a baseline and return the regressions."""
+    base = {(result['name'], result['scale']): result
+            for result in baseline['results']}
+    regressions = []
+    for result in results:
+        previous = base.get((result['name'], result['scale']))
+        if previous is None or not previous['per_item']:
+            continue
+        ratio = result['per_item'] / previous['per_item']
+        flag = ''
+        if ratio > threshold:
+            flag = '  REGRESSION'
+            regressions.append(result)
+        print(f"{result['name']:22} {result['scale']:7}"
+              f' {ratio:6.2f}x{flag}', file=sys.stderr)
+    return regressions
+
+
+def main():
+    """Run the benchmark suite."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scales', default='small,medium')
+    parser.add_argument('--only', default='')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--sample', type=int, default=200)
+    parser.add_argument('--run-players', type=int, default=500)
+    parser.add_argument('--output', default='')
+    parser.add_argument('--compare', default='')
+    parser.add_argument('--cassette', default='')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='ratio of the time per item to the baseline'
+                        ' reported as regression')
+    args = parser.parse_args()
+
+    scales = args.scales.split(',')
+    names = args.only.split(',') if args.only else [
+        name for name in BENCHMARKS if name != 'replay' or args.cassette]
+    if 'replay' in names and not args.cassette:
+        parser.error('benchmark replay requires --cassette')
+    for value, valid in [(scales, SCALES), (names, BENCHMARKS)]:
+        invalid = set(value) - set(valid)
+        if invalid:
+            parser.error(f"invalid choice {', '.join(sorted(invalid))}"
+                         f" (choose from {', '.join(valid)})")
+
+    results = run_benchmarks(scales, names, args.repeat, args.sample,
+                             args.run_players, args.cassette)
+    report = dict(commit=commit(), datetime=datetime.now().isoformat(),
+                  python=platform.python_version(),
+                  platform=platform.platform(), repeat=args.repeat,
+                  sample=args.sample, run_players=args.run_players,
+                  cassette=args.cassette or None,
+                  results=results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
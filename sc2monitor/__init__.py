@@ -52,8 +52,38 @@ def remove_player(url):
     controller.remove_player(url=url)
 
 
-async def main_loop():
-    """Define the asyncio main loop of the sc2monitor."""
+def recompute_statistics():
+    """Recompute the statistics of all players of the sc2monitor."""
+    kwargs = {}
+    kwargs['db'] = '{protocol}://{user}:{passwd}@{host}/{db}'.format(
+        **db_credentials)
+    controller = Controller(**kwargs)
+    controller.recompute_statistics()
+
+
+def rebuild_ema(period=None):
+    """Recompute the exponential moving average MMR of all matches."""
+    kwargs = {}
+    kwargs['db'] = '{protocol}://{user}:{passwd}@{host}/{db}'.format(
+        **db_credentials)
+    controller = Controller(**kwargs)
+    controller.rebuild_ema(period=period)
+
+
+def reprocess():
+    """Rebuild the matches and statistics of players from snapshots."""
+    kwargs = {}
+    kwargs['db'] = '{protocol}://{user}:{passwd}@{host}/{db}'.format(
+        **db_credentials)
+    controller = Controller(**kwargs)
+    asyncio.run(controller.reprocess())
+
+
+async def main_loop(interval=None, profile=None):
+    """Define the asyncio main loop of the sc2monitor.
+
+    Runs once or, if an interval is given, every interval seconds.
+    """
     kwargs = {}
 
     if db_credentials['passwd'] is not None:
@@ -68,9 +98,17 @@ async def main_loop():
         kwargs['api_secret'] = api_credentials['secret']
 
     async with Controller(**kwargs) as ctrl:
-        await ctrl.run()
+        if interval is None:
+            await ctrl.run(profile=profile)
+        else:
+            await ctrl.serve(interval)
+
+
+def run(profile=None):
+    """Run the sc2monitor, profiled by 'cprofile' or 'sampling' if given."""
+    asyncio.run(main_loop(profile=profile))
 
 
-def run():
-    """Run the sc2monitor."""
-    asyncio.run(main_loop())
+def serve(interval=300):
+    """Run the sc2monitor every interval seconds until interrupted."""
+    asyncio.run(main_loop(interval))
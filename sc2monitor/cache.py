@@ -0,0 +1,151 @@
+"""In-memory caches of database content."""
+import time
+import uuid
+
+from sqlalchemy import event
+
+import sc2monitor.model as model
+
+
+class ConfigCache:
+    """Cache of the config table with write-through and version checks.
+
+    The version is changed once per transaction setting config values,
+    except for internal bookkeeping keys other processes do not need to
+    reload the config for.
+    """
+
+    version_key = 'config_version'
+    internal_keys = frozenset(['retention_checked', 'profile_run',
+                               'access_token'])
+
+    def __init__(self, db_session, ttl=60.0):
+        """Init the cache, the config table is read on first access."""
+        self.db_session = db_session
+        self.ttl = ttl
+        self._values = None
+        self._version = None
+        self._checked = 0.0
+        self._bumped = False
+        event.listen(db_session, 'after_commit', self._end_transaction)
+        event.listen(db_session, 'after_rollback', self._end_transaction)
+
+    def _end_transaction(self, session):
+        self._bumped = False
+
+    def load(self):
+        """Read all config entries with a single query."""
+        self._values = {
+            key: value for key, value in self.db_session.query(
+                model.Config.key, model.Config.value)}
+        self._version = self._values.get(self.version_key)
+        self._checked = time.monotonic()
+
+    def invalidate(self):
+        """Drop the cached entries, they are reloaded on next access."""
+        self._values = None
+        self._version = None
+
+    def refresh(self):
+        """Reload the entries if another process changed the config."""
+        if self._values is None:
+            self.load()
+            return True
+        version = self.db_session.query(model.Config.value).filter(
+            model.Config.key == self.version_key).scalar()
+        self._checked = time.monotonic()
+        if version != self._version:
+            self.load()
+            return True
+        return False
+
+    def get(self, key):
+        """Return a cached config value, raise KeyError if unknown."""
+        if self._values is None:
+            self.load()
+        elif self.ttl is not None \
+                and time.monotonic() - self._checked > self.ttl:
+            self.refresh()
+        return self._values[key]
+
+    def set(self, key, value):
+        """Write a config value through to the session and the cache."""
+        if value is not None:
+            value = str(value)
+        entry = self.db_session.query(
+            model.Config).filter(model.Config.key == key).scalar()
+        if not entry:
+            self.db_session.add(model.Config(key=key, value=value))
+        else:
+            entry.value = value
+        if key not in self.internal_keys and not self._bumped:
+            self._bump_version()
+            self._bumped = True
+        if self._values is not None:
+            self._values[key] = value
+
+    def _bump_version(self):
+        """Mark the config as changed for other processes."""
+        version = uuid.uuid4().hex
+        table = model.Config.__table__
+        updated = self.db_session.execute(
+            table.update().where(table.c.key == self.version_key),
+            {'value': version}).rowcount
+        if not updated:
+            self.db_session.execute(
+                table.insert(), {'key': self.version_key, 'value': version})
+        self._version = version
+        if self._values is not None:
+            self._values[self.version_key] = version
+
+
+class PlayerIndex:
+    """Index of player rows by (player_id, realm, server, race)."""
+
+    def __init__(self, players=()):
+        """Init the index from player rows."""
+        self._races = {}
+        for player in players:
+            self.add(player)
+
+    @staticmethod
+    def identity(player: model.Player):
+        """Return the key shared by all race rows of a player."""
+        return (player.player_id, player.realm, player.server)
+
+    def add(self, player: model.Player):
+        """Add a player row to the index."""
+        self._races.setdefault(
+            self.identity(player), {})[player.race] = player
+
+    def discard(self, player: model.Player):
+        """Remove a player row from the index if present."""
+        races = self._races.get(self.identity(player), {})
+        for race, indexed in list(races.items()):
+            if indexed is player:
+                del races[race]
+        if not races:
+            self._races.pop(self.identity(player), None)
+
+    def change_race(self, player: model.Player, race: model.Race):
+        """Set the race of a player row and move it in the index."""
+        self.discard(player)
+        player.race = race
+        self.add(player)
+
+    def get(self, player_id, realm, server, race):
+        """Return the player row of a race or None."""
+        return self._races.get((player_id, realm, server), {}).get(race)
+
+    def races(self, player: model.Player):
+        """Return all race rows of a player."""
+        return list(self._races.get(self.identity(player), {}).values())
+
+    def players(self):
+        """Return one (the first indexed) row per player."""
+        return [next(iter(races.values()))
+                for races in self._races.values() if races]
+
+    def __len__(self):
+        """Return the number of indexed player rows."""
+        return sum(len(races) for races in self._races.values())
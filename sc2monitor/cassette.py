@@ -0,0 +1,103 @@
+"""Record and replay the api traffic of runs."""
+import asyncio
+import gzip
+import json
+import logging
+from collections import defaultdict, deque
+from datetime import datetime
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_MODES = ['record', 'replay', 'replay-fast']
+CASSETTE_VERSION = 1
+
+# Request parameters that differ between runs and are not recorded.
+_VOLATILE_PARAMS = {'access_token'}
+
+
+def _key(method, url, params):
+    """Return the key of a request, independent of the api host."""
+    params = sorted((key, str(value)) for key, value in (params or {}).items()
+                    if key not in _VOLATILE_PARAMS)
+    return method, urlsplit(url).path, tuple(params)
+
+
+class Cassette:
+    """Gzipped JSON lines of the api requests and responses of a run.
+
+    The first line is a header, every other line holds a request with its
+    decoded response and the time it took including retries. In record
+    mode the path is formatted by strftime, e.g. 'run-%Y%m%d-%H%M.jsonl.gz'
+    keeps a cassette per run. A replay serves the responses in recorded
+    order per request, with the recorded latency or as fast as possible.
+    """
+
+    def __init__(self, path, mode='record'):
+        """Open a cassette for recording or replaying."""
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Invalid cassette mode '{mode}'"
+                             f" (valid modes: {', '.join(CASSETTE_MODES)})")
+        self.mode = mode
+        self.replaying = mode != 'record'
+        self.misses = 0
+        self._file = None
+        self._responses = defaultdict(deque)
+        if self.replaying:
+            self.path = path
+            self._load()
+        else:
+            self.path = datetime.now().strftime(path)
+            self._file = gzip.open(self.path, 'wt', encoding='utf-8')
+            self._write(dict(version=CASSETTE_VERSION,
+                             recorded=datetime.now().isoformat()))
+
+    def _write(self, line):
+        self._file.write(json.dumps(line, separators=(',', ':'),
+                                    default=str))
+        self._file.write('\n')
+
+    def _load(self):
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            if header.get('version') != CASSETTE_VERSION:
+                raise ValueError(f'Unsupported cassette {self.path}')
+            for line in f:
+                interaction = json.loads(line)
+                self._responses[_key(
+                    interaction['method'], interaction['url'],
+                    interaction['params'])].append(interaction)
+
+    def record(self, method, url, params, data, status, elapsed):
+        """Record a request with its decoded response."""
+        data = {key: value for key, value in data.items()
+                if key != 'request_datetime'}
+        self._write(dict(
+            method=method, url=url,
+            params={key: value for key, value in (params or {}).items()
+                    if key not in _VOLATILE_PARAMS},
+            status=status, elapsed=round(elapsed, 6), data=data))
+
+    async def replay(self, method, url, params):
+        """Return the recorded response of a request."""
+        responses = self._responses.get(_key(method, url, params))
+        if not responses:
+            self.misses += 1
+            logger.warning(f'Request not in cassette: {method} {url}')
+            return {}, 404
+        # Repeated requests get the recorded responses in order, the last
+        # one is kept for any further repetitions.
+        interaction = responses[0] if len(responses) == 1 \
+            else responses.popleft()
+        if self.mode == 'replay':
+            await asyncio.sleep(interaction['elapsed'])
+        data = dict(interaction['data'])
+        data['request_datetime'] = datetime.now()
+        return data, interaction['status']
+
+    def close(self):
+        """Finish writing a recorded cassette."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            logger.info(f'Recorded api traffic to {self.path}.')
@@ -1,21 +1,133 @@
 """Control the sc2monitor."""
 import asyncio
 import logging
-import math
 import time
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-from operator import itemgetter
+from operator import attrgetter
 
 import aiohttp
+from sqlalchemy import (String, and_, bindparam, create_engine, func, select,
+                        type_coerce)
+from sqlalchemy.orm import joinedload, selectinload
 
 import sc2monitor.model as model
+import sc2monitor.retention as retention
+import sc2monitor.tracing as tracing
+from sc2monitor.cache import ConfigCache, PlayerIndex
+from sc2monitor.exporter import Exporter
 from sc2monitor.handlers import SQLAlchemyHandler
-from sc2monitor.sc2api import SC2API
+from sc2monitor.metrics import RunMetrics
+from sc2monitor.outbox import Outbox
+from sc2monitor.profiling import create_profiler
+from sc2monitor.push import PushServer
+from sc2monitor.sc2api import SC2API, LadderEntry, MatchEntry
+from sc2monitor.snapshots import SnapshotStore, decode
+from sc2monitor.statistics import (RollingStatistics, compute_bulk_ema,
+                                   compute_bulk_statistics,
+                                   compute_horizons, compute_statistics,
+                                   ema_alpha, parse_horizons,
+                                   same_statistics, statistics_values,
+                                   update_ema)
 
 logger = logging.getLogger(__name__)
 sql_logger = logging.getLogger()
 
 
+class RaceUpdate:
+    """Work item of the new matches of a race of a player."""
+
+    __slots__ = ('player', 'entry', 'missing_wins', 'missing_losses',
+                 'wins', 'losses', 'games')
+
+    def __init__(self, player: model.Player, entry: LadderEntry,
+                 missing_wins, missing_losses):
+        """Init the work item with the games missing in the database."""
+        self.player = player
+        self.entry = entry
+        self.missing_wins = missing_wins
+        self.missing_losses = missing_losses
+        self.wins = 0
+        self.losses = 0
+        self.games = []
+
+    @property
+    def missing_total(self):
+        """Return the number of missing games."""
+        return self.missing_wins + self.missing_losses
+
+    def missing(self, result: model.Result):
+        """Return the number of missing games with a result."""
+        if result is model.Result.Win:
+            return self.missing_wins
+        elif result is model.Result.Loss:
+            return self.missing_losses
+        return 0
+
+    def assign(self, result: model.Result):
+        """Count a missing game with a result as found."""
+        if result is model.Result.Win:
+            self.missing_wins -= 1
+            self.wins += 1
+        elif result is model.Result.Loss:
+            self.missing_losses -= 1
+            self.losses += 1
+
+
+# Engines of the worker processes of bulk jobs by database url.
+_engines = {}
+
+
+def _engine(bind):
+    """Return the engine of a database url or the given engine."""
+    if not isinstance(bind, str):
+        return bind
+    if bind not in _engines:
+        _engines[bind] = create_engine(bind)
+    return _engines[bind]
+
+
+def _statistics_range(bind, first, last, size):
+    """Read the matches of a range of player ids and compute statistics."""
+    match = model.Match.__table__
+    player = model.Player.__table__
+    with _engine(bind).connect() as connection:
+        rows = connection.execute(
+            select([match.c.player_id, match.c.mmr,
+                    # Skip the conversion into enum members per row.
+                    type_coerce(match.c.result, String),
+                    match.c.guess, match.c.max_length]).where(
+                match.c.player_id.between(first, last)).order_by(
+                match.c.player_id, match.c.datetime.desc(),
+                match.c.id.desc())).fetchall()
+        current_mmrs = dict(connection.execute(
+            select([player.c.id, player.c.mmr]).where(
+                player.c.id.between(first, last))).fetchall())
+    if not rows:
+        return {}
+    return compute_bulk_statistics(
+        *Controller._statistics_partition(rows, size, current_mmrs))
+
+
+def _ema_range(bind, first, last, alpha):
+    """Read the matches of a range of player ids and compute the EMA."""
+    match = model.Match.__table__
+    with _engine(bind).connect() as connection:
+        rows = connection.execute(
+            select([match.c.id, match.c.player_id, match.c.mmr]).where(
+                match.c.player_id.between(first, last)).order_by(
+                match.c.player_id, match.c.datetime,
+                match.c.id)).fetchall()
+    if not rows:
+        return array('q'), [], []
+    ids, player_ids, mmrs = zip(*rows)
+    emas, emvars = compute_bulk_ema(
+        array('q', player_ids), array('q', mmrs), alpha)
+    return array('q', ids), emas, emvars
+
+
 class Controller:
     """Control the sc2monitor."""
 
@@ -24,7 +136,17 @@ class Controller:
         self.kwargs = kwargs
         self.sc2api = None
         self.db_session = None
+        self.config = None
+        self.player_index = None
+        self.last_match = None
+        self.rolling_statistics = {}
         self.current_season = {}
+        self.metrics = RunMetrics()
+        self.exporter = Exporter(self)
+        self.tracer = tracing.Tracer()
+        self.snapshots = None
+        self.outbox = Outbox(self)
+        self.push = PushServer()
 
     async def __aenter__(self):
         """Create a aiohttp and db session that will later be closed."""
@@ -38,6 +160,10 @@ class Controller:
         self.db_session = model.create_db_session(
             db=self.kwargs.pop('db', ''),
             encoding=self.kwargs.pop('encoding', ''))
+        self.exporter.watch(self.db_session)
+        self.outbox.watch(self.db_session)
+        self.config = ConfigCache(self.db_session)
+        self.config.load()
         self.handler = SQLAlchemyHandler(self.db_session)
         self.handler.setLevel(logging.INFO)
         sql_logger.setLevel(logging.INFO)
@@ -46,6 +172,10 @@ class Controller:
         if len(self.kwargs) > 0:
             self.setup(**self.kwargs)
         self.sc2api = SC2API(self)
+        self.read_config()
+
+    def read_config(self):
+        """Read the controller settings from the config."""
         self.cache_matches = self.get_config(
             'cache_matches',
             default_value=1000)
@@ -58,10 +188,94 @@ class Controller:
         self.analyze_matches = self.get_config(
             'analyze_matches',
             default_value=100)
+        self.ema_alpha = ema_alpha(self.get_config(
+            'ema_period',
+            default_value=100))
+        self.statistics_horizons = parse_horizons(self.get_config(
+            'statistics_horizons',
+            default_value=''))
+        self.verify_statistics = str(self.get_config(
+            'verify_statistics',
+            default_value='')).lower() in ['1', 'true', 'yes']
+        self.analytics_processes = int(self.get_config(
+            'analytics_processes',
+            default_value=1))
+        self.max_age_logs = float(self.get_config(
+            'max_age_logs',
+            default_value=0))
+        self.max_age_runs = float(self.get_config(
+            'max_age_runs',
+            default_value=0))
+        self.max_age_events = float(self.get_config(
+            'max_age_events',
+            default_value=0))
+        self.retention_interval = float(self.get_config(
+            'retention_interval',
+            default_value=3600))
+        self.retention_partitions = str(self.get_config(
+            'retention_partitions',
+            default_value='')).lower() in ['1', 'true', 'yes']
+        self.metrics_host = self.get_config(
+            'metrics_host',
+            default_value='127.0.0.1')
+        self.metrics_port = int(self.get_config(
+            'metrics_port',
+            default_value=0))
+        self.metrics_textfile = self.get_config(
+            'metrics_textfile',
+            default_value='')
+        self.exporter.player_age = str(self.get_config(
+            'metrics_player_age',
+            default_value='')).lower() in ['1', 'true', 'yes']
+        self.profile_run = self.get_config(
+            'profile_run',
+            default_value='')
+        self.profile_dir = self.get_config(
+            'profile_dir',
+            default_value='')
+        self.profile_top = int(self.get_config(
+            'profile_top',
+            default_value=20))
+        self.tracer.path = self.get_config(
+            'trace_file',
+            default_value='')
+        self.tracer.sample_rate = float(self.get_config(
+            'trace_sample_rate',
+            default_value=0.1))
+        self.tracer.slow_seconds = float(self.get_config(
+            'trace_slow_seconds',
+            default_value=5.0))
+        if str(self.get_config(
+                'snapshots',
+                default_value='')).lower() in ['1', 'true', 'yes']:
+            self.snapshots = SnapshotStore(self.db_session)
+        else:
+            self.snapshots = None
+        self.outbox.enabled = str(self.get_config(
+            'outbox',
+            default_value='')).lower() in ['1', 'true', 'yes']
+        self.push_host = self.get_config(
+            'push_host',
+            default_value='127.0.0.1')
+        self.push_port = int(self.get_config(
+            'push_port',
+            default_value=0))
+        self.push.hub.queue_size = int(self.get_config(
+            'push_queue_size',
+            default_value=100))
 
     async def __aexit__(self, exc_type, exc, tb):
         """Close all aiohtto and database session."""
         await self.http_session.close()
+        self.close_db_session()
+
+    def close_db_session(self):
+        """Write buffered logs and close the database session."""
+        sql_logger.removeHandler(self.handler)
+        # Release the lock of SQLite before the handler writes, and commit
+        # its records written with the session of an in-memory database.
+        self.db_session.commit()
+        self.handler.close()
         self.db_session.commit()
         self.db_session.close()
         self.db_session = None
@@ -69,12 +283,18 @@ class Controller:
     def get_config(self, key, default_value=None,
                    raise_key_error=True,
                    return_object=False):
-        """Read a config value from database."""
+        """Read a config value from the config cache."""
         if default_value is not None:
             raise_key_error = False
-        entry = self.db_session.query(
-            model.Config).filter(model.Config.key == key).scalar()
-        if not entry:
+        if return_object:
+            entry = self.db_session.query(
+                model.Config).filter(model.Config.key == key).scalar()
+        else:
+            try:
+                entry = self.config.get(key)
+            except KeyError:
+                entry = None
+        if entry is None:
             if raise_key_error:
                 raise ValueError(f'Unknown config key "{key}"')
             else:
@@ -83,26 +303,34 @@ class Controller:
                 else:
                     return '' if default_value is None else default_value
         else:
-            if return_object:
-                return entry
-            else:
-                return entry.value
+            return entry
 
     def set_config(self, key, value, commit=True):
-        """Save a config value to the database."""
-        entry = self.db_session.query(
-            model.Config).filter(model.Config.key == key).scalar()
-        if not entry:
-            self.db_session.add(model.Config(key=key, value=value))
-        else:
-            entry.value = value
+        """Save a config value to the database and the config cache."""
+        self.config.set(key, value)
         if commit:
             self.db_session.commit()
 
+    def invalidate_config(self):
+        """Drop cached config values, e.g. after external changes."""
+        self.config.invalidate()
+
     def setup(self, **kwargs):
         """Set up the sc2monitor with api-key and api-secret."""
         valid_keys = ['api_key', 'api_secret',
-                      'cache_matches', 'analyze_matches']
+                      'cache_matches', 'analyze_matches',
+                      'ema_period', 'statistics_horizons',
+                      'verify_statistics', 'analytics_processes',
+                      'json_decoder', 'cache_logs', 'cache_runs',
+                      'max_age_logs', 'max_age_runs', 'retention_interval',
+                      'retention_partitions', 'metrics_host', 'metrics_port',
+                      'metrics_textfile', 'metrics_player_age',
+                      'profile_run', 'profile_dir',
+                      'profile_top', 'trace_file', 'trace_sample_rate',
+                      'trace_slow_seconds', 'api_base_url', 'cassette',
+                      'cassette_mode', 'snapshots', 'outbox',
+                      'max_age_events', 'push_host', 'push_port',
+                      'push_queue_size']
         for key, value in kwargs.items():
             if key not in valid_keys:
                 raise ValueError(
@@ -111,6 +339,7 @@ class Controller:
             self.set_config(key, value, commit=False)
         self.db_session.commit()
         if self.sc2api:
+            self.read_config()
             self.sc2api.read_config()
 
     def add_player(self, url, race=model.Race['Random']):
@@ -132,10 +361,11 @@ class Controller:
                 race=race)
             self.db_session.add(new_player)
             self.db_session.commit()
+            if self.player_index is not None:
+                self.player_index.add(new_player)
 
         if close_db:
-            self.db_session.close()
-            self.db_session = None
+            self.close_db_session()
 
     def remove_player(self, url):
         """Remove a player by url to the sc2monitor."""
@@ -150,12 +380,14 @@ class Controller:
                 model.Player.player_id == player_id,
                 model.Player.server == server).all():
             self.db_session.delete(player)
+            self.rolling_statistics.pop(player.id, None)
+            if self.player_index is not None:
+                self.player_index.discard(player)
 
         self.db_session.commit()
 
         if close_db:
-            self.db_session.close()
-            self.db_session = None
+            self.close_db_session()
 
     async def update_season(self, server: model.Server):
         """Update info about the current season in the database."""
@@ -202,213 +434,409 @@ class Controller:
 
     async def query_player(self, player: model.Player):
         """Collect api data of a player."""
-        complete_data = []
-        for ladder in await self.sc2api.get_ladders(player):
-            async for data in self.sc2api.get_ladder_data(player, ladder):
-                current_player = await self.get_player_with_race(player, data)
-                missing_games, new = self.count_missing_games(
-                    current_player, data)
-                if missing_games['Total'] > 0:
-                    complete_data.append({'player': current_player,
-                                          'new_data': data,
-                                          'missing': missing_games,
-                                          'Win': 0,
-                                          'Loss': 0})
-
-        if len(complete_data) > 0:
-            await self.process_player(complete_data, new)
-        elif (not player.name
-                or not isinstance(player.refreshed, datetime)
-                or player.refreshed <= datetime.now() - timedelta(days=1)):
-            await self.update_player_name(player)
+        with self.tracer.trace(player.id):
+            # Players without ladder data so far start their snapshots.
+            base = player.ladder_id == 0
+            entries = []
+            ladders = await self.sc2api.get_ladders(player)
+            for ladder in ladders:
+                async for entry in self.sc2api.get_ladder_data(
+                        player, ladder):
+                    entries.append(entry)
+            updates, new = await self.collect_updates(player, entries)
+            tracing.tag(ladders=len(ladders), updates=len(updates))
+
+            # The snapshot keeps the time guesses are relative to.
+            now = datetime.now()
+            match_history = None
+            if len(updates) > 0:
+                match_history = await self.process_player(
+                    updates, new, now=now)
+            elif (not player.name
+                    or not isinstance(player.refreshed, datetime)
+                    or player.refreshed
+                    <= datetime.now() - timedelta(days=1)):
+                await self.update_player_name(player)
+            season = self.current_season.get(player.server.id())
+            if self.snapshots is not None and season is None:
+                logger.warning(f'{player.id}: No snapshot without the'
+                               ' current season.')
+            elif self.snapshots is not None:
+                self.snapshots.add(player, season.season_id, entries,
+                                   match_history, base, now,
+                                   processed=len(updates) > 0)
+        self.exporter.player_done(player.id, len(updates) > 0)
+
+    async def collect_updates(self, player: model.Player, entries):
+        """Return the races of a player with games missing in the database.
+
+        The flag whether the player is new is the one of the last entry.
+        """
+        updates = []
+        new = False
+        for entry in entries:
+            current_player = await self.get_player_with_race(player, entry)
+            missing_wins, missing_losses, new = \
+                self.count_missing_games(current_player, entry)
+            if missing_wins + missing_losses > 0:
+                updates.append(RaceUpdate(
+                    current_player, entry, missing_wins, missing_losses))
+        return updates, new
 
     async def update_player_name(self, player: model.Player, name=''):
         """Update the name of a player from api data."""
+        with tracing.span('update_player_name'):
+            await self._update_player_name(player, name)
+
+    async def _update_player_name(self, player: model.Player, name=''):
         if not name:
             metadata = await self.sc2api.get_metadata(player)
             name = metadata['name']
-        for tmp_player in self.db_session.query(model.Player).filter(
+        if self.player_index is not None:
+            race_players = [tmp_player for tmp_player
+                            in self.player_index.races(player)
+                            if tmp_player.name != name]
+        else:
+            race_players = self.db_session.query(model.Player).filter(
                 model.Player.player_id == player.player_id,
                 model.Player.realm == player.realm,
                 model.Player.server == player.server,
-                model.Player.name != name).all():
+                model.Player.name != name).all()
+        for tmp_player in race_players:
             logger.info(f"{tmp_player.id}: Updating name to '{name}'")
+            self.outbox.name(tmp_player, name)
             tmp_player.name = name
         self.db_session.commit()
 
-    async def check_match_history(self, complete_data):
+    async def check_match_history(self, updates, match_history=None,
+                                  now=None):
         """Check matches in match history and assign them to races."""
-        match_history = await self.sc2api.get_match_history(
-            complete_data[0]['player'])
+        if match_history is None:
+            match_history = await self.sc2api.get_match_history(
+                updates[0].player)
 
         for match in match_history:
             positive = []
-            for data_key, data in enumerate(complete_data):
-                needed = data['missing'].get(match['result'].describe(), 0) > 0
+            for update in updates:
+                needed = update.missing(match.result) > 0
                 try:
-                    datetime_check = (match['datetime']
-                                      - data['player'].last_played
+                    datetime_check = (match.datetime
+                                      - update.player.last_played
                                       > timedelta(seconds=0))
                 except TypeError:
                     datetime_check = True
                 if (needed and datetime_check):
-                    positive.append(data_key)
+                    positive.append(update)
             if len(positive) == 0:
                 continue
             elif len(positive) >= 1:
                 # Choose the race with most missing results.
                 max_missing = 0
-                for key in positive:
-                    tmp_missing = complete_data[key][
-                        'missing'][match['result'].describe()]
+                for update in positive:
+                    tmp_missing = update.missing(match.result)
                     if tmp_missing > max_missing:
-                        data_key = key
+                        chosen = update
                         max_missing = tmp_missing
 
-                complete_data[data_key][
-                    'missing'][match['result'].describe()] -= 1
-                complete_data[data_key][match['result'].describe()] += 1
-                try:
-                    complete_data[data_key]['games'].insert(0, match)
-                except KeyError:
-                    complete_data[data_key]['games'] = [match]
+                chosen.assign(match.result)
+                chosen.games.insert(0, match)
 
         try:
-            last_played = match['datetime']
+            last_played = match.datetime
         except Exception:
-            last_played = datetime.now()
+            last_played = now or datetime.now()
 
         return last_played, len(match_history)
 
-    async def process_player(self, complete_data, new=False):
-        """Process the api data of a player."""
-        last_played, len_history \
-            = await self.check_match_history(complete_data)
-
-        for race_player in complete_data:
-            race_player['missing']['Total'] = race_player['missing']['Win'] + \
-                race_player['missing']['Loss']
-            if race_player['missing']['Total'] > 0:
+    async def process_player(self, updates, new=False, match_history=None,
+                             now=None):
+        """Process the api data of a player.
+
+        The match history is requested unless given and returned. Guesses
+        that have no match to refer to are relative to now.
+        """
+        with tracing.span('check_match_history'):
+            if match_history is None:
+                match_history = await self.sc2api.get_match_history(
+                    updates[0].player)
+            last_played, len_history \
+                = await self.check_match_history(updates, match_history, now)
+
+        for update in updates:
+            race_player = update.player.id
+            if update.missing_total > 0:
                 if new:
                     logger.info(
-                        f"{race_player['player'].id}: Ignoring "
-                        f"{race_player['missing']['Total']} games missing in"
+                        f"{update.player.id}: Ignoring "
+                        f"{update.missing_total} games missing in"
                         f" match history ({len_history}) "
                         "of new player.")
                 else:
-                    self.guess_games(race_player, last_played)
-            self.guess_mmr_changes(race_player)
-            await self.update_player(race_player)
-            self.calc_statistics(race_player['player'])
-
-    async def update_player(self, complete_data):
+                    with tracing.span('guess_games', player=race_player,
+                                      missing=update.missing_total):
+                        self.guess_games(update, last_played, now)
+            with self.metrics.phase('guess_mmr_changes'), \
+                    tracing.span('guess_mmr_changes', player=race_player):
+                new_matches = self.guess_mmr_changes(update)
+            with self.metrics.phase('update_player'), \
+                    tracing.span('update_player', player=race_player):
+                await self.update_player(update)
+            with self.metrics.phase('statistics'), \
+                    tracing.span('calc_statistics', player=race_player,
+                                 matches=len(new_matches)):
+                self.calc_statistics(update.player, new_matches)
+                self.calc_horizon_statistics(update.player)
+        return match_history
+
+    async def update_player(self, update):
         """Update database with new data of a player."""
-        player = complete_data['player']
-        new_data = complete_data['new_data']
-        player.mmr = new_data['mmr']
-        player.ladder_id = new_data['ladder_id']
-        player.league = new_data['league']
-        player.ladder_joined = new_data['joined']
-        player.wins = new_data['wins']
-        player.losses = new_data['losses']
+        player = update.player
+        entry = update.entry
+        self.outbox.mmr(player, entry.mmr)
+        self.outbox.league(player, entry.league)
+        player.mmr = entry.mmr
+        player.ladder_id = entry.ladder_id
+        player.league = entry.league
+        player.ladder_joined = entry.joined
+        player.wins = entry.wins
+        player.losses = entry.losses
         player.last_active_season = self.get_season_id(player.server)
-        if player.name != new_data['name']:
+        if player.name != entry.name:
             await self.update_player_name(
                 player,
-                new_data['name'])
+                entry.name)
         if (not player.last_played
                 or player.ladder_joined
                 > player.last_played):
             player.last_played = player.ladder_joined
         self.db_session.commit()
 
-    def calc_statistics(self, player: model.Player):
-        """Recalculate player statistics."""
-        self.db_session.refresh(player)
+    def calc_statistics(self, player: model.Player, new_matches=None):
+        """Update player statistics with new matches."""
         if not player.statistics:
             stats = model.Statistics(player=player)
             self.db_session.add(stats)
-            self.db_session.commit()
-            self.db_session.refresh(stats)
         else:
             stats = player.statistics
 
-        matches = self.db_session.query(model.Match).filter(
-            model.Match.player_id == player.id).order_by(
-            model.Match.datetime.desc()).limit(self.analyze_matches).all()
-
-        stats.games_available = len(matches)
-        wma_mmr_denominator = stats.games_available * \
-            (stats.games_available + 1.0) / 2.0
-        stats.max_mmr = player.mmr
-        stats.min_mmr = player.mmr
-        stats.current_mmr = player.mmr
-        wma_mmr = 0.0
-        expected_mmr_value = 0.0
-        expected_mmr_value2 = 0.0
-        current_wining_streak = 0
-        current_losing_streak = 0
-
-        for idx, match in enumerate(matches):
-            if match.result == model.Result.Win:
-                stats.wins += 1
-                current_wining_streak += 1
-                current_losing_streak = 0
-                if current_wining_streak > stats.longest_wining_streak:
-                    stats.longest_wining_streak = current_wining_streak
-            elif match.result == model.Result.Loss:
-                stats.losses += 1
-                current_losing_streak += 1
-                current_wining_streak = 0
-                if current_losing_streak > stats.longest_losing_streak:
-                    stats.longest_losing_streak = current_losing_streak
-                if match.max_length <= 120:
-                    stats.instant_left_games += 1
-
-            if match.guess:
-                stats.guessed_games += 1
-
-            mmr = match.mmr
-            wma_mmr += mmr * \
-                (stats.games_available - idx) / wma_mmr_denominator
-            if stats.max_mmr < mmr:
-                stats.max_mmr = mmr
-            if stats.min_mmr > mmr:
-                stats.min_mmr = mmr
-            expected_mmr_value += mmr / stats.games_available
-            expected_mmr_value2 += mmr * (mmr / stats.games_available)
-
-        if stats.games_available <= 1:
-            stats.lr_mmr_slope = 0.0
-            stats.lr_mmr_intercept = expected_mmr_value
+        window = self.get_rolling_statistics(player, new_matches)
+        values = window.values(player.mmr)
+        if self.verify_statistics:
+            expected = compute_statistics(
+                self.get_recent_matches(player, window.size), player.mmr)
+            if not same_statistics(values, expected):
+                logger.warning(f'{player.id}: Incremental statistics differ'
+                               ' from full recompute.')
+                values = expected
+                del self.rolling_statistics[player.id]
+
+        for key, value in values.items():
+            setattr(stats, key, value)
+
+        self.db_session.commit()
+
+    def calc_horizon_statistics(self, player: model.Player):
+        """Update player statistics over the configured horizons.
+
+        Horizons up to analyze_matches are derived from the rolling window
+        of calc_statistics. Otherwise the matches are read from the
+        database, up to the largest horizon or, for 'season', up to
+        cache_matches rows per updated player.
+        """
+        if not self.statistics_horizons:
+            return
+
+        limits = [horizon for horizon in self.statistics_horizons
+                  if horizon != 'season']
+        window = self.rolling_statistics.get(player.id)
+        if (window is not None and limits == self.statistics_horizons
+                and max(limits) <= window.size):
+            values = window.horizons(player.mmr, limits)
         else:
-            ybar = expected_mmr_value
-            xbar = -0.5 * (stats.games_available - 1)
-            numerator = 0
-            denominator = 0
-            for x, match in enumerate(matches):
-                x = -x
-                y = match.mmr
-                numerator += (x - xbar) * (y - ybar)
-                denominator += (x - xbar) * (x - xbar)
-
-            stats.lr_mmr_slope = numerator / denominator
-            stats.lr_mmr_intercept = ybar - stats.lr_mmr_slope * xbar
-
-        stats.sd_mmr = round(
-            math.sqrt(expected_mmr_value2
-                      - expected_mmr_value
-                      * expected_mmr_value))
-        # critical_idx = min(self.controller.config['no_critical_games'],
-        #                   stats.games_available) - 1
-        # stats.critical_game_played = matches[critical_idx]["played"]
-        stats.avg_mmr = expected_mmr_value
-        stats.wma_mmr = wma_mmr
+            season_start = None
+            if 'season' in self.statistics_horizons:
+                limits.append(int(self.cache_matches))
+                season = self.current_season.get(player.server.id())
+                if season is not None:
+                    season_start = season.start
+            matches = self.get_recent_matches(player, max(limits))
+            values = compute_horizons(
+                matches, player.mmr, self.statistics_horizons, season_start)
+
+        configured = {str(horizon) for horizon in self.statistics_horizons}
+        rows = {row.horizon: row for row in player.horizon_statistics}
+        for horizon, horizon_values in values.items():
+            row = rows.pop(horizon, None)
+            if row is None:
+                row = model.HorizonStatistics(player=player, horizon=horizon)
+                self.db_session.add(row)
+            for key, value in horizon_values.items():
+                setattr(row, key, value)
+        for horizon, row in rows.items():
+            # Delete the horizons not configured anymore, but keep those
+            # not computed this time, e.g. the season while it is unknown.
+            if horizon not in configured:
+                self.db_session.delete(row)
 
         self.db_session.commit()
 
+    def recompute_statistics(self, chunk_size=100000, processes=None):
+        """Recompute the statistics of all players in bulk.
+
+        The matches are read and computed in partitions of whole players of
+        about chunk_size matches (see _map_partitions).
+        """
+        close_db = False
+        if self.db_session is None:
+            self.create_db_session()
+            close_db = True
+
+        size = min(int(self.analyze_matches), int(self.cache_matches))
+        current_mmrs = dict(self.db_session.query(
+            model.Player.id, model.Player.mmr))
+        bind, processes = self._analytics_bind(processes)
+        partitions = ((None, (bind, first, last, size))
+                      for first, last in self._player_ranges(chunk_size))
+
+        statistics = {}
+        for _, values in self._map_partitions(
+                _statistics_range, partitions, processes):
+            statistics.update(values)
+
+        for player_id, current_mmr in current_mmrs.items():
+            if player_id not in statistics:
+                statistics[player_id] = statistics_values(
+                    0, 0, 0, 0, None, None, current_mmr)
+
+        statistics_ids = dict(self.db_session.query(
+            model.Statistics.player_id, model.Statistics.id))
+        updates = []
+        inserts = []
+        for player_id, values in statistics.items():
+            if player_id in statistics_ids:
+                updates.append(dict(values, id=statistics_ids[player_id]))
+            else:
+                inserts.append(dict(values, player_id=player_id))
+        self.db_session.bulk_update_mappings(model.Statistics, updates)
+        self.db_session.bulk_insert_mappings(model.Statistics, inserts)
+        self.db_session.commit()
+        self.db_session.expire_all()
+        self.rolling_statistics.clear()
+        logger.info(f'Recomputed statistics of {len(statistics)} players.')
+
+        if close_db:
+            self.close_db_session()
+
+    @staticmethod
+    def _statistics_partition(rows, size, current_mmrs):
+        """Pack match rows grouped by player into compact columns."""
+        player_ids, mmrs, results, guesses, max_lengths = zip(*rows)
+        values = {result.name: result.value for result in model.Result}
+        return (array('q', player_ids), array('q', mmrs),
+                array('b', map(values.__getitem__, results)),
+                array('b', guesses), array('q', max_lengths),
+                {player_id: current_mmrs.get(player_id)
+                 for player_id in set(player_ids)},
+                size)
+
+    def _analytics_bind(self, processes=None):
+        """Return the database of bulk jobs and the number of processes.
+
+        Worker processes get the database url to connect on their own,
+        except for an in-memory SQLite database only this process knows.
+        """
+        if processes is None:
+            processes = self.analytics_processes
+        engine = self.db_session.get_bind()
+        if processes <= 1:
+            return engine, 1
+        if engine.dialect.name == 'sqlite' \
+                and engine.url.database in (None, '', ':memory:'):
+            logger.warning('Worker processes cannot read an in-memory'
+                           ' database, computing in process.')
+            return engine, 1
+        return str(engine.url), processes
+
+    def _player_ranges(self, chunk_size):
+        """Return ranges of player ids with about chunk_size matches each."""
+        match = model.Match.__table__
+        ranges = []
+        first = None
+        matches = 0
+        for player_id, count in self.db_session.execute(
+                select([match.c.player_id, func.count(match.c.id)]).
+                group_by(match.c.player_id).order_by(match.c.player_id)):
+            if first is None:
+                first = player_id
+            matches += count
+            if matches >= chunk_size:
+                ranges.append((first, player_id))
+                first = None
+                matches = 0
+        if first is not None:
+            ranges.append((first, player_id))
+        return ranges
+
+    def _map_partitions(self, function, partitions, processes=1):
+        """Apply a function to (key, args) partitions, yield (key, result).
+
+        With more than one process the partitions are read and computed by
+        a pool of worker processes, each connected to the database on its
+        own, while results are yielded in order to the caller, which does
+        all writes.
+        """
+        if processes <= 1:
+            for key, args in partitions:
+                yield key, function(*args)
+            return
+
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            # Bound the partitions in flight to keep memory bounded.
+            pending = deque()
+            for key, args in partitions:
+                pending.append((key, executor.submit(function, *args)))
+                if len(pending) >= 2 * processes:
+                    key, future = pending.popleft()
+                    yield key, future.result()
+            while pending:
+                key, future = pending.popleft()
+                yield key, future.result()
+
+    def get_recent_matches(self, player: model.Player, limit):
+        """Get the most recent matches of a player, newest first."""
+        return self.db_session.query(model.Match).filter(
+            model.Match.player_id == player.id).order_by(
+            model.Match.datetime.desc(),
+            model.Match.id.desc()).limit(limit).all()
+
+    def get_rolling_statistics(self, player: model.Player, new_matches=None):
+        """Get the window of recent matches of a player up to date."""
+        size = min(int(self.analyze_matches), int(self.cache_matches))
+        window = self.rolling_statistics.get(player.id)
+        if (window is None or window.size != size or new_matches is None
+                or not window.is_older(new_matches)):
+            window = RollingStatistics(size)
+            for match in reversed(self.get_recent_matches(player, size)):
+                window.push_match(match)
+            self.rolling_statistics[player.id] = window
+        else:
+            for match in new_matches:
+                window.push_match(match)
+        return window
+
+    def check_rolling_statistics(self):
+        """Drop windows whose matches were changed outside this process."""
+        for player_id, window in list(self.rolling_statistics.items()):
+            last_match = self.last_match.get(player_id)
+            if last_match is None:
+                newest = None
+            else:
+                newest = (last_match.id, last_match.datetime)
+            if window.newest != newest:
+                del self.rolling_statistics[player_id]
+
     @classmethod
-    def guess_games(cls, complete_data, last_played):
+    def guess_games(cls, update, last_played, now=None):
         """Guess games of a player if missing in match history."""
         # If a player isn't new in the database and has played more
         # than 25 games since the last refresh or the match
@@ -416,18 +844,16 @@ class Controller:
         # missing games in the match history. These are guessed to be very
         # close to the last game of the match history and in alternating
         # order.
-        player = complete_data['player']
-        if 'games' not in complete_data:
-            complete_data['games'] = []
+        player = update.player
 
         logger.info((
             "{}: {} missing games in match "
             + "history - more guessing!").format(
-            player.id, complete_data['missing']['Total']))
+            player.id, update.missing_total))
 
         try:
             delta = (last_played - player.last_played) / \
-                complete_data['missing']['Total']
+                update.missing_total
         except Exception:
             delta = timedelta(minutes=3)
 
@@ -435,64 +861,57 @@ class Controller:
             delta = timedelta(minutes=3)
 
         if delta.total_seconds() <= 0:
-            last_played = datetime.now()
+            last_played = now or datetime.now()
             delta = timedelta(minutes=3)
 
-        while (complete_data['missing']['Win'] > 0
-               or complete_data['missing']['Loss'] > 0):
+        while update.missing_wins > 0 or update.missing_losses > 0:
 
-            if complete_data['missing']['Win'] > 0:
+            if update.missing_wins > 0:
                 last_played = last_played - delta
-                complete_data['games'].append(
-                    {'datetime': last_played, 'result': model.Result.Win})
-                complete_data['missing']['Win'] -= 1
-                complete_data['Win'] += 1
-
-            if (complete_data['missing']['Win'] > 0
-                    and complete_data['missing']['Win']
-                    > complete_data['missing']['Loss']):
+                update.games.append(
+                    MatchEntry(model.Result.Win, last_played))
+                update.assign(model.Result.Win)
+
+            if (update.missing_wins > 0
+                    and update.missing_wins > update.missing_losses):
                 # If there are more wins than losses add
                 # a second win before the next loss.
                 last_played = last_played - delta
-                complete_data['games'].append(
-                    {'datetime': last_played, 'result': model.Result.Win})
-                complete_data['missing']['Win'] -= 1
-                complete_data['Win'] += 1
+                update.games.append(
+                    MatchEntry(model.Result.Win, last_played))
+                update.assign(model.Result.Win)
 
-            if complete_data['missing']['Loss'] > 0:
+            if update.missing_losses > 0:
                 last_played = last_played - delta
-                complete_data['games'].append(
-                    {'datetime': last_played, 'result': model.Result.Loss})
-                complete_data['missing']['Loss'] -= 1
-                complete_data['Loss'] += 1
-
-            if (complete_data['missing']['Loss'] > 0
-                    and complete_data['missing']['Win']
-                    < complete_data['missing']['Loss']):
+                update.games.append(
+                    MatchEntry(model.Result.Loss, last_played))
+                update.assign(model.Result.Loss)
+
+            if (update.missing_losses > 0
+                    and update.missing_wins < update.missing_losses):
                 # If there are more losses than wins add second loss before
                 # the next win.
                 last_played = last_played - delta
-                complete_data['games'].append(
-                    {'datetime': last_played, 'result': model.Result.Loss})
-                complete_data['missing']['Loss'] -= 1
-                complete_data['Loss'] += 1
+                update.games.append(
+                    MatchEntry(model.Result.Loss, last_played))
+                update.assign(model.Result.Loss)
 
-    def guess_mmr_changes(self, complete_data):
+    def guess_mmr_changes(self, update):
         """Guess MMR change of matches."""
-        MMR = complete_data['player'].mmr
+        player = update.player
+        MMR = player.mmr
         if MMR is None:
             MMR = 0
-        totalMMRchange = complete_data['new_data']['mmr'] - MMR
-        wins = complete_data['Win']
-        losses = complete_data['Loss']
-        complete_data['games'] = sorted(
-            complete_data.get('games', []), key=itemgetter('datetime'))
+        totalMMRchange = update.entry.mmr - MMR
+        wins = update.wins
+        losses = update.losses
+        update.games.sort(key=attrgetter('datetime'))
         logger.info('{}: Adding {} wins and {} losses!'.format(
-            complete_data['player'].id, wins, losses))
+            player.id, wins, losses))
 
         if wins + losses <= 0:
             # No games to guess
-            return
+            return []
 
         # Estimate MMR change to be +/-21 for a win and losse, each adjusted
         # by the average deviation to achive the most recent MMR value.
@@ -505,7 +924,7 @@ class Controller:
 
         if MMR == 0:
             totalMMRchange = MMRchange * (wins - losses)
-            MMR = complete_data['new_data']['mmr'] - totalMMRchange
+            MMR = update.entry.mmr - totalMMRchange
 
         while True:
             avgMMRadjustment = (totalMMRchange - MMRchange
@@ -514,107 +933,275 @@ class Controller:
             # Make sure that sign of MMR change is correct
             if abs(avgMMRadjustment) >= MMRchange and MMRchange <= 50:
                 MMRchange += 1
-                logger.info(f"{complete_data['player'].id}:"
+                logger.info(f"{player.id}:"
                             f" Adjusting avg. MMR change to {MMRchange}")
             else:
                 break
 
-        last_played = complete_data['player'].last_played
+        last_played = player.last_played
 
-        previous_match = self.db_session.query(model.Match).\
-            filter(model.Match.player_id
-                   == complete_data['player'].id).\
-            order_by(model.Match.datetime.desc()).limit(1).scalar()
+        previous_match = self.get_last_match(player)
+        # The EMA follows the matches in (datetime, id) order. Games older
+        # than the last match are not appended to it, so it is recomputed.
+        reorder = (previous_match is not None
+                   and update.games[0].datetime < previous_match.datetime)
+        newest_match = previous_match
+        new_matches = []
 
         # Warning breaks Travis CI
         # if not previous_match:
         #     logger.warning('{}: No previous match found.'.format(
-        #         complete_data['player'].id))
+        #         player.id))
 
-        for idx, match in enumerate(complete_data['games']):
+        for idx, match in enumerate(update.games):
             estMMRchange = round(
-                MMRchange * match['result'].change() + avgMMRadjustment)
+                MMRchange * match.result.change() + avgMMRadjustment)
             MMR = MMR + estMMRchange
             try:
-                delta = match['datetime'] - last_played
+                delta = match.datetime - last_played
             except Exception:
                 delta = timedelta(minutes=3)
-            last_played = match['datetime']
+            last_played = match.datetime
             max_length = delta.total_seconds()
             # Don't mark the most recent game as guess, as time and mmr value
             # should be accurate (but not mmr change).
-            guess = not (idx + 1 == len(complete_data['games']))
-            alpha = 2.0 / (100.0 + 1.0)
-            if previous_match and previous_match.ema_mmr > 0.0:
-                delta = MMR - previous_match.ema_mmr
-                ema_mmr = previous_match.ema_mmr + alpha * delta
-                emvar_mmr = (1.0 - alpha) * \
-                    (previous_match.emvar_mmr + alpha * delta * delta)
+            guess = not (idx + 1 == len(update.games))
+            if previous_match:
+                ema_mmr, emvar_mmr = update_ema(
+                    MMR, self.ema_alpha,
+                    previous_match.ema_mmr, previous_match.emvar_mmr)
             else:
-                ema_mmr = MMR
-                emvar_mmr = 0.0
+                ema_mmr, emvar_mmr = update_ema(MMR, self.ema_alpha)
 
             new_match = model.Match(
-                player=complete_data['player'],
-                result=match['result'],
-                datetime=match['datetime'],
+                player=player,
+                result=match.result,
+                datetime=match.datetime,
                 mmr=MMR,
                 mmr_change=estMMRchange,
                 guess=guess,
                 ema_mmr=ema_mmr,
                 emvar_mmr=emvar_mmr,
                 max_length=max_length)
-            complete_data['player'].last_played = match['datetime']
+            player.last_played = match.datetime
             self.db_session.add(new_match)
+            self.outbox.match(new_match)
+            new_matches.append(new_match)
             previous_match = new_match
 
+        if (newest_match is None
+                or newest_match.datetime <= previous_match.datetime):
+            newest_match = previous_match
         self.db_session.commit()
+        if reorder:
+            self.update_ema_mmr(player)
+        if self.last_match is not None:
+            self.last_match[player.id] = newest_match
 
-        # Delete old matches:
+        self.prune_matches(player)
+
+        return new_matches
+
+    def prune_matches(self, player: model.Player):
+        """Delete the matches of a player beyond the newest cache_matches."""
         deletions = 0
         for match in self.db_session.query(model.Match).\
-                filter(model.Match.player_id == complete_data['player'].id).\
-                order_by(model.Match.datetime.desc()).\
+                filter(model.Match.player_id == player.id).\
+                order_by(model.Match.datetime.desc(),
+                         model.Match.id.desc()).\
                 offset(self.cache_matches).all():
             self.db_session.delete(match)
             deletions += 1
         if deletions > 0:
             self.db_session.commit()
-            logger.info(f"{complete_data['player'].id}: "
+            logger.info(f"{player.id}: "
                         f"{deletions} matches deleted!")
+        return deletions
 
     def update_ema_mmr(self, player: model.Player):
         """Update the exponential moving avarage MMR of a player."""
         matches = self.db_session.query(model.Match).\
             filter(model.Match.player == player).\
-            order_by(model.Match.datetime.asc()).all()
+            order_by(model.Match.datetime.asc(),
+                     model.Match.id.asc()).all()
 
-        previous_match = None
+        ema_mmr = emvar_mmr = None
         for match in matches:
-            alpha = 2.0 / (100.0 + 1.0)
-            if previous_match and previous_match.ema_mmr > 0.0:
-                delta = match.mmr - previous_match.ema_mmr
-                ema_mmr = previous_match.ema_mmr + alpha * delta
-                emvar_mmr = (1.0 - alpha) * \
-                    (previous_match.emvar_mmr + alpha * delta * delta)
-            else:
-                ema_mmr = match.mmr
-                emvar_mmr = 0.0
-
+            ema_mmr, emvar_mmr = update_ema(
+                match.mmr, self.ema_alpha, ema_mmr, emvar_mmr)
             match.ema_mmr = ema_mmr
             match.emvar_mmr = emvar_mmr
-            previous_match = match
         self.db_session.commit()
 
+    def rebuild_ema(self, period=None, chunk_size=100000, processes=None):
+        """Recompute the EMA and EMVar of all matches in bulk."""
+        close_db = False
+        if self.db_session is None:
+            self.create_db_session()
+            close_db = True
+        alpha = self.ema_alpha if period is None else ema_alpha(period)
+
+        match = model.Match.__table__
+        update = match.update().where(
+            match.c.id == bindparam('match_id')).values(
+            ema_mmr=bindparam('ema'), emvar_mmr=bindparam('emvar'))
+
+        # Partitions of whole players can be computed on their own.
+        bind, processes = self._analytics_bind(processes)
+        partitions = ((None, (bind, first, last, alpha))
+                      for first, last in self._player_ranges(chunk_size))
+
+        count = 0
+        for _, (ids, emas, emvars) in self._map_partitions(
+                _ema_range, partitions, processes):
+            if not ids:
+                continue
+            self.db_session.execute(update, [
+                {'match_id': match_id, 'ema': float(ema),
+                 'emvar': float(emvar)}
+                for match_id, ema, emvar in zip(ids, emas, emvars)])
+            self.db_session.commit()
+            count += len(ids)
+
+        self.db_session.expire_all()
+        logger.info(f'Recomputed EMA and EMVar of {count} matches.')
+
+        if close_db:
+            self.close_db_session()
+
+    async def reprocess(self, chunk_size=1000):
+        """Rebuild the matches and statistics of players from snapshots.
+
+        The snapshots are processed in order like the api data of runs, but
+        without any api requests. Players whose snapshots do not start with
+        their first run are skipped, as their older matches would be lost.
+        Every player is reset to the row added for it without ladder data,
+        its other race rows are deleted and created again while processing
+        like in the runs (with new ids). No events are recorded in the
+        outbox.
+        """
+        close_db = False
+        if self.db_session is None:
+            self.create_db_session()
+            close_db = True
+        store = SnapshotStore(self.db_session)
+        outbox_enabled, self.outbox.enabled = self.outbox.enabled, False
+
+        complete = set()
+        for identity, base in store.starts().items():
+            if base:
+                complete.add(identity)
+            else:
+                logger.warning(f'Skipping player {identity[0]} on'
+                               f' {identity[2]}, whose snapshots do not'
+                               ' start with the first run.')
+
+        players = [player for player in self.db_session.query(
+                       model.Player).order_by(model.Player.id)
+                   if PlayerIndex.identity(player) in complete]
+        first = {}
+        for player in players:
+            first.setdefault(PlayerIndex.identity(player), player)
+        extra = [player.id for player in players
+                 if first[PlayerIndex.identity(player)] is not player]
+        players = list(first.values())
+        for player in players:
+            player.ladder_id = 0
+            player.mmr = 0
+            player.league = model.League.Unranked
+            player.wins = 0
+            player.losses = 0
+            player.last_played = None
+            player.ladder_joined = None
+            player.last_active_season = 0
+        ids = [player.id for player in players] + extra
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            for table in (model.Match.__table__,
+                          model.Statistics.__table__,
+                          model.HorizonStatistics.__table__):
+                self.db_session.execute(
+                    table.delete().where(table.c.player_id.in_(chunk)))
+        player_table = model.Player.__table__
+        for start in range(0, len(extra), chunk_size):
+            self.db_session.execute(player_table.delete().where(
+                player_table.c.id.in_(extra[start:start + chunk_size])))
+        self.db_session.commit()
+        # Forget the deleted rows, the players are loaded again below.
+        self.db_session.expunge_all()
+
+        options = [joinedload(model.Player.statistics)]
+        if self.statistics_horizons:
+            options.append(selectinload(model.Player.horizon_statistics))
+        self.player_index = PlayerIndex(
+            self.db_session.query(model.Player).options(
+                *options).order_by(model.Player.id))
+        roots = {PlayerIndex.identity(player): player
+                 for player in self.player_index.players()}
+        self.rolling_statistics = {}
+        self.load_last_matches()
+
+        count = 0
+        for snapshot in store.iterate(chunk_size):
+            identity = (snapshot.player_id, snapshot.realm, snapshot.server)
+            player = roots.get(identity)
+            if identity not in complete or player is None:
+                continue
+            season, entries, match_history, _ = decode(snapshot.data)
+            self.current_season[snapshot.server.id()] = model.Season(
+                server=snapshot.server, season_id=season)
+            updates, new = await self.collect_updates(player, entries)
+            if len(updates) > 0:
+                await self.process_player(
+                    updates, new,
+                    match_history if match_history is not None else [],
+                    snapshot.datetime)
+            count += 1
+        self.current_season = {}
+        self.outbox.enabled = outbox_enabled
+        logger.info(f'Reprocessed {count} snapshots of'
+                    f' {len(complete)} players.')
+
+        if close_db:
+            self.close_db_session()
+
+    def get_last_match(self, player: model.Player):
+        """Get the most recent match of a player."""
+        if self.last_match is not None:
+            return self.last_match.get(player.id)
+        return self.db_session.query(model.Match).\
+            filter(model.Match.player_id == player.id).\
+            order_by(model.Match.datetime.desc(),
+                     model.Match.id.desc()).limit(1).scalar()
+
+    def load_last_matches(self):
+        """Load the most recent match of every player with one query.
+
+        Ties of the most recent datetime are broken by the highest id.
+        """
+        latest = self.db_session.query(
+            model.Match.player_id,
+            func.max(model.Match.datetime).label('datetime')).\
+            group_by(model.Match.player_id).subquery()
+        last_ids = self.db_session.query(
+            func.max(model.Match.id).label('id')).join(
+            latest, and_(model.Match.player_id == latest.c.player_id,
+                         model.Match.datetime == latest.c.datetime)).\
+            group_by(model.Match.player_id).subquery()
+        self.last_match = {
+            match.player_id: match
+            for match in self.db_session.query(model.Match).join(
+                last_ids, model.Match.id == last_ids.c.id)}
+
     def get_season_id(self, server: model.Server):
         """Get the current season id on a server."""
         return self.current_season[server.id()].season_id
 
-    def count_missing_games(self, player: model.Player, data):
+    def count_missing_games(self, player: model.Player,
+                            entry: LadderEntry):
         """Count games of the api data that are not yet in the database."""
-        missing = {}
-        missing['Win'] = data['wins']
-        missing['Loss'] = data['losses']
+        missing_wins = entry.wins
+        missing_losses = entry.losses
         if player.last_active_season == 0 or player.mmr == 0:
             new = True
         elif (player.last_active_season < self.get_season_id(player.server)):
@@ -625,140 +1212,288 @@ class Controller:
             # known), e.g.:
             # https://eu.api.blizzard.com/sc2/legacy/ladder/2/209966
             new = False
-        elif (player.ladder_id != data['ladder_id']
+        elif (player.ladder_id != entry.ladder_id
                 or not player.ladder_joined
-                or player.ladder_joined < data['joined']
-                or data['wins'] < player.wins
-                or data['losses'] < player.losses):
+                or player.ladder_joined < entry.joined
+                or entry.wins < player.wins
+                or entry.losses < player.losses):
             # Old season, but new ladder or same ladder, but rejoined
-            if (data['wins'] < player.wins
-                    or data['losses'] < player.losses):
+            if (entry.wins < player.wins
+                    or entry.losses < player.losses):
                 # Forced ladder reset!
                 logger.info('{}: Manual ladder reset to {}!'.format(
-                    player.id, data['ladder_id']))
+                    player.id, entry.ladder_id))
                 new = True
             else:
                 # Promotion?!
-                missing['Win'] -= player.wins
-                missing['Loss'] -= player.losses
+                missing_wins -= player.wins
+                missing_losses -= player.losses
                 new = player.mmr == 0
-                if missing['Win'] + missing['Loss'] == 0:
+                if missing_wins + missing_losses == 0:
                     # Player was promoted/demoted to/from GM!
-                    promotion = data['league'] == model.League.Grandmaster
+                    promotion = entry.league == model.League.Grandmaster
                     demotion = player.league == model.League.Grandmaster
                     if promotion == demotion:
                         logger.warning(
                             'Logical error in GM promotion/'
                             'demotion detection.')
-                    player.ladder_joined = data['joined']
-                    player.ladder_id = data['ladder_id']
-                    player.league = data['league']
+                    player.ladder_joined = entry.joined
+                    player.ladder_id = entry.ladder_id
+                    self.outbox.league(player, entry.league)
+                    player.league = entry.league
                     self.db_session.commit()
                     logger.info(f"{player.id}: GM promotion/demotion.")
                 else:
-                    if data['league'] < player.league:
+                    if entry.league < player.league:
                         logger.warning('Logical error in promtion detection.')
                     else:
                         logger.info(f"{player.id}: Promotion "
-                                    f"to ladder {data['ladder_id']}!")
+                                    f"to ladder {entry.ladder_id}!")
         else:
-            missing['Win'] -= player.wins
-            missing['Loss'] -= player.losses
+            missing_wins -= player.wins
+            missing_losses -= player.losses
             new = player.mmr == 0
 
-        missing['Total'] = missing['Win'] + missing['Loss']
-
-        if (missing['Total']) > 0:
-            logger.info(
-                '{player}: {Total} new matches found!'.format(
-                    player=player.id, **missing))
+        if missing_wins + missing_losses > 0:
+            logger.info(f'{player.id}: {missing_wins + missing_losses}'
+                        ' new matches found!')
 
-        return missing, new
+        return missing_wins, missing_losses, new
 
-    async def get_player_with_race(self, player, ladder_data):
-        """Get the player with the race present in the ladder data."""
+    async def get_player_with_race(self, player, entry: LadderEntry):
+        """Get the player with the race present in the ladder entry."""
         if player.ladder_id == 0:
-            player.race = ladder_data['race']
+            if self.player_index is not None:
+                self.player_index.change_race(player, entry.race)
+            else:
+                player.race = entry.race
             correct_player = player
-        elif player.race != ladder_data['race']:
-            correct_player = self.db_session.query(model.Player).filter(
-                model.Player.player_id == player.player_id,
-                model.Player.realm == player.realm,
-                model.Player.server == player.server,
-                model.Player.race == ladder_data['race']).scalar()
+        elif player.race != entry.race:
+            tracing.tag(race_split=True)
+            if self.player_index is not None:
+                correct_player = self.player_index.get(
+                    player.player_id, player.realm,
+                    player.server, entry.race)
+            else:
+                correct_player = self.db_session.query(model.Player).filter(
+                    model.Player.player_id == player.player_id,
+                    model.Player.realm == player.realm,
+                    model.Player.server == player.server,
+                    model.Player.race == entry.race).scalar()
             if not correct_player:
                 correct_player = model.Player(
                     player_id=player.player_id,
                     realm=player.realm,
                     server=player.server,
-                    race=ladder_data['race'],
+                    race=entry.race,
                     ladder_id=0)
                 self.db_session.add(correct_player)
                 self.db_session.commit()
                 self.db_session.refresh(correct_player)
+                if self.player_index is not None:
+                    self.player_index.add(correct_player)
         else:
             correct_player = player
 
         return correct_player
 
-    def delete_old_logs_and_runs(self):
+    def delete_old_logs_and_runs(self, chunk_size=10000):
         """ Delete old logs and runs from database."""
-        deletions = 0
-        for log_entry in self.db_session.query(model.Log).\
-                order_by(model.Log.datetime.desc()).\
-                offset(self.cache_logs).all():
-            self.db_session.delete(log_entry)
-            deletions += 1
-        if deletions > 0:
-            self.db_session.commit()
-            logger.info(f"{deletions} old log entries were deleted!")
-        deletions = 0
-        for run in self.db_session.query(model.Run).\
-                order_by(model.Run.datetime.desc()).\
-                offset(self.cache_runs).all():
-            self.db_session.delete(run)
-            deletions += 1
-        if deletions > 0:
-            self.db_session.commit()
-            logger.info(f"{deletions} old run logs were deleted!")
+        now = datetime.now()
+        checked = self.get_config('retention_checked', default_value='')
+        if checked and now - datetime.fromisoformat(checked) \
+                < timedelta(seconds=self.retention_interval):
+            return
 
-    async def run(self):
-        """Run the sc2monitor."""
+        engine = self.db_session.get_bind()
+        partitioned = self.retention_partitions
+        if partitioned and engine.dialect.name != 'mysql':
+            logger.warning('Partitioned retention requires MySQL.')
+            partitioned = False
+
+        run_metrics = model.RunMetric.__table__
+        for table, keep, max_age, name, children in [
+                (model.Log.__table__, self.cache_logs, self.max_age_logs,
+                 'log entries', []),
+                (model.Run.__table__, self.cache_runs, self.max_age_runs,
+                 'run logs', [run_metrics.c.run_id]),
+                (model.Event.__table__, None, self.max_age_events,
+                 'change events', [])]:
+            deletions = 0
+            if max_age > 0:
+                if partitioned:
+                    dropped = retention.maintain_partitions(
+                        engine, table, now.date(), max_age)
+                    if dropped > 0:
+                        logger.info(f'{dropped} partitions of old {name}'
+                                    ' were dropped!')
+                        for column in children:
+                            retention.delete_orphans(
+                                self.db_session, column, table.c.id)
+                else:
+                    deletions += retention.delete_in_chunks(
+                        self.db_session, table,
+                        retention.age_condition(table, now, max_age),
+                        chunk_size, children)
+            # The outbox has no limit on the number of events.
+            condition = None if keep is None else retention.count_condition(
+                self.db_session, table, int(keep))
+            if condition is not None:
+                deletions += retention.delete_in_chunks(
+                    self.db_session, table, condition, chunk_size, children)
+            if deletions > 0:
+                logger.info(f"{deletions} old {name} were deleted!")
+
+        self.set_config('retention_checked', now)
+
+    async def run(self, profile=None):
+        """Run the sc2monitor.
+
+        The run is profiled if a profiler is passed or set by the config
+        key profile_run, which is reset afterwards (see
+        sc2monitor.profiling).
+        """
+        # Reload the rows other processes changed since the last run, e.g.
+        # in serve mode.
+        self.db_session.expire_all()
+        if self.config.refresh():
+            self.read_config()
+            self.sc2api.read_config()
+        # Internal keys do not invalidate the config of other processes.
+        entry = self.get_config('profile_run', raise_key_error=False,
+                                return_object=True)
+        self.profile_run = entry.value if entry else ''
+
+        profiler = None
+        if profile or self.profile_run:
+            try:
+                profiler = create_profiler(profile or self.profile_run,
+                                           self.profile_dir,
+                                           self.profile_top)
+            except ValueError:
+                logger.exception('Unable to profile run:')
+            if not profile:
+                self.set_config('profile_run', '')
+                self.profile_run = ''
+
+        try:
+            self.sc2api.open_cassette()
+        except (OSError, ValueError):
+            logger.exception('Unable to open the cassette:')
+        try:
+            if profiler is None:
+                await self._run()
+            else:
+                with profiler:
+                    await self._run()
+        finally:
+            self.sc2api.clear_ladders()
+            self.sc2api.close_cassette()
+
+    async def _run(self):
+        """Perform a run of the sc2monitor."""
         start_time = time.time()
         logger.debug("Starting job...")
+        self.metrics.reset()
+        # The counters keep counting when running repeatedly, see serve.
+        request_count = self.sc2api.request_count
+        retry_count = self.sc2api.retry_count
+        warnings = self.handler.warnings
+        errors = self.handler.errors
 
-        await self.update_seasons()
+        with self.metrics.phase('seasons'):
+            await self.update_seasons()
 
-        unique_group = (model.Player.player_id,
-                        model.Player.realm, model.Player.server)
         tasks = []
-        players = self.db_session.query(model.Player).distinct(
-            *unique_group).group_by(*unique_group).all()
+        with self.metrics.phase('load_players'):
+            options = [joinedload(model.Player.statistics)]
+            if self.statistics_horizons:
+                options.append(selectinload(model.Player.horizon_statistics))
+            self.player_index = PlayerIndex(
+                self.db_session.query(model.Player).options(
+                    *options).order_by(model.Player.id))
+            self.load_last_matches()
+            self.check_rolling_statistics()
+            players = self.player_index.players()
+            self.exporter.load_players(players)
 
         for player in players:
             tasks.append(asyncio.create_task(self.query_player(player)))
 
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        with self.metrics.phase('query_players'):
+            results = await asyncio.gather(*tasks, return_exceptions=True)
         for key, result in enumerate(results):
             try:
                 if result is not None:
                     raise result
             except Exception:
+                self.exporter.player_failed(players[key].id)
                 logger.exception(
                     'The following exception was'
                     f' raised while quering player {players[key].id}:')
 
-        self.delete_old_logs_and_runs()
+        self.tracer.flush()
+        if self.snapshots is not None:
+            self.snapshots.flush()
+            logger.debug(f'Added {self.snapshots.added} snapshots,'
+                         f' {self.snapshots.unchanged} players unchanged.')
+            self.snapshots.added = self.snapshots.unchanged = 0
+
+        # Write buffered logs before old logs are deleted.
+        self.handler.flush()
+        with self.metrics.phase('retention'):
+            self.delete_old_logs_and_runs()
 
         duration = time.time() - start_time
-        self.db_session.add(
-            model.Run(duration=duration,
-                      api_requests=self.sc2api.request_count,
-                      api_retries=self.sc2api.retry_count,
-                      warnings=self.handler.warnings,
-                      errors=self.handler.errors))
+        run = model.Run(duration=duration,
+                        api_requests=self.sc2api.request_count
+                        - request_count,
+                        api_retries=self.sc2api.retry_count - retry_count,
+                        warnings=self.handler.warnings - warnings,
+                        errors=self.handler.errors - errors)
+        run.metrics = [model.RunMetric(**row)
+                       for row in self.metrics.rows()]
+        run.metrics.append(model.RunMetric(
+            kind='phase', name='total', count=1, seconds=duration))
+        self.db_session.add(run)
         self.db_session.commit()
 
-        logger.debug(f"Finished job performing {self.sc2api.request_count}"
-                     f" api requests ({self.sc2api.retry_count} retries)"
+        self.exporter.run_done(duration)
+        if self.metrics_textfile:
+            try:
+                self.exporter.write_textfile(self.metrics_textfile)
+            except OSError:
+                logger.exception('Unable to write the metrics to'
+                                 f' {self.metrics_textfile}:')
+
+        logger.debug(f"Finished job performing {run.api_requests}"
+                     f" api requests ({run.api_retries} retries)"
                      f" in {duration:.2f} seconds.")
+
+    async def serve(self, interval=300):
+        """Run the sc2monitor every interval seconds until cancelled.
+
+        If the config key metrics_port is set, the metrics are served via
+        http on /metrics meanwhile. If push_port is set, clients can
+        subscribe to the events of players (see sc2monitor.push).
+        """
+        if self.metrics_port:
+            await self.exporter.start(self.metrics_host, self.metrics_port)
+        if self.push_port:
+            self.outbox.listeners.append(self.push.hub.publish)
+            await self.push.start(self.push_host, self.push_port)
+        try:
+            while True:
+                start_time = time.monotonic()
+                try:
+                    await self.run()
+                except Exception:
+                    logger.exception('The following exception was'
+                                     ' raised during a run:')
+                await asyncio.sleep(
+                    max(0.0, interval - (time.monotonic() - start_time)))
+        finally:
+            await self.exporter.stop()
+            if self.push.hub.publish in self.outbox.listeners:
+                self.outbox.listeners.remove(self.push.hub.publish)
+            await self.push.stop()
@@ -0,0 +1,137 @@
+"""Decode and project JSON responses of the SC2 api."""
+import json
+import logging
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+logger = logging.getLogger(__name__)
+
+# Fields of the api responses used by the sc2monitor. A field maps to
+# True to keep its whole value or to the fields to keep of its value
+# (of every item of a list).
+LADDER_FIELDS = {
+    'league': True,
+    'ranksAndPools': {'rank': True, 'mmr': True},
+    'ladderTeams': {
+        'teamMembers': {'id': True, 'realm': True, 'displayName': True,
+                        'favoriteRace': True},
+        'mmr': True, 'wins': True, 'losses': True, 'joinTimestamp': True}}
+LADDER_SUMMARY_FIELDS = {
+    'allLadderMemberships': {'ladderId': True, 'localizedGameMode': True}}
+MATCH_HISTORY_FIELDS = {
+    'matches': {'type': True, 'decision': True, 'date': True}}
+
+DECODERS = ['auto', 'json', 'orjson', 'ijson']
+
+
+class Decoder:
+    """Pluggable JSON decoder of api responses."""
+
+    def __init__(self, name='auto'):
+        """Init the decoder by name, see DECODERS."""
+        name = name or 'auto'
+        if name not in DECODERS:
+            raise ValueError(f"Unknown JSON decoder '{name}'"
+                             f" (valid decoders: {', '.join(DECODERS)})")
+        self.name = name
+        if name == 'orjson' and orjson is None \
+                or name == 'ijson' and ijson is None:
+            logger.warning(f"JSON decoder '{name}' is not installed.")
+            name = 'auto'
+        self.streaming = name == 'ijson'
+        # Responses without projection are decoded as a whole.
+        if name == 'json' or orjson is None:
+            self.loads = json.loads
+        else:
+            self.loads = orjson.loads
+
+    async def decode(self, resp, fields=None):
+        """Decode an aiohttp response.
+
+        A streaming decoder keeps only the projected fields, otherwise the
+        whole response is decoded (a projection of the decoded response
+        would only cost time).
+        """
+        if self.streaming and fields is not None:
+            # Raise ContentTypeError like resp.json() for other content.
+            if 'json' not in resp.content_type:
+                await resp.json()
+            projection = Projection(fields)
+            try:
+                async for _, event, value in ijson.parse_async(
+                        resp.content, use_float=True):
+                    projection.feed(event, value)
+            except ijson.JSONError as error:
+                # Malformed JSON raises ValueError like json.loads.
+                raise ValueError(str(error)) from error
+            return projection.result
+        return await resp.json(loads=self.loads)
+
+
+class Projection:
+    """Build the projected fields from a stream of parse events.
+
+    The events are (event, value) pairs as produced by ijson, so large
+    responses never have to be held as a whole in memory.
+    """
+
+    def __init__(self, fields):
+        """Init an empty projection."""
+        self.fields = fields
+        self.result = None
+        self._stack = []
+        self._key = None
+        self._skip = 0
+
+    def feed(self, event, value):
+        """Process the next parse event."""
+        if self._skip:
+            if event in ('start_map', 'start_array'):
+                self._skip += 1
+            elif event in ('end_map', 'end_array'):
+                self._skip -= 1
+            return
+        if event == 'map_key':
+            self._key = value
+            return
+        if event in ('end_map', 'end_array'):
+            self._stack.pop()
+            return
+
+        fields = self._next_fields()
+        if fields is None:
+            if event in ('start_map', 'start_array'):
+                self._skip = 1
+            return
+        if event == 'start_map':
+            item = {}
+        elif event == 'start_array':
+            item = []
+        else:
+            item = value
+
+        if not self._stack:
+            self.result = item
+        elif isinstance(self._stack[-1][0], list):
+            self._stack[-1][0].append(item)
+        else:
+            self._stack[-1][0][self._key] = item
+        if event in ('start_map', 'start_array'):
+            self._stack.append((item, fields))
+
+    def _next_fields(self):
+        """Return the fields to keep of the next value or None to skip it."""
+        if not self._stack:
+            return self.fields
+        container, fields = self._stack[-1]
+        if fields is True or isinstance(container, list):
+            return fields
+        return fields.get(self._key)
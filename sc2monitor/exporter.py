@@ -0,0 +1,248 @@
+"""Export metrics of the monitor in the Prometheus/OpenMetrics format."""
+import bisect
+import logging
+import math
+import os
+import time
+from collections import Counter
+
+from aiohttp import web
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+OPENMETRICS_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# Upper bounds of the buckets of the database commit latency histogram.
+COMMIT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                  1.0, 2.5, 5.0, 10.0)
+
+# Quantiles of the data age over all players.
+AGE_QUANTILES = (0.5, 0.9, 0.99)
+
+
+def _labels(**labels):
+    """Format the labels of a sample."""
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+
+def _quantile(values, quantile):
+    """Return the quantile of sorted values by the nearest rank."""
+    return values[max(0, math.ceil(quantile * len(values)) - 1)]
+
+
+def _value(value):
+    """Format the value of a sample."""
+    if isinstance(value, float):
+        return repr(value) if value != float('inf') else '+Inf'
+    return str(value)
+
+
+class Exporter:
+    """Pre-aggregated metrics of the monitor.
+
+    The counters are updated by the controller and the api wrapper while
+    they work, so rendering the metrics never queries the database. The
+    age of the data of each player is only exported with `player_age`
+    set, as it adds a time series per player.
+    """
+
+    def __init__(self, controller):
+        """Init all counters."""
+        self._controller = controller
+        self.requests = Counter()
+        self.retries = Counter()
+        self.players = Counter()
+        self.players_queued = 0
+        self.refreshed = {}
+        self.player_age = False
+        self.commit_buckets = [0] * (len(COMMIT_BUCKETS) + 1)
+        self.commit_count = 0
+        self.commit_seconds = 0.0
+        self.runs = 0
+        self.last_run = None
+        self.last_run_duration = None
+        self._commit_start = None
+        self._runner = None
+
+    def watch(self, db_session):
+        """Time the commits of a database session."""
+        event.listen(db_session, 'before_commit', self._before_commit)
+        event.listen(db_session, 'after_commit', self._after_commit)
+
+    def _before_commit(self, session):
+        self._commit_start = time.perf_counter()
+
+    def _after_commit(self, session):
+        if self._commit_start is None:
+            return
+        seconds = time.perf_counter() - self._commit_start
+        self._commit_start = None
+        self.commit_buckets[bisect.bisect_left(COMMIT_BUCKETS, seconds)] += 1
+        self.commit_count += 1
+        self.commit_seconds += seconds
+
+    def request(self, endpoint, status):
+        """Count an api request by endpoint and status class."""
+        self.requests[endpoint, f'{status // 100}xx' if status else 'none'] \
+            += 1
+
+    def retry(self, endpoint, reason):
+        """Count a retried api request by endpoint and reason."""
+        self.retries[endpoint, reason] += 1
+
+    def player_done(self, player_id, updated):
+        """Count a queried player and mark its data as fresh."""
+        self.players['processed' if updated else 'skipped'] += 1
+        self.players_queued -= 1
+        self.refreshed[player_id] = time.time()
+
+    def player_failed(self, player_id):
+        """Count a player whose query failed."""
+        self.players['failed'] += 1
+        self.players_queued -= 1
+
+    def load_players(self, players):
+        """Seed the data age of players not queried by this process yet."""
+        for player in players:
+            if player.id not in self.refreshed and player.refreshed:
+                self.refreshed[player.id] = player.refreshed.timestamp()
+        self.players_queued = len(players)
+
+    def run_done(self, duration):
+        """Record a finished run."""
+        self.runs += 1
+        self.last_run = time.time()
+        self.last_run_duration = duration
+
+    def render(self, openmetrics=False):
+        """Render all metrics as text."""
+        lines = []
+
+        def metric(name, kind, help, samples):
+            # OpenMetrics names counters without the _total suffix.
+            family = name[:-6] if openmetrics and kind == 'counter' else name
+            lines.append(f'# HELP {family} {help}')
+            lines.append(f'# TYPE {family} {kind}')
+            for suffix, labels, value in samples:
+                lines.append(f'{name}{suffix}{_labels(**labels)}'
+                             f' {_value(value)}')
+
+        sc2api = self._controller.sc2api
+        handler = getattr(self._controller, 'handler', None)
+        now = time.time()
+
+        metric('sc2monitor_api_requests_total', 'counter',
+               'Api requests by endpoint and status class.',
+               [('', dict(endpoint=endpoint, status=status), count)
+                for (endpoint, status), count in
+                sorted(self.requests.items())])
+        metric('sc2monitor_api_retries_total', 'counter',
+               'Retried api requests by endpoint and reason.',
+               [('', dict(endpoint=endpoint, reason=reason), count)
+                for (endpoint, reason), count in
+                sorted(self.retries.items())])
+        metric('sc2monitor_api_in_flight', 'gauge',
+               'Api requests waiting for a response.',
+               [('', {}, sc2api.in_flight if sc2api else 0)])
+        metric('sc2monitor_players_queued', 'gauge',
+               'Players of the current run not queried yet.',
+               [('', {}, self.players_queued)])
+        metric('sc2monitor_log_records_buffered', 'gauge',
+               'Log records waiting to be written to the database.',
+               [('', {}, handler.buffered if handler else 0)])
+        push = getattr(self._controller, 'push', None)
+        if push is not None:
+            metric('sc2monitor_push_subscribers', 'gauge',
+                   'Clients subscribed to the events of players.',
+                   [('', {}, len(push.hub.subscribers))])
+            metric('sc2monitor_push_events_total', 'counter',
+                   'Events pushed to subscribers.',
+                   [('', {}, push.hub.published)])
+            metric('sc2monitor_push_dropped_total', 'counter',
+                   'Subscribers dropped for not keeping up.',
+                   [('', {}, push.hub.dropped)])
+
+        buckets = []
+        cumulative = 0
+        for bound, count in zip(COMMIT_BUCKETS + (float('inf'),),
+                                self.commit_buckets):
+            cumulative += count
+            buckets.append(('_bucket', dict(le=_value(float(bound))),
+                            cumulative))
+        metric('sc2monitor_db_commit_seconds', 'histogram',
+               'Latency of database commits.',
+               buckets + [('_count', {}, self.commit_count),
+                          ('_sum', {}, self.commit_seconds)])
+
+        metric('sc2monitor_players_total', 'counter',
+               'Queried players by outcome.',
+               [('', dict(outcome=outcome), self.players[outcome])
+                for outcome in ('processed', 'skipped', 'failed')])
+        ages = sorted(round(now - refreshed, 3)
+                      for refreshed in self.refreshed.values())
+        if ages:
+            metric('sc2monitor_players_data_age_seconds', 'gauge',
+                   'Quantiles of the seconds since the data of the players'
+                   ' was last refreshed.',
+                   [('', dict(quantile=quantile), _quantile(ages, quantile))
+                    for quantile in AGE_QUANTILES])
+            metric('sc2monitor_players_data_age_max_seconds', 'gauge',
+                   'Seconds since the data of the stalest player was last'
+                   ' refreshed.',
+                   [('', {}, ages[-1])])
+        if self.player_age:
+            metric('sc2monitor_player_data_age_seconds', 'gauge',
+                   'Seconds since the data of a player was last refreshed.',
+                   [('', dict(player=player_id), round(now - refreshed, 3))
+                    for player_id, refreshed in
+                    sorted(self.refreshed.items())])
+
+        metric('sc2monitor_runs_total', 'counter', 'Finished runs.',
+               [('', {}, self.runs)])
+        if self.last_run is not None:
+            metric('sc2monitor_last_run_timestamp_seconds', 'gauge',
+                   'Time the last run finished.',
+                   [('', {}, round(self.last_run, 3))])
+            metric('sc2monitor_last_run_duration_seconds', 'gauge',
+                   'Duration of the last run.',
+                   [('', {}, round(self.last_run_duration, 3))])
+
+        if openmetrics:
+            lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """Write the metrics atomically, e.g. for a textfile collector."""
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    async def handle(self, request):
+        """Serve the metrics, in OpenMetrics format if accepted."""
+        openmetrics = 'application/openmetrics-text' in request.headers.get(
+            'Accept', '')
+        return web.Response(
+            body=self.render(openmetrics).encode('utf-8'),
+            headers={'Content-Type': OPENMETRICS_TYPE if openmetrics
+                     else PROMETHEUS_TYPE})
+
+    async def start(self, host='127.0.0.1', port=9101):
+        """Serve the metrics via http on /metrics."""
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f'Serving metrics on http://{host}:{port}/metrics')
+
+    async def stop(self):
+        """Stop serving the metrics."""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -1,22 +1,74 @@
 """Log to database via SQLAlchemy."""
 import logging
+import sys
+import threading
+import time
 import traceback
+from datetime import datetime
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import DataError, IntegrityError, OperationalError
 
 from sc2monitor.model import Log
 
+MSG_LENGTH = Log.__table__.c.msg.type.length
+TRACE_LENGTH = Log.__table__.c.trace.type.length
+
 
 class SQLAlchemyHandler(logging.Handler):
-    """Handler for logging via SQLAlchemy to the database."""
+    """Handler for logging via SQLAlchemy to the database.
+
+    Records are buffered and written in batches through a connection of
+    their own, by a background thread once `capacity` records are
+    buffered or `flush_interval` seconds passed. SQLite allows a single
+    writer only, so there the batches are written synchronously, waiting
+    at most `busy_timeout` seconds for the lock of the session. Batches
+    finding the database locked are kept until the next flush. An
+    in-memory database only exists for the connection of the session, so
+    there the batches are written with the session.
+
+    Messages and traces are truncated to the length of their columns.
+    Records the database rejects are dropped, while batches failing
+    otherwise are retried up to `max_retries` times, keeping at most
+    `max_buffer` records.
+    """
 
-    def __init__(self, db_session):
+    def __init__(self, db_session, capacity=100, flush_interval=5.0,
+                 max_retries=3, max_buffer=10000, busy_timeout=0.1):
         """Init logger and set database session."""
         super().__init__()
         self.db_session = db_session
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.max_buffer = max_buffer
         self.errors = 0
         self.warnings = 0
+        self.dropped = 0
+        self._retries = 0
+        self._buffer = []
+        self._buffer_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._flushed = time.monotonic()
+        self._closed = False
+
+        self._engine = db_session.get_bind()
+        self._thread = None
+        if self._engine.dialect.name == 'sqlite':
+            if self._engine.url.database in (None, '', ':memory:'):
+                self._engine = None
+            else:
+                self._engine = create_engine(
+                    self._engine.url,
+                    connect_args={'timeout': busy_timeout})
+        else:
+            self._wakeup = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run, name='SQLAlchemyHandler', daemon=True)
+            self._thread.start()
 
     def emit(self, record):
-        """Write a record to the database."""
+        """Buffer a record to be written to the database."""
         trace = None
         exc = record.__dict__['exc_info']
         level = record.__dict__['levelname']
@@ -27,11 +79,110 @@ class SQLAlchemyHandler(logging.Handler):
             self.warnings += 1
 
         if exc:
-            trace = traceback.format_exc()
-        log = Log(
-            logger=record.__dict__['name'],
-            level=level,
-            trace=trace,
-            msg=record.__dict__['msg'],)
-        self.db_session.add(log)
-        self.db_session.commit()
+            # The end of a traceback holds the exception.
+            trace = traceback.format_exc()[-TRACE_LENGTH:]
+        with self._buffer_lock:
+            self._buffer.append(dict(
+                logger=record.__dict__['name'],
+                level=level,
+                trace=trace,
+                msg=str(record.__dict__['msg'])[:MSG_LENGTH],
+                datetime=datetime.now()))
+            full = len(self._buffer) >= self.capacity
+
+        if self._thread is not None:
+            if full:
+                self._wakeup.set()
+        elif full or time.monotonic() - self._flushed >= self.flush_interval:
+            self.flush()
+
+    @property
+    def buffered(self):
+        """Return the number of records waiting to be written."""
+        return len(self._buffer)
+
+    def flush(self):
+        """Write all buffered records to the database."""
+        with self._write_lock:
+            with self._buffer_lock:
+                rows, self._buffer = self._buffer, []
+            self._flushed = time.monotonic()
+            if not rows:
+                return
+            try:
+                self._write(rows)
+                self._retries = 0
+            except OperationalError as error:
+                if not self._locked(error):
+                    self._failed(rows)
+                else:
+                    # Try again after the session committed.
+                    self._keep(rows)
+            except Exception:
+                self._failed(rows)
+
+    def _failed(self, rows):
+        """Keep the rows of a failed batch for a limited number of retries."""
+        self._retries += 1
+        if self._retries > self.max_retries:
+            self._drop(len(rows))
+            self._retries = 0
+        else:
+            self._keep(rows)
+        sys.stderr.write('--- Writing log records failed ---\n')
+        traceback.print_exc(file=sys.stderr)
+
+    def _keep(self, rows):
+        """Put rows back in front of the buffer, up to max_buffer rows."""
+        with self._buffer_lock:
+            self._buffer[:0] = rows
+            excess = len(self._buffer) - self.max_buffer
+            if excess > 0:
+                del self._buffer[:excess]
+        if excess > 0:
+            self._drop(excess)
+
+    def _locked(self, error):
+        """Return whether SQLite failed as the session holds the lock."""
+        return (self._thread is None and self._engine is not None
+                and 'database is locked' in str(error.orig))
+
+    def _write(self, rows):
+        """Insert rows, dropping the ones the database rejects."""
+        try:
+            if self._engine is None:
+                self.db_session.execute(Log.__table__.insert(), rows)
+            else:
+                with self._engine.begin() as connection:
+                    connection.execute(Log.__table__.insert(), rows)
+        except (DataError, IntegrityError):
+            if len(rows) == 1:
+                self._drop(1)
+                return
+            # Split the batch to find the rejected rows.
+            middle = len(rows) // 2
+            self._write(rows[:middle])
+            self._write(rows[middle:])
+
+    def _drop(self, count):
+        self.dropped += count
+        sys.stderr.write(f'--- Dropped {count} log records ---\n')
+
+    def close(self):
+        """Write the buffered records and stop the background thread."""
+        if not self._closed:
+            self._closed = True
+            if self._thread is not None:
+                self._wakeup.set()
+                self._thread.join()
+            self.flush()
+            if self._thread is None and self._engine is not None:
+                self._engine.dispose()
+        super().close()
+
+    def _run(self):
+        """Flush the buffer on size or time thresholds until closed."""
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
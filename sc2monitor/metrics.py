@@ -0,0 +1,110 @@
+"""Collect timings of the phases and api requests of a run."""
+import math
+import time
+
+# Buckets of the latency histograms grow by a factor of 2^(1/8), so a
+# percentile is off by less than 5% while recording stays O(1).
+_BUCKET_BASE = 1e-4
+_BUCKET_FACTOR = math.log(2) / 8
+
+
+class Histogram:
+    """Log-bucketed histogram of durations in seconds."""
+
+    __slots__ = ('count', 'total', 'bytes', 'min', 'max', '_buckets')
+
+    def __init__(self):
+        """Init an empty histogram."""
+        self.count = 0
+        self.total = 0.0
+        self.bytes = 0
+        self.min = math.inf
+        self.max = 0.0
+        self._buckets = {}
+
+    def record(self, seconds, size=0):
+        """Record a duration (and the bytes transferred)."""
+        self.count += 1
+        self.total += seconds
+        self.bytes += size
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+        bucket = 0 if seconds <= _BUCKET_BASE else \
+            int(math.log(seconds / _BUCKET_BASE) / _BUCKET_FACTOR)
+        self._buckets[bucket] = self._buckets.get(bucket, 0) + 1
+
+    def percentile(self, q):
+        """Return the approximate q-th percentile or None if empty."""
+        if self.count == 0:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for bucket in sorted(self._buckets):
+            seen += self._buckets[bucket]
+            if seen >= rank:
+                break
+        # The geometric center of the bucket.
+        value = _BUCKET_BASE * math.exp((bucket + 0.5) * _BUCKET_FACTOR)
+        return min(max(value, self.min), self.max)
+
+
+class _Phase:
+    """Context manager adding its wall time to a phase."""
+
+    __slots__ = ('_metrics', '_name', '_start')
+
+    def __init__(self, metrics, name):
+        self._metrics = metrics
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc, tb):
+        phases = self._metrics.phases
+        count, seconds = phases.get(self._name, (0, 0.0))
+        phases[self._name] = (
+            count + 1, seconds + time.perf_counter() - self._start)
+
+
+class RunMetrics:
+    """Wall time per phase and latency histograms per api endpoint."""
+
+    def __init__(self):
+        """Init empty metrics."""
+        self.reset()
+
+    def reset(self):
+        """Drop all recorded timings, e.g. at the start of a run."""
+        self.phases = {}
+        self.endpoints = {}
+
+    def phase(self, name):
+        """Return a context manager timing a phase.
+
+        Phases of concurrent tasks overlap, so their times can add up to
+        more than the duration of the run.
+        """
+        return _Phase(self, name)
+
+    def request(self, endpoint, seconds, size=0):
+        """Record the duration of an api request."""
+        histogram = self.endpoints.get(endpoint)
+        if histogram is None:
+            histogram = self.endpoints[endpoint] = Histogram()
+        histogram.record(seconds, size)
+
+    def rows(self):
+        """Return the recorded timings as rows of the run_metrics table."""
+        rows = [dict(kind='phase', name=name, count=count, seconds=seconds)
+                for name, (count, seconds) in self.phases.items()]
+        rows.extend(
+            dict(kind='endpoint', name=name, count=histogram.count,
+                 seconds=histogram.total, bytes=histogram.bytes,
+                 p50=histogram.percentile(50),
+                 p90=histogram.percentile(90),
+                 p99=histogram.percentile(99))
+            for name, histogram in self.endpoints.items())
+        return rows
@@ -1,14 +1,33 @@
 """Define model (database structure) of sc2monitor."""
 import enum
+import logging
 from datetime import datetime
 
 from sqlalchemy import (Boolean, Column, DateTime, Enum, Float, ForeignKey,
-                        Integer, String, UniqueConstraint, create_engine, text)
+                        Index, Integer, LargeBinary, String,
+                        UniqueConstraint, create_engine, inspect, select,
+                        text)
+from sqlalchemy.exc import (IntegrityError, OperationalError,
+                            ProgrammingError)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
 
+logger = logging.getLogger(__name__)
+
 Base = declarative_base()
 
+# Increase whenever tables, columns or indexes change to trigger the
+# migration of existing databases on the next start.
+SCHEMA_VERSION = 5
+
+
+def _prefix_table(cls, length):
+    """Map lower case name prefixes to the first enum member using them."""
+    table = {}
+    for name, member in cls.__members__.items():
+        table.setdefault(name[:length].lower(), member)
+    return table
+
 
 class Result(enum.Enum):
     """Result of a ladder match."""
@@ -26,9 +45,7 @@ class Result(enum.Enum):
         elif isinstance(value, str):
             if not value:
                 return cls.Unknown
-            for result in cls.__members__:
-                if result[0].lower() == value[0].lower():
-                    return cls[result]
+            return _RESULT_INITIALS.get(value[0].lower(), cls.Unknown)
         elif isinstance(value, int):
             if value >= 1:
                 return cls.Win
@@ -79,6 +96,9 @@ class Result(enum.Enum):
         return self.describe()
 
 
+_RESULT_INITIALS = _prefix_table(Result, 1)
+
+
 class Race(enum.Enum):
     """StarCraft 2 race."""
 
@@ -95,9 +115,9 @@ class Race(enum.Enum):
         elif isinstance(value, str):
             if not value:
                 return cls.Random
-            for race in cls.__members__:
-                if race[0].lower() == value[0].lower():
-                    return cls[race]
+            race = _RACE_INITIALS.get(value[0].lower())
+            if race is not None:
+                return race
         raise ValueError(f'Unknown race {value}')
 
     def describe(self):
@@ -131,6 +151,9 @@ class Race(enum.Enum):
         return self.describe()
 
 
+_RACE_INITIALS = _prefix_table(Race, 1)
+
+
 class Server(enum.Enum):
     """StarCraft 2 Server."""
 
@@ -216,12 +239,10 @@ class League(enum.Enum):
                 return cls.Unranked
             if value[0:2].lower() == 'gm':
                 return League.Grandmaster
-            for league in cls.__members__:
-                if league[0:2].lower() == value[0:2].lower():
-                    return cls[league]
-            for league in cls.__members__:
-                if league[0].lower() == value[0].lower():
-                    return cls[league]
+            league = _LEAGUE_PREFIXES.get(value[0:2].lower()) \
+                or _LEAGUE_INITIALS.get(value[0].lower())
+            if league is not None:
+                return league
         elif isinstance(value, int):
             return League(value)
         raise ValueError(f'Unknown league {value}')
@@ -256,6 +277,10 @@ class League(enum.Enum):
         return self.describe()
 
 
+_LEAGUE_PREFIXES = _prefix_table(League, 2)
+_LEAGUE_INITIALS = _prefix_table(League, 1)
+
+
 def same_as(column_name):
     """Provide SQLAlchemy with a default value based on another column."""
     def default_function(context):
@@ -280,6 +305,8 @@ class Season(Base):
     """Season database entry."""
 
     __tablename__ = "season"
+    __table_args__ = (
+        Index('ix_season_server_season_id', 'server', 'season_id'),)
     id = Column(Integer, primary_key=True)
     season_id = Column(Integer)
     server = Column(Enum(Server), default=Server.Europe)
@@ -299,8 +326,9 @@ class Player(Base):
     """Player database entry."""
 
     __tablename__ = "player"
-    __table_args__ = tuple(UniqueConstraint(
-        'player_id', 'realm', 'server', 'race'))
+    __table_args__ = (
+        UniqueConstraint('player_id', 'realm', 'server', 'race',
+                         name='uq_player_identity'),)
     id = Column(Integer, primary_key=True)
     player_id = Column(Integer)
     realm = Column(Integer, default=1, server_default=text("1"))
@@ -324,6 +352,9 @@ class Player(Base):
                               back_populates="player",
                               uselist=False,
                               cascade="save-update, merge, delete")
+    horizon_statistics = relationship("HorizonStatistics",
+                                      back_populates="player",
+                                      cascade="save-update, merge, delete")
 
     def __repr__(self):
         """Represent database object."""
@@ -338,6 +369,8 @@ class Match(Base):
     """Match database entry."""
 
     __tablename__ = "match"
+    __table_args__ = (
+        Index('ix_match_player_datetime', 'player_id', 'datetime'),)
     id = Column(Integer, primary_key=True)
     player_id = Column(Integer, ForeignKey('player.id'))
     player = relationship(Player, back_populates="matches", uselist=False)
@@ -388,10 +421,46 @@ class Statistics(Base):
                 f'games={self.games})>')
 
 
+class HorizonStatistics(Base):
+    """Statistics over a horizon (last N games or season) database entry."""
+
+    __tablename__ = "horizon_statistics"
+    __table_args__ = (
+        UniqueConstraint('player_id', 'horizon',
+                         name='uq_horizon_statistics_player_horizon'),)
+    id = Column(Integer, primary_key=True)
+    player_id = Column(Integer, ForeignKey('player.id'))
+    player = relationship(Player, back_populates="horizon_statistics",
+                          uselist=False)
+    horizon = Column(String(16))
+    winrate = Column(Float, default=0.0)
+    games = Column(Integer, default=0)
+    current_mmr = Column(Integer, default=0)
+    wma_mmr = Column(Integer, default=0)
+    max_mmr = Column(Integer, default=0)
+    min_mmr = Column(Integer, default=0)
+    wins = Column(Integer, default=0)
+    losses = Column(Integer, default=0)
+    longest_wining_streak = Column(Integer, default=0)
+    longest_losing_streak = Column(Integer, default=0)
+    guessed_games = Column(Integer, default=0)
+    lr_mmr_slope = Column(Float, default=0.0)
+    lr_mmr_intercept = Column(Float, default=0.0)
+    sd_mmr = Column(Float, default=0.0)
+    avg_mmr = Column(Float, default=0.0)
+    instant_left_games = Column(Integer, default=0)
+
+    def __repr__(self):
+        """Represent database object."""
+        return (f'<HorizonStatistics(id={self.id}, player={self.player}, '
+                f'horizon={self.horizon}, games={self.games})>')
+
+
 class Log(Base):
     """Log database entry."""
 
     __tablename__ = 'logs'
+    __table_args__ = (Index('ix_logs_datetime', 'datetime'),)
     id = Column(Integer, primary_key=True)  # auto incrementing
     logger = Column(String(64))  # the name of the logger. (e.g. myapp.views)
     level = Column(String(64))  # info, debug, or error?
@@ -420,6 +489,7 @@ class Run(Base):
     """Run database entry."""
 
     __tablename__ = "runs"
+    __table_args__ = (Index('ix_runs_datetime', 'datetime'),)
     id = Column(Integer, primary_key=True)
     datetime = Column(DateTime, default=datetime.now)
     duration = Column(Float, default=0.0)
@@ -427,6 +497,11 @@ class Run(Base):
     api_retries = Column(Integer, default=0)
     warnings = Column(Integer, default=0)
     errors = Column(Integer, default=0)
+    # No foreign key constraint on run_metrics, so runs can be partitioned
+    # (see sc2monitor.retention). Metrics are deleted with their runs.
+    metrics = relationship("RunMetric",
+                           primaryjoin="Run.id == foreign(RunMetric.run_id)",
+                           cascade="save-update, merge, delete")
 
     def __repr__(self):
         """Represent database object."""
@@ -437,6 +512,140 @@ class Run(Base):
                 f'errors={self.errors}>')
 
 
+class RunMetric(Base):
+    """Timing of a phase or an api endpoint during a run."""
+
+    __tablename__ = "run_metrics"
+    __table_args__ = (Index('ix_run_metrics_run_id', 'run_id'),)
+    id = Column(Integer, primary_key=True)
+    run_id = Column(Integer)
+    kind = Column(String(16))  # phase or endpoint
+    name = Column(String(64))
+    count = Column(Integer, default=0)
+    seconds = Column(Float, default=0.0)  # total wall time
+    p50 = Column(Float)
+    p90 = Column(Float)
+    p99 = Column(Float)
+    bytes = Column(Integer)
+
+    def __repr__(self):
+        """Represent database object."""
+        return (f'<RunMetric(run_id={self.run_id}, kind={self.kind}, '
+                f'name={self.name}, count={self.count}, '
+                f'seconds={self.seconds:.3f})>')
+
+
+class Snapshot(Base):
+    """Compressed api data of a player consumed by a run.
+
+    Snapshots are only appended and only if the ladder data of a player
+    changed, see sc2monitor.snapshots.
+    """
+
+    __tablename__ = "snapshots"
+    __table_args__ = (Index('ix_snapshots_player', 'player_id', 'realm',
+                            'server'),)
+    id = Column(Integer, primary_key=True)
+    player_id = Column(Integer)
+    realm = Column(Integer, default=1)
+    server = Column(Enum(Server), default=Server.Europe)
+    datetime = Column(DateTime, default=datetime.now)
+    digest = Column(String(40))  # sha1 of the ladder data
+    data = Column(LargeBinary)
+
+    def __repr__(self):
+        """Represent database object."""
+        return (f'<Snapshot(id={self.id}, player_id={self.player_id}, '
+                f'server={self.server}, realm={self.realm}, '
+                f'datetime={self.datetime})>')
+
+
+class Event(Base):
+    """Change of a player in the outbox (see sc2monitor.outbox).
+
+    The ids are the sequence numbers consumers read the outbox by. There
+    is no foreign key, so the table can be partitioned by the retention.
+    """
+
+    __tablename__ = "events"
+    __table_args__ = (Index('ix_events_datetime', 'datetime'),)
+    id = Column(Integer, primary_key=True)
+    datetime = Column(DateTime, default=datetime.now)
+    player_id = Column(Integer)
+    kind = Column(String(16))  # match, mmr, league or name
+    data = Column(String(255))  # JSON
+
+    def __repr__(self):
+        """Represent database object."""
+        return (f'<Event(id={self.id}, player_id={self.player_id}, '
+                f'kind={self.kind}, data={self.data})>')
+
+
+def migrate(engine):
+    """Add indexes and constraints missing in an existing database."""
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = {index['name']
+                    for index in inspector.get_indexes(table.name)}
+        existing.update(
+            constraint['name']
+            for constraint in inspector.get_unique_constraints(table.name))
+
+        for index in table.indexes:
+            if index.name not in existing:
+                logger.info(f'Creating index {index.name}'
+                            f' on table {table.name}.')
+                index.create(engine)
+
+        for constraint in table.constraints:
+            if (not isinstance(constraint, UniqueConstraint)
+                    or constraint.name in existing):
+                continue
+            # Existing tables cannot be altered to hold a new constraint
+            # on all backends (e.g. SQLite), but a unique index is
+            # equivalent and can be added everywhere.
+            index = Index(constraint.name,
+                          *constraint.columns,
+                          unique=True)
+            try:
+                logger.info(f'Creating unique index {index.name}'
+                            f' on table {table.name}.')
+                index.create(engine)
+            except (IntegrityError, OperationalError):
+                logger.warning(
+                    f'Unable to create unique index {index.name} on table'
+                    f' {table.name} - remove duplicate rows first.')
+            finally:
+                table.indexes.discard(index)
+
+
+def read_schema_version(engine):
+    """Read the schema version stamp, 0 if the database is not stamped."""
+    query = select([Config.value]).where(Config.key == 'schema_version')
+    try:
+        with engine.connect() as conn:
+            value = conn.execute(query).scalar()
+    except (OperationalError, ProgrammingError):
+        # The config table does not exist yet.
+        return 0
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def write_schema_version(engine, version=SCHEMA_VERSION):
+    """Stamp the database with a schema version."""
+    table = Config.__table__
+    with engine.begin() as conn:
+        updated = conn.execute(
+            table.update().where(table.c.key == 'schema_version'),
+            value=str(version)).rowcount
+        if not updated:
+            conn.execute(table.insert(),
+                         key='schema_version', value=str(version))
+
+
 def create_db_session(db='', encoding=''):
     """Create a new database session."""
     if not db:
@@ -444,6 +653,18 @@ def create_db_session(db='', encoding=''):
     if not encoding:
         encoding = 'utf8'
     engine = create_engine(db, encoding=encoding)
-    Base.metadata.create_all(engine)
+    version = read_schema_version(engine)
+    if version < SCHEMA_VERSION:
+        Base.metadata.create_all(engine)
+        migrate(engine)
+        write_schema_version(engine)
+        logger.info(f'Database schema upgraded from version {version}'
+                    f' to {SCHEMA_VERSION}.')
+    elif version > SCHEMA_VERSION:
+        logger.warning(f'Database schema version {version} is newer than'
+                       f' the supported version {SCHEMA_VERSION}.')
     Base.metadata.bind = engine
-    return sessionmaker(bind=engine)()
+    # Objects are only changed by the controller during a run, hence they
+    # do not have to be reloaded after every commit. Controller.run expires
+    # them, so rows changed by other processes are reloaded every run.
+    return sessionmaker(bind=engine, expire_on_commit=False)()
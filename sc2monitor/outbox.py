@@ -0,0 +1,115 @@
+"""Append-only outbox of the changes of players for consumers to tail."""
+import json
+import logging
+import time
+from datetime import datetime
+
+from sqlalchemy import event, select
+
+import sc2monitor.model as model
+
+logger = logging.getLogger(__name__)
+
+EVENT_KINDS = ['match', 'mmr', 'league', 'name']
+
+
+class Outbox:
+    """Record the changes of players as events.
+
+    The events are added to the session of the controller, so they are
+    committed in the same transaction as the changes. As only the monitor
+    writes events, their sequence numbers grow in commit order. Nothing is
+    recorded unless enabled.
+
+    Listeners, e.g. sc2monitor.push.Hub.publish, get the events as dicts
+    once committed, even if the outbox is not enabled (without a sequence
+    number then).
+    """
+
+    def __init__(self, controller, enabled=False):
+        """Init the outbox of a controller."""
+        self.controller = controller
+        self.enabled = enabled
+        self.listeners = []
+        self._pending = []
+
+    def watch(self, db_session):
+        """Pass the events to the listeners once committed."""
+        event.listen(db_session, 'after_commit', self._after_commit)
+        event.listen(db_session, 'after_rollback', self._after_rollback)
+
+    def _after_commit(self, session):
+        if not self._pending:
+            return
+        rows, self._pending = self._pending, []
+        changes = [as_dict(row) for row in rows]
+        for listener in self.listeners:
+            try:
+                listener(changes)
+            except Exception:
+                logger.exception('Unable to pass events to a listener:')
+
+    def _after_rollback(self, session):
+        self._pending = []
+
+    def add(self, kind, player: model.Player, **data):
+        """Record an event of a player."""
+        if not self.enabled and not self.listeners:
+            return
+        row = model.Event(
+            datetime=datetime.now(), player_id=player.id, kind=kind,
+            data=json.dumps(data, separators=(',', ':'), default=str))
+        if self.enabled:
+            self.controller.db_session.add(row)
+        if self.listeners:
+            self._pending.append(row)
+
+    def match(self, match: model.Match):
+        """Record a new match."""
+        self.add('match', match.player, result=match.result.name,
+                 datetime=match.datetime, mmr=match.mmr,
+                 mmr_change=match.mmr_change, guess=match.guess)
+
+    def mmr(self, player: model.Player, mmr):
+        """Record a change of the MMR of a player."""
+        if mmr != player.mmr:
+            self.add('mmr', player, old=player.mmr, new=mmr)
+
+    def league(self, player: model.Player, league: model.League):
+        """Record a promotion or demotion of a player."""
+        if league != player.league:
+            self.add('league', player, old=player.league.name,
+                     new=league.name)
+
+    def name(self, player: model.Player, name):
+        """Record a change of the name of a player."""
+        self.add('name', player, old=player.name, new=name)
+
+
+def as_dict(row):
+    """Return an event as dict with its data."""
+    change = json.loads(row.data)
+    change.update(seq=row.id, time=row.datetime.isoformat(),
+                  player=row.player_id, kind=row.kind)
+    return change
+
+
+def read(db_session, cursor=0, limit=1000):
+    """Return up to limit events after the sequence number cursor."""
+    table = model.Event.__table__
+    return [as_dict(row) for row in db_session.execute(
+        select([table]).where(table.c.id > cursor).order_by(
+            table.c.id).limit(limit))]
+
+
+def tail(db_session, cursor=0, interval=1.0, limit=1000):
+    """Yield the events after cursor as they are committed, forever."""
+    while True:
+        events = read(db_session, cursor, limit)
+        # End the transaction to see events committed meanwhile.
+        db_session.rollback()
+        yield from events
+        if events:
+            cursor = events[-1]['seq']
+        if len(events) < limit:
+            time.sleep(interval)
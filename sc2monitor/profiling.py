@@ -0,0 +1,208 @@
+"""Profile single runs of the monitor."""
+import cProfile
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from sc2monitor.handlers import MSG_LENGTH
+
+logger = logging.getLogger(__name__)
+
+PROFILERS = ['cprofile', 'sampling']
+
+# Functions whose time is reported separately in the summaries.
+HOT_SPOTS = [
+    ('calc_statistics', 'controller.py', 'calc_statistics'),
+    ('guess_mmr_changes', 'controller.py', 'guess_mmr_changes'),
+    ('orm flush', 'session.py', 'flush'),
+    ('orm commit', 'session.py', 'commit'),
+    ('json decode', 'decoding.py', 'decode'),
+]
+
+
+def _is_wait(filename, function):
+    """Return whether a frame waits for I/O in the event loop."""
+    return filename.endswith('selectors.py') and function == 'select'
+
+
+def create_profiler(name, directory='', top=20):
+    """Return a profiler by name."""
+    if name == 'cprofile':
+        return CProfiler(directory, top)
+    if name == 'sampling':
+        return SamplingProfiler(directory, top)
+    raise ValueError(f"Invalid profiler '{name}'"
+                     f" (valid profilers: {', '.join(PROFILERS)})")
+
+
+class _Profiler:
+    """Profile the code between start and stop on the current thread."""
+
+    suffix = ''
+
+    def __init__(self, directory='', top=20):
+        self.directory = directory
+        self.top = top
+        self.path = ''
+        self.summary_path = ''
+        self._wall = 0.0
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        self._wall = time.perf_counter() - self._wall
+        self.path = os.path.join(
+            self.directory,
+            f'sc2monitor-{datetime.now():%Y%m%d-%H%M%S}{self.suffix}')
+        self.dump(self.path)
+        summary = self.summary()
+        self.summary_path = f'{self.path}.txt'
+        with open(self.summary_path, 'w', encoding='utf-8') as f:
+            f.write(summary)
+            f.write('\n')
+        # One record per line, as the log table holds short messages.
+        lines = summary.splitlines()
+        lines.append(f'Profile summary written to {self.summary_path}.')
+        for line in lines:
+            logger.info(line[:MSG_LENGTH])
+
+
+class CProfiler(_Profiler):
+    """Deterministic profiler based on cProfile.
+
+    A coroutine counts as returning whenever it awaits, so the time of
+    the coroutines only includes the time they actually run, while
+    waiting for http responses shows up in the select of the event loop.
+    """
+
+    suffix = '.prof'
+
+    def start(self):
+        """Start profiling."""
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def stop(self):
+        """Stop profiling."""
+        self._profile.disable()
+
+    def dump(self, path):
+        """Write the stats for pstats or e.g. snakeviz."""
+        self._profile.dump_stats(path)
+
+    def summary(self):
+        """Return the time of the hot spots and the top functions."""
+        stats = pstats.Stats(self._profile)
+        wait = 0.0
+        hot_spots = Counter()
+        for (filename, _, function), (_, _, tottime, cumtime, _) \
+                in stats.stats.items():
+            if _is_wait(filename, function):
+                wait += cumtime
+            for label, module, name in HOT_SPOTS:
+                if function == name and filename.endswith(module):
+                    hot_spots[label] += cumtime
+        lines = [f'Profiled run of {self._wall:.2f}s ({self.path}):',
+                 f'  waiting for I/O: {wait:.2f}s']
+        lines.extend(f'  {label}: {hot_spots[label]:.2f}s'
+                     for label, _, _ in HOT_SPOTS)
+        lines.append(f'  top {self.top} functions by own time'
+                     ' (own, cumulative, calls):')
+        stats.sort_stats('tottime')
+        for key in stats.fcn_list[:self.top]:
+            filename, line, function = key
+            _, calls, tottime, cumtime, _ = stats.stats[key]
+            lines.append(f'    {tottime:7.3f}s {cumtime:7.3f}s {calls:8d}'
+                         f' {os.path.basename(filename)}:{line}'
+                         f'({function})')
+        return '\n'.join(lines)
+
+
+class SamplingProfiler(_Profiler):
+    """Statistical profiler sampling the stack of the profiled thread.
+
+    Busy code holds the GIL and delays the sampling thread, so each
+    sample is weighted by the time since the previous one. The samples
+    are written as folded stacks in milliseconds, e.g. for flamegraph.pl
+    or speedscope. It adds less overhead than cProfile to the profiled run.
+    """
+
+    suffix = '.folded'
+
+    def __init__(self, directory='', top=20, interval=0.005):
+        """Init the profiler with a sampling interval in seconds."""
+        super().__init__(directory, top)
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Start sampling the current thread."""
+        self._thread_id = threading.get_ident()
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._sample, name='SamplingProfiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling."""
+        self._stopped.set()
+        self._thread.join()
+
+    def _sample(self):
+        last = time.perf_counter()
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            now = time.perf_counter()
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_name))
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += now - last
+            last = now
+
+    @staticmethod
+    def _name(filename, function):
+        return f'{os.path.basename(filename)}:{function}'
+
+    def dump(self, path):
+        """Write the samples as folded stacks."""
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, seconds in self.stacks.items():
+                f.write(';'.join(self._name(*frame) for frame in stack))
+                f.write(f' {round(seconds * 1000)}\n')
+
+    def summary(self):
+        """Return the share of the hot spots and the top functions."""
+        total = sum(self.stacks.values()) or 1.0
+        wait = 0.0
+        hot_spots = Counter()
+        functions = Counter()
+        for stack, count in self.stacks.items():
+            if stack and _is_wait(*stack[-1]):
+                wait += count
+            if stack:
+                functions[self._name(*stack[-1])] += count
+            for label, module, name in HOT_SPOTS:
+                if any(function == name and filename.endswith(module)
+                       for filename, function in stack):
+                    hot_spots[label] += count
+        lines = [f'Profiled run of {self._wall:.2f}s with'
+                 f' {len(self.stacks)} distinct stacks ({self.path}):',
+                 f'  waiting for I/O: {wait / total:.1%}']
+        lines.extend(f'  {label}: {hot_spots[label] / total:.1%}'
+                     for label, _, _ in HOT_SPOTS)
+        lines.append(f'  top {self.top} functions by own time:')
+        lines.extend(f'    {count / total:6.1%} {name}'
+                     for name, count in functions.most_common(self.top))
+        return '\n'.join(lines)
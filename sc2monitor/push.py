@@ -0,0 +1,221 @@
+"""Push the changes of players to subscribed clients in long-running mode.
+
+Clients subscribe to player ids (of the table player) via a WebSocket on
+/ws or server-sent events on /events, e.g.
+
+    /events?players=1,2,3
+
+and get the events of the outbox (see sc2monitor.outbox) of these players
+as JSON as soon as they are committed. WebSocket clients can change their
+subscriptions by sending {"subscribe": [4]} or {"unsubscribe": [1]}.
+"""
+import asyncio
+import json
+import logging
+
+from aiohttp import WSMsgType, web
+
+logger = logging.getLogger(__name__)
+
+
+class Subscriber:
+    """Client of the hub with a bounded queue of messages."""
+
+    __slots__ = ('players', 'queue', 'closed')
+
+    def __init__(self, size=100):
+        """Init the subscriber with the size of its queue."""
+        self.players = set()
+        self.queue = asyncio.Queue(max(1, size))
+        self.closed = False
+
+    async def get(self):
+        """Return the next message or None once closed."""
+        return await self.queue.get()
+
+    def close(self):
+        """Discard the queued messages and wake up the reader."""
+        if self.closed:
+            return
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class Hub:
+    """Fan out events to the subscribers of the players.
+
+    Every event is serialized once for all its subscribers. A subscriber
+    whose queue is full does not keep up and is dropped instead of
+    buffering without limit.
+    """
+
+    def __init__(self, queue_size=100):
+        """Init the hub with the queue size of the subscribers."""
+        self.queue_size = queue_size
+        self.subscribers = set()
+        self.published = 0
+        self.dropped = 0
+        self._players = {}
+
+    def connect(self, players=()):
+        """Return a new subscriber of some players."""
+        subscriber = Subscriber(self.queue_size)
+        self.subscribers.add(subscriber)
+        self.subscribe(subscriber, players)
+        return subscriber
+
+    def subscribe(self, subscriber, players):
+        """Subscribe to the events of players."""
+        if subscriber.closed:
+            return
+        for player in players:
+            subscriber.players.add(player)
+            self._players.setdefault(player, set()).add(subscriber)
+
+    def unsubscribe(self, subscriber, players):
+        """Unsubscribe from the events of players."""
+        for player in list(players):
+            subscriber.players.discard(player)
+            subscribers = self._players.get(player)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._players[player]
+
+    def disconnect(self, subscriber):
+        """Remove a subscriber and close it."""
+        self.unsubscribe(subscriber, subscriber.players)
+        self.subscribers.discard(subscriber)
+        subscriber.close()
+
+    def publish(self, changes):
+        """Queue events for the subscribers of their players."""
+        for change in changes:
+            subscribers = self._players.get(change['player'])
+            if not subscribers:
+                continue
+            message = json.dumps(change, separators=(',', ':'))
+            for subscriber in list(subscribers):
+                try:
+                    subscriber.queue.put_nowait(message)
+                except asyncio.QueueFull:
+                    self.dropped += 1
+                    logger.warning('Dropping a slow subscriber of players'
+                                   f' {sorted(subscriber.players)}.')
+                    self.disconnect(subscriber)
+            self.published += 1
+
+
+def _player_ids(values):
+    """Return player ids from a list or a comma separated string."""
+    if isinstance(values, str):
+        values = [value for value in values.split(',') if value.strip()]
+    try:
+        return {int(value) for value in values}
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid player ids {values!r}')
+
+
+class PushServer:
+    """aiohttp application serving the hub via WebSocket and SSE."""
+
+    def __init__(self, queue_size=100, heartbeat=30.0):
+        """Init the server and its hub."""
+        self.hub = Hub(queue_size)
+        self.heartbeat = heartbeat
+        self._runner = None
+
+    def app(self):
+        """Return the aiohttp application."""
+        app = web.Application()
+        app.router.add_get('/ws', self.websocket)
+        app.router.add_get('/events', self.events)
+        return app
+
+    @staticmethod
+    def _players(request):
+        try:
+            return _player_ids(request.query.get('players', ''))
+        except ValueError as error:
+            raise web.HTTPBadRequest(text=str(error))
+
+    async def websocket(self, request):
+        """Push the events of the subscribed players via a WebSocket."""
+        players = self._players(request)
+        ws = web.WebSocketResponse(heartbeat=self.heartbeat)
+        await ws.prepare(request)
+        subscriber = self.hub.connect(players)
+        reader = asyncio.create_task(self._read(ws, subscriber))
+        try:
+            while True:
+                message = await subscriber.get()
+                if message is None:
+                    break
+                await ws.send_str(message)
+        except ConnectionResetError:
+            pass
+        finally:
+            reader.cancel()
+            self.hub.disconnect(subscriber)
+            await ws.close()
+        return ws
+
+    async def _read(self, ws, subscriber):
+        """Change the subscriptions on request of the client."""
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            try:
+                request = json.loads(msg.data)
+                subscribe = _player_ids(request.get('subscribe', []))
+                unsubscribe = _player_ids(request.get('unsubscribe', []))
+            except (AttributeError, ValueError) as error:
+                await ws.send_json(dict(error=str(error)))
+                continue
+            self.hub.subscribe(subscriber, subscribe)
+            self.hub.unsubscribe(subscriber, unsubscribe)
+        # The client is gone, so stop waiting for messages.
+        self.hub.disconnect(subscriber)
+
+    async def events(self, request):
+        """Push the events of the subscribed players as server-sent events."""
+        players = self._players(request)
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache'})
+        await response.prepare(request)
+        subscriber = self.hub.connect(players)
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscriber.get(),
+                                                     self.heartbeat)
+                except asyncio.TimeoutError:
+                    await response.write(b': keep-alive\n\n')
+                    continue
+                if message is None:
+                    break
+                await response.write(f'data: {message}\n\n'.encode())
+        except ConnectionResetError:
+            pass
+        finally:
+            self.hub.disconnect(subscriber)
+        return response
+
+    async def start(self, host='127.0.0.1', port=9102):
+        """Serve the hub via http."""
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f'Pushing player events on ws://{host}:{port}/ws'
+                    f' and http://{host}:{port}/events')
+
+    async def stop(self):
+        """Disconnect all subscribers and stop serving."""
+        for subscriber in list(self.hub.subscribers):
+            self.hub.disconnect(subscriber)
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
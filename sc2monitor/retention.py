@@ -0,0 +1,122 @@
+"""Delete old rows of append-only tables (logs and runs)."""
+import logging
+from datetime import timedelta
+
+from sqlalchemy import and_, func, or_, select, text
+
+logger = logging.getLogger(__name__)
+
+
+def count_condition(db_session, table, keep):
+    """Return the condition of all rows but the newest keep rows or None."""
+    # Walks the datetime index for keep rows instead of the whole table.
+    cutoff = db_session.execute(
+        select([table.c.datetime, table.c.id]).order_by(
+            table.c.datetime.desc(), table.c.id.desc()).
+        offset(keep).limit(1)).first()
+    if cutoff is None:
+        return None
+    return or_(table.c.datetime < cutoff.datetime,
+               and_(table.c.datetime == cutoff.datetime,
+                    table.c.id <= cutoff.id))
+
+
+def age_condition(table, now, max_age):
+    """Return the condition of the rows older than max_age days."""
+    return table.c.datetime < now - timedelta(days=max_age)
+
+
+def delete_in_chunks(db_session, table, condition, chunk_size=10000,
+                     children=()):
+    """Delete the rows matching a condition in chunks, oldest first.
+
+    The rows referencing a deleted row by one of the `children` columns
+    are deleted with it.
+    """
+    query = select([table.c.id]).where(condition).order_by(
+        table.c.datetime).limit(chunk_size)
+    deletions = 0
+    while True:
+        ids = [row.id for row in db_session.execute(query)]
+        if not ids:
+            break
+        for column in children:
+            db_session.execute(
+                column.table.delete().where(column.in_(ids)))
+        db_session.execute(table.delete().where(table.c.id.in_(ids)))
+        db_session.commit()
+        deletions += len(ids)
+        if len(ids) < chunk_size:
+            break
+    return deletions
+
+
+def delete_orphans(db_session, column, parent_id):
+    """Delete the rows referencing ids below the oldest remaining parent."""
+    oldest = db_session.execute(select([func.min(parent_id)])).scalar()
+    table = column.table
+    condition = column < oldest if oldest is not None else column.isnot(None)
+    deletions = db_session.execute(table.delete().where(condition)).rowcount
+    db_session.commit()
+    return deletions
+
+
+def partition_name(day):
+    """Return the name of the partition of the rows before a day."""
+    return f'p{day:%Y%m%d}'
+
+
+def _partition(day):
+    return (f'PARTITION {partition_name(day)} VALUES LESS THAN '
+            f"(TO_DAYS('{day:%Y-%m-%d}'))")
+
+
+def partitions(connection, table):
+    """Return the names of the partitions of a MySQL table."""
+    return [row[0] for row in connection.execute(text(
+        'SELECT PARTITION_NAME FROM information_schema.PARTITIONS'
+        ' WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table'
+        ' AND PARTITION_NAME IS NOT NULL'
+        ' ORDER BY PARTITION_ORDINAL_POSITION'), table=table.name)]
+
+
+def maintain_partitions(engine, table, today, max_age, days_ahead=7):
+    """Partition a MySQL table by day and drop the expired partitions.
+
+    Each partition p<YYYYMMDD> holds the rows before that day, partitions
+    are kept `days_ahead` days in advance of today and a partition is
+    dropped once all of its rows are older than max_age days. Returns the
+    number of dropped partitions.
+    """
+    upcoming = [today + timedelta(days=days)
+                for days in range(1, days_ahead + 1)]
+    with engine.begin() as connection:
+        existing = partitions(connection, table)
+        if not existing:
+            logger.info(f'Partitioning table {table.name} by day.')
+            # The partitioning column has to be part of the primary key.
+            connection.execute(
+                f'ALTER TABLE {table.name} DROP PRIMARY KEY,'
+                ' ADD PRIMARY KEY (id, datetime)')
+            connection.execute(
+                f'ALTER TABLE {table.name} PARTITION BY RANGE'
+                ' (TO_DAYS(datetime))'
+                f" ({', '.join(map(_partition, upcoming))},"
+                ' PARTITION pmax VALUES LESS THAN MAXVALUE)')
+            existing = [partition_name(day) for day in upcoming] + ['pmax']
+        else:
+            missing = [day for day in upcoming
+                       if partition_name(day) not in existing]
+            if missing:
+                connection.execute(
+                    f'ALTER TABLE {table.name} REORGANIZE PARTITION pmax'
+                    f" INTO ({', '.join(map(_partition, missing))},"
+                    ' PARTITION pmax VALUES LESS THAN MAXVALUE)')
+
+        cutoff = partition_name(today - timedelta(days=max_age))
+        expired = [name for name in existing
+                   if name != 'pmax' and name <= cutoff]
+        if expired:
+            connection.execute(f'ALTER TABLE {table.name}'
+                               f" DROP PARTITION {', '.join(expired)}")
+    return len(expired)
@@ -2,15 +2,71 @@
 import asyncio
 import logging
 import re
+import time
 from datetime import datetime, timedelta
+from typing import NamedTuple
 
 from aiohttp import BasicAuth
 from aiohttp.client_exceptions import ClientResponseError, ContentTypeError
 
 import sc2monitor.model as model
+import sc2monitor.tracing as tracing
+from sc2monitor.cassette import Cassette
+from sc2monitor.decoding import (LADDER_FIELDS, LADDER_SUMMARY_FIELDS,
+                                 MATCH_HISTORY_FIELDS, Decoder)
 
 logger = logging.getLogger(__name__)
 
+API_URL = 'https://eu.api.blizzard.com'
+OAUTH_URL = 'https://eu.battle.net'
+
+
+class LadderEntry(NamedTuple):
+    """Entry of a player in a ladder."""
+
+    mmr: int
+    race: model.Race
+    games: int
+    wins: int
+    losses: int
+    name: str
+    joined: datetime
+    ladder_id: int
+    league: model.League
+
+
+class MatchEntry(NamedTuple):
+    """Entry of the match history of a player."""
+
+    result: model.Result
+    datetime: datetime
+
+
+class LadderIndex:
+    """Index of the teams of a ladder by (profile id, realm)."""
+
+    __slots__ = ('_teams',)
+
+    def __init__(self, ladder_teams):
+        """Index the teams of a ladder response."""
+        self._teams = {}
+        for idx, team in enumerate(ladder_teams):
+            player = team.get('teamMembers')[0]
+            self._teams.setdefault(
+                (int(player.get('id')), int(player.get('realm'))),
+                []).append(idx)
+
+    def find(self, profileID, realmID, start=0, used=()):
+        """Return the index of the first unused team of a player or None."""
+        for idx in self._teams.get((profileID, realmID), ()):
+            if idx >= start and idx not in used:
+                return idx
+        return None
+
+    def teams(self, profileID, realmID):
+        """Return the indices of all teams of a player."""
+        return self._teams.get((profileID, realmID), [])
+
 
 class SC2API:
     """Wrapper for the SC2 api."""
@@ -26,6 +82,13 @@ class SC2API:
         self._secret = ''
         self._access_token = ''
         self._access_token_checked = False
+        self._decoder = None
+        self._api_url = API_URL
+        self._oauth_url = OAUTH_URL
+        self._cassette = None
+        # Parsed ladders by (server, ladder id), see clear_ladders.
+        self._ladders = {}
+        self._ladder_locks = {}
         self.read_config()
         try:
             self._access_token_lock = asyncio.Lock()
@@ -33,6 +96,9 @@ class SC2API:
             self._access_token_lock = None
         self.request_count = 0
         self.retry_count = 0
+        self.in_flight = 0
+        self.metrics = getattr(controller, 'metrics', None)
+        self.exporter = getattr(controller, 'exporter', None)
 
         self._precompile()
 
@@ -55,15 +121,41 @@ class SC2API:
             'api_secret', raise_key_error=False)
         new_token = self._controller.get_config(
             'access_token', raise_key_error=False)
+        decoder = self._controller.get_config(
+            'json_decoder', raise_key_error=False)
+        base_url = self._controller.get_config(
+            'api_base_url', raise_key_error=False)
+        if base_url:
+            self._api_url = self._oauth_url = base_url.rstrip('/')
+        else:
+            self._api_url, self._oauth_url = API_URL, OAUTH_URL
+        self._cassette_path = self._controller.get_config(
+            'cassette', raise_key_error=False)
+        self._cassette_mode = self._controller.get_config(
+            'cassette_mode', raise_key_error=False) or 'record'
+        if self._decoder is None or self._decoder.name != (decoder or 'auto'):
+            self._decoder = Decoder(decoder)
 
         if self._access_token != new_token:
             self._access_token = new_token
             self._access_token_checked = False
 
+    def open_cassette(self):
+        """Start recording or replaying the requests, if configured."""
+        self.close_cassette()
+        if self._cassette_path:
+            self._cassette = Cassette(self._cassette_path, self._cassette_mode)
+
+    def close_cassette(self):
+        """Stop recording or replaying the requests."""
+        if self._cassette is not None:
+            self._cassette.close()
+            self._cassette = None
+
     async def check_access_token(self, token):
         """Check if the access token is valid for at least an hour."""
         async with self._session.get(
-                'https://eu.battle.net/oauth/check_token',
+                f'{self._oauth_url}/oauth/check_token',
                 params={'token': token}) as resp:
             self.request_count += 1
             valid = resp.status == 200
@@ -76,6 +168,8 @@ class SC2API:
 
     async def get_access_token(self):
         """Get an valid access token."""
+        if self._cassette is not None and self._cassette.replaying:
+            return 'replay'
         async with self._access_token_lock:
             if (not self._access_token
                 or (not self._access_token_checked
@@ -87,7 +181,8 @@ class SC2API:
     async def receive_new_access_token(self):
         """Receive a new acces token vai oauth."""
         data, status = await self._perform_api_post_request(
-            'https://eu.battle.net/oauth/token',
+            f'{self._oauth_url}/oauth/token',
+            endpoint='oauth_token',
             auth=BasicAuth(
                 self._key, self._secret),
             params={'grant_type': 'client_credentials'})
@@ -119,11 +214,12 @@ class SC2API:
 
     async def get_season(self, server: model.Server):
         """Collect the current season info."""
-        api_url = ('https://eu.api.blizzard.com/sc2/'
+        api_url = (f'{self._api_url}/sc2/'
                    f'ladder/season/{server.id()}')
         payload = {'locale': 'en_US',
                    'access_token': await self.get_access_token()}
-        data, status = await self._perform_api_request(api_url, params=payload)
+        data, status = await self._perform_api_request(
+            api_url, params=payload, endpoint='season')
         if status != 200:
             raise InvalidApiResponse(f'{status}: {api_url}')
 
@@ -136,6 +232,11 @@ class SC2API:
             end=datetime.fromtimestamp(int(data.get('endDate')))
         )
 
+    def clear_ladders(self):
+        """Forget the ladders requested during a run."""
+        self._ladders.clear()
+        self._ladder_locks.clear()
+
     async def get_metadata(self, player: model.Player):
         """Collect meta data for a player."""
         return await self._get_metadata(
@@ -160,12 +261,14 @@ class SC2API:
     async def _get_ladders(self, server: model.Server,
                            realmID, profileID, scope='1v1'):
         """Collect all ladder of a scope where a player is ranked."""
-        api_url = ('https://eu.api.blizzard.com/sc2/'
+        api_url = (f'{self._api_url}/sc2/'
                    f'profile/{server.id()}/{realmID}/{profileID}/'
                    'ladder/summary')
         payload = {'locale': 'en_US',
                    'access_token': await self.get_access_token()}
-        data, status = await self._perform_api_request(api_url, params=payload)
+        data, status = await self._perform_api_request(
+            api_url, params=payload, fields=LADDER_SUMMARY_FIELDS,
+            endpoint='ladder_summary')
         if status != 200:
             raise InvalidApiResponse(f'{status}: {api_url}')
         data = data.get('allLadderMemberships', [])
@@ -180,167 +283,253 @@ class SC2API:
     async def _get_metadata(self, server: model.Server,
                             realmID, profileID):
         """Collect a player's meta data."""
-        api_url = ('https://eu.api.blizzard.com/sc2/'
+        api_url = (f'{self._api_url}/sc2/'
                    f'metadata/profile/{server.id()}/{realmID}/{profileID}')
         payload = {'locale': 'en_US',
                    'access_token': await self.get_access_token()}
-        data, status = await self._perform_api_request(api_url, params=payload)
+        data, status = await self._perform_api_request(
+            api_url, params=payload, endpoint='metadata')
         if status != 200:
             raise InvalidApiResponse(f'{status}: {api_url}')
         return data
 
     async def _get_ladder_data(self, server: model.Server,
                                realmID, profileID, ladderID):
-        """Collect data of a specific player's ladder."""
-        api_url = ('https://eu.api.blizzard.com/sc2/profile/'
+        """Collect data of a specific player's ladder.
+
+        A ladder contains the teams of all its players, so it is requested
+        only once per run (until clear_ladders) for all players in it.
+        Requests are recorded or replayed per player, so every player
+        requests the ladder while a cassette is open.
+        """
+        if self._cassette is not None:
+            entries = await self._request_ladder_data(
+                server, realmID, profileID, ladderID)
+        else:
+            key = (server, int(ladderID))
+            async with self._ladder_locks.setdefault(key, asyncio.Lock()):
+                entries = self._cached_ladder_data(key, realmID, profileID)
+                if entries is None:
+                    entries = await self._request_ladder_data(
+                        server, realmID, profileID, ladderID)
+        for entry in entries:
+            yield entry
+
+    def _cached_ladder_data(self, key, realmID, profileID):
+        """Return the entries of a player in a ladder of this run or None."""
+        if key not in self._ladders:
+            return None
+        league, teams, index = self._ladders[key]
+        team_idxs = index.teams(profileID, realmID)
+        if not team_idxs:
+            return None
+        return [self._ladder_entry(teams[idx], teams[idx].get('mmr'),
+                                   key[1], league)
+                for idx in team_idxs]
+
+    async def _request_ladder_data(self, server: model.Server,
+                                   realmID, profileID, ladderID):
+        """Request a ladder and return the entries of a player in it."""
+        api_url = (f'{self._api_url}/sc2/profile/'
                    f'{server.id()}/{realmID}/{profileID}/ladder/{ladderID}')
         payload = {'locale': 'en_US',
                    'access_token': await self.get_access_token()}
-        data, status = await self._perform_api_request(api_url, params=payload)
+        data, status = await self._perform_api_request(
+            api_url, params=payload, fields=LADDER_FIELDS,
+            endpoint='ladder')
         if status != 200:
             raise InvalidApiResponse(f'{status}: {api_url}')
 
         league = model.League.get(data.get('league'))
+        teams = data.get('ladderTeams')
+        index = LadderIndex(teams)
         found_idx = -1
-        found = 0
         used = set()
+        entries = []
         for meta_data in data.get('ranksAndPools'):
             mmr = meta_data.get('mmr')
 
             try:
                 idx = meta_data.get('rank') - 1
-                team = data.get('ladderTeams')[idx]
+                team = teams[idx]
                 player = team.get('teamMembers')[0]
                 used.add(idx)
                 if (int(player.get('id')) != profileID
                         or int(player.get('realm')) != realmID):
                     raise InvalidApiResponse(api_url)
             except (IndexError, InvalidApiResponse):
-                found = False
-                for team_idx in range(
-                        found_idx + 1, len(data.get('ladderTeams'))):
-                    team = data.get('ladderTeams')[team_idx]
-                    player = team.get('teamMembers')[0]
-                    if (team_idx not in used):
-                        used.add(team_idx)
-                        if (int(player.get('id')) == profileID
-                                and int(player.get('realm')) == realmID):
-                            found_idx = team_idx
-                            found = True
-                            break
-
-                if not found:
+                team_idx = index.find(profileID, realmID,
+                                      start=found_idx + 1, used=used)
+                if team_idx is None:
                     raise InvalidApiResponse(api_url)
+                used.add(team_idx)
+                found_idx = team_idx
+                team = teams[team_idx]
 
             if mmr != team.get('mmr'):
                 logger.debug(
                     f'{api_url}: MMR in ladder request'
                     f" does not match {mmr} vs {team.get('mmr')}.")
-                mmr = team.get('mmr', mmr)
-            race = player.get('favoriteRace')
-            games = int(team.get('wins')) + int(team.get('losses'))
-
-            if mmr is None:
-                raise InvalidApiResponse(api_url)
-
-            yield {
-                'mmr': int(mmr),
-                'race': model.Race.get(race),
-                'games': games,
-                'wins': int(team.get('wins')),
-                'losses': int(team.get('losses')),
-                'name': player.get('displayName'),
-                'joined': datetime.fromtimestamp(team.get('joinTimestamp')),
-                'ladder_id': int(ladderID),
-                'league': league}
+            entries.append(self._ladder_entry(team, mmr, ladderID, league,
+                                              api_url))
+        self._ladders[server, int(ladderID)] = (league, teams, index)
+        return entries
+
+    @staticmethod
+    def _ladder_entry(team, mmr, ladderID, league, api_url=''):
+        """Return the ladder entry of a team."""
+        player = team.get('teamMembers')[0]
+        mmr = team.get('mmr', mmr)
+        if mmr is None:
+            raise InvalidApiResponse(api_url)
+        wins = int(team.get('wins'))
+        losses = int(team.get('losses'))
+        return LadderEntry(
+            mmr=int(mmr),
+            race=model.Race.get(player.get('favoriteRace')),
+            games=wins + losses,
+            wins=wins,
+            losses=losses,
+            name=player.get('displayName'),
+            joined=datetime.fromtimestamp(team.get('joinTimestamp')),
+            ladder_id=int(ladderID),
+            league=league)
 
     async def _get_match_history(self, server: model.Server,
                                  realmID, profileID, scope='1v1'):
         """Collect matches of a specific scope from the match history."""
-        api_url = ('https://eu.api.blizzard.com/sc2/legacy/profile/'
+        api_url = (f'{self._api_url}/sc2/legacy/profile/'
                    f'{server.id()}/{realmID}/{profileID}/matches')
         payload = {'locale': 'en_US',
                    'access_token': await self.get_access_token()}
-        data, status = await self._perform_api_request(api_url, params=payload)
+        data, status = await self._perform_api_request(
+            api_url, params=payload, fields=MATCH_HISTORY_FIELDS,
+            endpoint='match_history')
         if status != 200:
             raise InvalidApiResponse(f'{status}: {api_url}')
 
-        match_history = []
-        for match in data.get('matches', []):
-            if match['type'] == scope:
-                match_data = {
-                    'result': model.Result.get(match['decision']),
-                    'datetime': datetime.fromtimestamp(match['date'])}
-                match_history.append(match_data)
-
-        return match_history
+        return [MatchEntry(model.Result.get(match['decision']),
+                           datetime.fromtimestamp(match['date']))
+                for match in data.get('matches', [])
+                if match['type'] == scope]
 
-    async def _perform_api_post_request(self, url, **kwargs):
+    async def _perform_api_post_request(self, url, endpoint='other',
+                                        **kwargs):
         """Perform a generic api request (including retries)."""
         error = ''
         json = {}
         max_retries = 5
         for retries in range(max_retries):
-            async with self._session.post(url, **kwargs) as resp:
-                self.request_count += 1
-                status = resp.status
-                if resp.status == 504:
-                    error = 'API timeout'
-                    self.retry_count += 1
-                    continue
-                try:
-                    resp.raise_for_status()
-                except ClientResponseError:
-                    error = f'{resp.status}: {resp.reason}'
-                    continue
-                try:
-                    json = await resp.json()
-                except ContentTypeError:
-                    error = 'Unable to decode JSON'
-                    self.retry_count += 1
-                    status = 0
-                    continue
-                json['request_datetime'] = datetime.now()
-                break
+            start = time.perf_counter()
+            resp = None
+            self.in_flight += 1
+            try:
+                async with self._session.post(url, **kwargs) as resp:
+                    self.request_count += 1
+                    status = resp.status
+                    if resp.status == 504:
+                        error = 'API timeout'
+                        self.retry_count += 1
+                        self._record_retry(endpoint, 'timeout')
+                        continue
+                    try:
+                        resp.raise_for_status()
+                    except ClientResponseError:
+                        error = f'{resp.status}: {resp.reason}'
+                        self._record_retry(endpoint, str(resp.status))
+                        continue
+                    try:
+                        json = await resp.json()
+                    except (ContentTypeError, ValueError):
+                        error = 'Unable to decode JSON'
+                        self.retry_count += 1
+                        self._record_retry(endpoint, 'decode')
+                        status = 0
+                        continue
+                    json['request_datetime'] = datetime.now()
+                    break
+            finally:
+                self.in_flight -= 1
+                self._record_request(endpoint, start, resp)
 
         if retries == max_retries - 1 and error:
             logger.warning(error)
 
         return json, status
 
-    async def _perform_api_request(self, url, **kwargs):
-        """Perform a generic api request (including retries)."""
+    async def _perform_api_request(self, url, fields=None,
+                                   endpoint='other', **kwargs):
+        """Perform a generic api request (including retries).
+
+        If fields are given, a streaming decoder keeps only these fields of
+        the response, see sc2monitor.decoding.
+        """
+        if self._cassette is not None and self._cassette.replaying:
+            self.request_count += 1
+            return await self._cassette.replay(
+                'GET', url, kwargs.get('params'))
+        started = time.perf_counter()
         error = ''
         json = {}
         max_retries = 5
         for retries in range(max_retries):
-            async with self._session.get(url, **kwargs) as resp:
-                self.request_count += 1
-                status = resp.status
-                if resp.status == 504:
-                    error = 'API timeout'
-                    self.retry_count += 1
-                    continue
-                try:
-                    resp.raise_for_status()
-                except ClientResponseError:
-                    error = f'{resp.status}: {resp.reason}'
-                    continue
-                try:
-                    json = await resp.json()
-                except ContentTypeError:
-                    error = 'Unable to decode JSON'
-                    self.retry_count += 1
-                    status = 0
-                    continue
-                json['request_datetime'] = datetime.now()
-                break
+            start = time.perf_counter()
+            resp = None
+            self.in_flight += 1
+            try:
+                async with self._session.get(url, **kwargs) as resp:
+                    self.request_count += 1
+                    status = resp.status
+                    if resp.status == 504:
+                        error = 'API timeout'
+                        self.retry_count += 1
+                        self._record_retry(endpoint, 'timeout')
+                        continue
+                    try:
+                        resp.raise_for_status()
+                    except ClientResponseError:
+                        error = f'{resp.status}: {resp.reason}'
+                        self._record_retry(endpoint, str(resp.status))
+                        continue
+                    try:
+                        json = await self._decoder.decode(resp, fields)
+                    except (ContentTypeError, ValueError):
+                        error = 'Unable to decode JSON'
+                        self.retry_count += 1
+                        self._record_retry(endpoint, 'decode')
+                        status = 0
+                        continue
+                    json['request_datetime'] = datetime.now()
+                    break
+            finally:
+                self.in_flight -= 1
+                self._record_request(endpoint, start, resp)
 
         if retries == max_retries - 1 and error:
             logger.warning(error)
 
+        if self._cassette is not None:
+            self._cassette.record('GET', url, kwargs.get('params'), json,
+                                  status, time.perf_counter() - started)
         return json, status
 
+    def _record_request(self, endpoint, start, resp):
+        """Record the latency of an api request in the metrics."""
+        if resp is None:
+            tracing.record(endpoint, start, status=None)
+            return
+        tracing.record(endpoint, start, status=resp.status)
+        if self.metrics is not None:
+            self.metrics.request(endpoint, time.perf_counter() - start,
+                                 resp.content_length or 0)
+        if self.exporter is not None:
+            self.exporter.request(endpoint, resp.status)
+
+    def _record_retry(self, endpoint, reason):
+        """Count a retried api request in the exported metrics."""
+        if self.exporter is not None:
+            self.exporter.retry(endpoint, reason)
+
 
 class InvalidApiResponse(Exception):
     """Invalid API Response exception."""
@@ -0,0 +1,144 @@
+"""Store the api data consumed by runs for offline reprocessing."""
+import hashlib
+import json
+import logging
+import zlib
+from datetime import datetime
+
+from sqlalchemy import func, select
+
+import sc2monitor.model as model
+from sc2monitor.sc2api import LadderEntry, MatchEntry
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+
+def _ladders(entries):
+    return [[entry.mmr, entry.race.name, entry.games, entry.wins,
+             entry.losses, entry.name, entry.joined.isoformat(),
+             entry.ladder_id, entry.league.name] for entry in entries]
+
+
+def digest(entries):
+    """Return the digest of ladder entries to detect changes."""
+    return hashlib.sha1(json.dumps(
+        _ladders(entries), separators=(',', ':')).encode()).hexdigest()
+
+
+def encode(season, entries, match_history=None, base=False):
+    """Return the compressed payload of a snapshot.
+
+    The match history is only part of snapshots of runs that requested it.
+    Base snapshots hold the first ladder data of a player, so the matches
+    of the player can be rebuilt from its snapshots.
+    """
+    payload = dict(version=SNAPSHOT_VERSION, season=season, base=base,
+                   ladders=_ladders(entries))
+    if match_history is not None:
+        payload['matches'] = [[match.result.name, match.datetime.isoformat()]
+                              for match in match_history]
+    return zlib.compress(json.dumps(
+        payload, separators=(',', ':')).encode())
+
+
+def decode(data):
+    """Return the season, ladder entries, match history and base flag."""
+    payload = json.loads(zlib.decompress(data))
+    if payload.get('version') != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version"
+                         f" {payload.get('version')}")
+    entries = [LadderEntry(mmr, model.Race[race], games, wins, losses,
+                           name, datetime.fromisoformat(joined), ladder_id,
+                           model.League[league])
+               for (mmr, race, games, wins, losses, name, joined,
+                    ladder_id, league) in payload['ladders']]
+    match_history = payload.get('matches')
+    if match_history is not None:
+        match_history = [MatchEntry(model.Result[result],
+                                    datetime.fromisoformat(played))
+                         for result, played in match_history]
+    return payload['season'], entries, match_history, payload['base']
+
+
+class SnapshotStore:
+    """Append-only store of the api data of players per run.
+
+    A snapshot is only added if the ladder entries of a player changed
+    since the last one, as unchanged entries mean no new matches. The
+    snapshots of a run are buffered and written at once by flush.
+    """
+
+    def __init__(self, db_session):
+        """Init the store."""
+        self.db_session = db_session
+        self.added = 0
+        self.unchanged = 0
+        self._digests = None
+        self._rows = []
+
+    def load(self):
+        """Load the digest of the latest snapshot of every player."""
+        table = model.Snapshot.__table__
+        latest = select([func.max(table.c.id)]).group_by(
+            table.c.player_id, table.c.realm, table.c.server)
+        self._digests = {
+            (row.player_id, row.realm, row.server): row.digest
+            for row in self.db_session.execute(
+                select([table.c.player_id, table.c.realm, table.c.server,
+                        table.c.digest]).where(table.c.id.in_(latest)))}
+
+    def add(self, player: model.Player, season, entries, match_history=None,
+            base=False, now=None, processed=False):
+        """Add a snapshot of a player unless nothing changed.
+
+        Unchanged ladder data is stored again if games were processed,
+        e.g. when assigned to a race row created in this run.
+        """
+        if self._digests is None:
+            self.load()
+        key = (player.player_id, player.realm, player.server)
+        entries_digest = digest(entries)
+        if self._digests.get(key) == entries_digest and not processed:
+            self.unchanged += 1
+            return False
+        self._rows.append(dict(
+            player_id=player.player_id, realm=player.realm,
+            server=player.server, datetime=now or datetime.now(),
+            digest=entries_digest,
+            data=encode(season, entries, match_history, base)))
+        self._digests[key] = entries_digest
+        self.added += 1
+        return True
+
+    def flush(self):
+        """Write the buffered snapshots."""
+        rows, self._rows = self._rows, []
+        if rows:
+            self.db_session.execute(model.Snapshot.__table__.insert(), rows)
+            self.db_session.commit()
+
+    def starts(self):
+        """Return per player whether its snapshots start with a base one."""
+        table = model.Snapshot.__table__
+        first = select([func.min(table.c.id)]).group_by(
+            table.c.player_id, table.c.realm, table.c.server)
+        return {(row.player_id, row.realm, row.server): decode(row.data)[3]
+                for row in self.db_session.execute(
+                    select([table.c.player_id, table.c.realm,
+                            table.c.server, table.c.data]).where(
+                        table.c.id.in_(first)))}
+
+    def iterate(self, chunk_size=1000):
+        """Yield all snapshots in the order they were added."""
+        table = model.Snapshot.__table__
+        last_id = 0
+        while True:
+            rows = self.db_session.execute(
+                select([table]).where(table.c.id > last_id).order_by(
+                    table.c.id).limit(chunk_size)).fetchall()
+            if not rows:
+                return
+            yield from rows
+            last_id = rows[-1].id
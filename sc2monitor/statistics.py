@@ -0,0 +1,592 @@
+"""Compute player statistics over windows of recent matches."""
+import math
+from collections import deque
+from typing import NamedTuple
+
+import sc2monitor.model as model
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Losses shorter than this (in seconds) count as instantly left games.
+INSTANT_LEAVE_SECONDS = 120
+
+
+class WindowMatch(NamedTuple):
+    """Match of a rolling window."""
+
+    mmr: int
+    result: model.Result
+    guess: bool
+    max_length: float
+
+
+class StatisticsAccumulator:
+    """Accumulate statistics of matches added from newest to oldest.
+
+    The values of every prefix (the N most recent matches) are available
+    at any time, hence several window sizes can be read from one scan.
+    """
+
+    __slots__ = ('games', 'sum_mmr', 'sum_idx_mmr', 'sum_mmr2',
+                 'max_mmr', 'min_mmr', 'wins', 'losses', 'guessed_games',
+                 'instant_left_games', 'longest_wining_streak',
+                 'longest_losing_streak', '_streak_result', '_streak')
+
+    def __init__(self):
+        """Init an empty accumulator."""
+        self.games = 0
+        self.sum_mmr = 0
+        self.sum_idx_mmr = 0
+        self.sum_mmr2 = 0
+        self.max_mmr = None
+        self.min_mmr = None
+        self.wins = 0
+        self.losses = 0
+        self.guessed_games = 0
+        self.instant_left_games = 0
+        self.longest_wining_streak = 0
+        self.longest_losing_streak = 0
+        self._streak_result = None
+        self._streak = 0
+
+    def add(self, mmr, result, guess=False, max_length=180):
+        """Add the next older match."""
+        self.sum_idx_mmr += self.games * mmr
+        self.games += 1
+        self.sum_mmr += mmr
+        self.sum_mmr2 += mmr * mmr
+        if self.max_mmr is None or mmr > self.max_mmr:
+            self.max_mmr = mmr
+        if self.min_mmr is None or mmr < self.min_mmr:
+            self.min_mmr = mmr
+        if guess:
+            self.guessed_games += 1
+
+        if result == model.Result.Win:
+            self.wins += 1
+        elif result == model.Result.Loss:
+            self.losses += 1
+            if max_length <= INSTANT_LEAVE_SECONDS:
+                self.instant_left_games += 1
+        else:
+            return
+
+        if result == self._streak_result:
+            self._streak += 1
+        else:
+            self._streak_result = result
+            self._streak = 1
+        if result == model.Result.Win:
+            self.longest_wining_streak = max(
+                self.longest_wining_streak, self._streak)
+        else:
+            self.longest_losing_streak = max(
+                self.longest_losing_streak, self._streak)
+
+    def add_match(self, match: model.Match):
+        """Add the next older match from a database entry."""
+        self.add(match.mmr, match.result, match.guess, match.max_length)
+
+    def values(self, current_mmr):
+        """Return the statistics of the matches added so far."""
+        return statistics_values(
+            self.games, self.sum_mmr, self.sum_idx_mmr, self.sum_mmr2,
+            self.max_mmr, self.min_mmr, current_mmr,
+            wins=self.wins,
+            losses=self.losses,
+            guessed_games=self.guessed_games,
+            instant_left_games=self.instant_left_games,
+            longest_wining_streak=self.longest_wining_streak,
+            longest_losing_streak=self.longest_losing_streak)
+
+
+class RollingStatistics:
+    """Statistics of a sliding window over the most recent matches.
+
+    Matches are pushed from oldest to newest and the oldest match is
+    evicted once the window is full. Sums are kept exactly as integers,
+    minimum, maximum and the longest streaks via monotonic queues, hence
+    every update takes constant (amortized) time independent of the
+    window size.
+    """
+
+    __slots__ = ('size', 'matches', 'newest', 'sum_mmr', 'sum_seq_mmr',
+                 'sum_mmr2', 'wins', 'losses', 'guessed_games',
+                 'instant_left_games', '_seq', '_max', '_min', '_runs',
+                 '_longest')
+
+    def __init__(self, size):
+        """Init an empty window holding up to size matches."""
+        self.size = size
+        self.matches = deque()
+        self.newest = None
+        self.sum_mmr = 0
+        self.sum_seq_mmr = 0
+        self.sum_mmr2 = 0
+        self.wins = 0
+        self.losses = 0
+        self.guessed_games = 0
+        self.instant_left_games = 0
+        self._seq = 0
+        self._max = deque()
+        self._min = deque()
+        self._runs = deque()
+        self._longest = {model.Result.Win: deque(),
+                         model.Result.Loss: deque()}
+
+    def is_older(self, matches):
+        """Test if the window only holds matches older than new matches."""
+        if self.newest is None or not matches:
+            return True
+        return all(match.datetime > self.newest[1] for match in matches)
+
+    def push_match(self, match: model.Match):
+        """Push a new match from a database entry."""
+        self.push(match.mmr, match.result, match.guess, match.max_length)
+        self.newest = (match.id, match.datetime)
+
+    def push(self, mmr, result, guess=False, max_length=180):
+        """Push a new match and evict the oldest if the window is full."""
+        if self.size <= 0:
+            return
+        if len(self.matches) >= self.size:
+            self._evict()
+        self._seq += 1
+        entry = (self._seq, mmr, result, guess, max_length)
+        self.matches.append(entry)
+        self.sum_mmr += mmr
+        self.sum_seq_mmr += self._seq * mmr
+        self.sum_mmr2 += mmr * mmr
+        if guess:
+            self.guessed_games += 1
+
+        while self._max and self._max[-1][1] <= mmr:
+            self._max.pop()
+        self._max.append(entry)
+        while self._min and self._min[-1][1] >= mmr:
+            self._min.pop()
+        self._min.append(entry)
+
+        if result == model.Result.Win:
+            self.wins += 1
+        elif result == model.Result.Loss:
+            self.losses += 1
+            if max_length <= INSTANT_LEAVE_SECONDS:
+                self.instant_left_games += 1
+        else:
+            return
+
+        longest = self._longest[result]
+        if self._runs and self._runs[-1][0] == result:
+            run = self._runs[-1]
+            run[1] += 1
+            # The current run is always the last candidate.
+            longest.pop()
+        else:
+            run = [result, 1]
+            self._runs.append(run)
+        while longest and longest[-1][1] <= run[1]:
+            longest.pop()
+        longest.append(run)
+
+    def _evict(self):
+        """Remove the oldest match of the window."""
+        seq, mmr, result, guess, max_length = self.matches.popleft()
+        self.sum_mmr -= mmr
+        self.sum_seq_mmr -= seq * mmr
+        self.sum_mmr2 -= mmr * mmr
+        if guess:
+            self.guessed_games -= 1
+        if self._max[0][0] == seq:
+            self._max.popleft()
+        if self._min[0][0] == seq:
+            self._min.popleft()
+
+        if result == model.Result.Win:
+            self.wins -= 1
+        elif result == model.Result.Loss:
+            self.losses -= 1
+            if max_length <= INSTANT_LEAVE_SECONDS:
+                self.instant_left_games -= 1
+        else:
+            return
+
+        run = self._runs[0]
+        run[1] -= 1
+        if run[1] == 0:
+            self._runs.popleft()
+        longest = self._longest[result]
+        if longest[0] is run and (
+                run[1] == 0
+                or (len(longest) > 1 and longest[1][1] > run[1])):
+            # The oldest run only shrinks and can't become the longest.
+            longest.popleft()
+
+    def values(self, current_mmr):
+        """Return the statistics of the matches in the window."""
+        games = len(self.matches)
+        return statistics_values(
+            games, self.sum_mmr,
+            # Index of a match counted from the most recent one.
+            self._seq * self.sum_mmr - self.sum_seq_mmr,
+            self.sum_mmr2,
+            self._max[0][1] if self._max else None,
+            self._min[0][1] if self._min else None,
+            current_mmr,
+            wins=self.wins,
+            losses=self.losses,
+            guessed_games=self.guessed_games,
+            instant_left_games=self.instant_left_games,
+            longest_wining_streak=self._longest_streak(model.Result.Win),
+            longest_losing_streak=self._longest_streak(model.Result.Loss))
+
+    def _longest_streak(self, result):
+        longest = self._longest[result]
+        return longest[0][1] if longest else 0
+
+    def horizons(self, current_mmr, horizons):
+        """Compute statistics over numbers of most recent matches.
+
+        Like compute_horizons for horizons up to the size of the window.
+        """
+        return compute_horizons(
+            (WindowMatch(*entry[1:]) for entry in reversed(self.matches)),
+            current_mmr, horizons)
+
+
+def parse_horizons(value):
+    """Parse a comma separated list of horizons, e.g. '25,100,season'."""
+    horizons = []
+    for horizon in str(value or '').split(','):
+        horizon = horizon.strip().lower()
+        if not horizon:
+            continue
+        if horizon == 'season':
+            horizons.append(horizon)
+        elif horizon.isdigit() and int(horizon) > 0:
+            horizons.append(int(horizon))
+        else:
+            raise ValueError(f'Invalid statistics horizon {horizon}')
+    return horizons
+
+
+def compute_horizons(matches, current_mmr, horizons, season_start=None):
+    """Compute statistics over several horizons in a single pass.
+
+    The matches have to be ordered from newest to oldest, a horizon is
+    either the number of most recent matches or 'season' for all matches
+    played since season_start. The scan stops once all horizons are
+    complete, hence its cost grows with the largest horizon only.
+    """
+    windows = sorted({horizon for horizon in horizons
+                      if horizon != 'season'})
+    season = 'season' in horizons and season_start is not None
+    accumulator = StatisticsAccumulator()
+    values = {}
+
+    def snapshot(horizon):
+        values[str(horizon)] = horizon_values(accumulator, current_mmr)
+
+    for match in matches:
+        if season and match.datetime < season_start:
+            snapshot('season')
+            season = False
+        if not windows and not season:
+            break
+        accumulator.add_match(match)
+        while windows and accumulator.games >= windows[0]:
+            snapshot(windows.pop(0))
+
+    # Fewer matches than a horizon covers are available.
+    for horizon in windows:
+        snapshot(horizon)
+    if season:
+        snapshot('season')
+    return values
+
+
+def horizon_values(accumulator, current_mmr):
+    """Return the statistics of an accumulator including games/winrate."""
+    values = accumulator.values(current_mmr)
+    decided = values['wins'] + values['losses']
+    values['games'] = accumulator.games
+    values['winrate'] = values['wins'] / decided if decided else 0.0
+    return values
+
+
+def statistics_values(games, sum_mmr, sum_idx_mmr, sum_mmr2,
+                      max_mmr, min_mmr, current_mmr, **counts):
+    """Derive the statistics from the sums over the last games.
+
+    The index of a match is its position counted from the most recent
+    match (0) and sum_idx_mmr is the sum of index times MMR.
+    """
+    if current_mmr is None:
+        current_mmr = 0
+    values = dict(counts)
+    values['current_mmr'] = current_mmr
+    values['max_mmr'] = current_mmr if max_mmr is None \
+        else max(current_mmr, max_mmr)
+    values['min_mmr'] = current_mmr if min_mmr is None \
+        else min(current_mmr, min_mmr)
+
+    if games == 0:
+        values.update(avg_mmr=0.0, wma_mmr=0.0, sd_mmr=0,
+                      lr_mmr_slope=0.0, lr_mmr_intercept=0.0)
+        return values
+
+    avg_mmr = sum_mmr / games
+    values['avg_mmr'] = avg_mmr
+    # The most recent match has the weight N, the oldest the weight 1.
+    values['wma_mmr'] = (games * sum_mmr - sum_idx_mmr) \
+        / (games * (games + 1) / 2.0)
+    values['sd_mmr'] = round(
+        math.sqrt(games * sum_mmr2 - sum_mmr * sum_mmr) / games)
+
+    if games <= 1:
+        values['lr_mmr_slope'] = 0.0
+        values['lr_mmr_intercept'] = avg_mmr
+    else:
+        # Linear regression with x = -index, i.e. the intercept is the
+        # estimated MMR of the most recent match.
+        slope = 6.0 * ((games - 1) * sum_mmr - 2 * sum_idx_mmr) \
+            / (games * (games * games - 1))
+        values['lr_mmr_slope'] = slope
+        values['lr_mmr_intercept'] = avg_mmr + slope * (games - 1) / 2.0
+    return values
+
+
+def compute_statistics(matches, current_mmr):
+    """Compute the statistics of matches ordered from newest to oldest."""
+    accumulator = StatisticsAccumulator()
+    for match in matches:
+        accumulator.add_match(match)
+    return accumulator.values(current_mmr)
+
+
+def same_statistics(values, other, rel_tol=1e-9, abs_tol=1e-6):
+    """Compare two sets of statistics allowing for rounding errors."""
+    if values.keys() != other.keys():
+        return False
+    return all(math.isclose(values[key], other[key],
+                            rel_tol=rel_tol, abs_tol=abs_tol)
+               for key in values)
+
+
+def compute_bulk_statistics(player_ids, mmrs, results, guesses, max_lengths,
+                            current_mmrs, limit=None):
+    """Compute the statistics of many players at once.
+
+    The match columns have to be grouped by player and ordered from
+    newest to oldest match within each group, results are given by the
+    value of model.Result. Only the first limit matches of each player
+    are used. Returns a dict mapping a player id to its statistics.
+    Uses NumPy if available.
+    """
+    if np is None:
+        return _compute_bulk_statistics_python(
+            player_ids, mmrs, results, guesses, max_lengths, current_mmrs,
+            limit)
+
+    player_ids = np.asarray(player_ids, dtype=np.int64)
+    if len(player_ids) == 0:
+        return {}
+    mmrs = np.asarray(mmrs, dtype=np.int64)
+    results = np.asarray(results, dtype=np.int8)
+    guesses = np.asarray(guesses, dtype=bool)
+    max_lengths = np.asarray(max_lengths, dtype=np.int64)
+
+    if limit is not None:
+        starts = np.flatnonzero(
+            np.r_[True, player_ids[1:] != player_ids[:-1]])
+        games = np.diff(np.r_[starts, len(player_ids)])
+        idx = np.arange(len(player_ids)) - np.repeat(starts, games)
+        keep = idx < limit
+        player_ids = player_ids[keep]
+        mmrs = mmrs[keep]
+        results = results[keep]
+        guesses = guesses[keep]
+        max_lengths = max_lengths[keep]
+
+    starts = np.flatnonzero(
+        np.r_[True, player_ids[1:] != player_ids[:-1]])
+    groups = player_ids[starts]
+    games = np.diff(np.r_[starts, len(player_ids)])
+    group_of_match = np.repeat(np.arange(len(groups)), games)
+    idx = np.arange(len(player_ids)) - np.repeat(starts, games)
+
+    wins = results == model.Result.Win.value
+    losses = results == model.Result.Loss.value
+
+    sum_mmr = np.add.reduceat(mmrs, starts)
+    sum_idx_mmr = np.add.reduceat(idx * mmrs, starts)
+    sum_mmr2 = np.add.reduceat(mmrs * mmrs, starts)
+    max_mmr = np.maximum.reduceat(mmrs, starts)
+    min_mmr = np.minimum.reduceat(mmrs, starts)
+    win_count = np.add.reduceat(wins.astype(np.int64), starts)
+    loss_count = np.add.reduceat(losses.astype(np.int64), starts)
+    guessed = np.add.reduceat(guesses.astype(np.int64), starts)
+    instant_left = np.add.reduceat(
+        (losses & (max_lengths <= INSTANT_LEAVE_SECONDS)).astype(np.int64),
+        starts)
+
+    # Streaks are runs of wins or losses; ties do not interrupt them.
+    decided = wins | losses
+    streak_groups = group_of_match[decided]
+    streak_results = results[decided]
+    longest = {model.Result.Win: np.zeros(len(groups), dtype=np.int64),
+               model.Result.Loss: np.zeros(len(groups), dtype=np.int64)}
+    if len(streak_groups) > 0:
+        new_run = np.r_[True,
+                        (streak_groups[1:] != streak_groups[:-1])
+                        | (streak_results[1:] != streak_results[:-1])]
+        run_length = np.bincount(np.cumsum(new_run) - 1)
+        run_group = streak_groups[new_run]
+        run_result = streak_results[new_run]
+        for result, longest_streak in longest.items():
+            mask = run_result == result.value
+            np.maximum.at(longest_streak, run_group[mask], run_length[mask])
+
+    statistics = {}
+    for key, player_id in enumerate(groups.tolist()):
+        statistics[player_id] = statistics_values(
+            int(games[key]), int(sum_mmr[key]), int(sum_idx_mmr[key]),
+            int(sum_mmr2[key]), int(max_mmr[key]), int(min_mmr[key]),
+            current_mmrs.get(player_id),
+            wins=int(win_count[key]),
+            losses=int(loss_count[key]),
+            guessed_games=int(guessed[key]),
+            instant_left_games=int(instant_left[key]),
+            longest_wining_streak=int(longest[model.Result.Win][key]),
+            longest_losing_streak=int(longest[model.Result.Loss][key]))
+    return statistics
+
+
+def _compute_bulk_statistics_python(player_ids, mmrs, results, guesses,
+                                    max_lengths, current_mmrs, limit=None):
+    """Compute the statistics of many players without NumPy."""
+    accumulators = {}
+    for player_id, mmr, result, guess, max_length in zip(
+            player_ids, mmrs, results, guesses, max_lengths):
+        try:
+            accumulator = accumulators[player_id]
+        except KeyError:
+            accumulator = accumulators[player_id] = StatisticsAccumulator()
+        if limit is not None and accumulator.games >= limit:
+            continue
+        accumulator.add(mmr, model.Result(result), guess, max_length)
+    return {player_id: accumulator.values(current_mmrs.get(player_id))
+            for player_id, accumulator in accumulators.items()}
+
+
+def ema_alpha(period):
+    """Return the smoothing factor of an EMA over a period of matches."""
+    if float(period) < 1.0:
+        raise ValueError(f'Invalid EMA period {period} (at least 1)')
+    return 2.0 / (float(period) + 1.0)
+
+
+def update_ema(mmr, alpha, ema=None, emvar=None):
+    """Return the EMA and EMVar of the MMR after a new match."""
+    if ema is not None and ema > 0.0:
+        delta = mmr - ema
+        return (ema + alpha * delta,
+                (1.0 - alpha) * (emvar + alpha * delta * delta))
+    return mmr, 0.0
+
+
+def compute_bulk_ema(player_ids, mmrs, alpha):
+    """Compute the EMA and EMVar of the MMR of many players at once.
+
+    The matches have to be grouped by player and ordered from oldest to
+    newest match within each group. Like update_ema, the EMA of every
+    player starts at its first match and again after an EMA of at most
+    zero. Returns the EMAs and the EMVars.
+    """
+    if len(player_ids) == 0:
+        return [], []
+    if np is None:
+        return _compute_bulk_ema_python(player_ids, mmrs, alpha)
+
+    player_ids = np.asarray(player_ids, dtype=np.int64)
+    mmrs = np.asarray(mmrs, dtype=np.float64)
+    resets = np.r_[True, player_ids[1:] != player_ids[:-1]]
+
+    # ema_k = (1 - alpha) * ema_(k-1) + alpha * mmr_k
+    ema = _linear_recurrence(
+        1.0 - alpha, np.where(resets, mmrs, alpha * mmrs), resets, 0.0)
+    # Restart after the first EMA of at most zero and solve again from
+    # there on, such EMAs (of MMR 0) are rare.
+    while True:
+        late = np.flatnonzero(~resets[1:] & (ema[:-1] <= 0.0))
+        if len(late) == 0:
+            break
+        start = stop = late[0] + 1
+        # Restarting at an MMR of at most zero restarts the next one, too.
+        while stop < len(mmrs) - 1 and mmrs[stop] <= 0.0:
+            stop += 1
+        resets[start:stop + 1] = True
+        ema[start:] = _linear_recurrence(
+            1.0 - alpha,
+            np.where(resets[start:], mmrs[start:], alpha * mmrs[start:]),
+            resets[start:], 0.0)
+
+    # emvar_k = (1 - alpha) * (emvar_(k-1) + alpha * delta_k^2)
+    delta = mmrs - np.r_[0.0, ema[:-1]]
+    emvar = _linear_recurrence(
+        1.0 - alpha,
+        np.where(resets, 0.0, (1.0 - alpha) * alpha * delta * delta),
+        resets, 0.0)
+    return ema, emvar
+
+
+def _linear_recurrence(factor, summands, resets, initial):
+    """Solve s_k = factor * s_(k-1) + summands_k with NumPy.
+
+    The recurrence restarts with s_k = summands_k where resets is set
+    and s_(-1) is given by initial. Blocks are chosen such that the
+    powers of the factor stay well conditioned.
+    """
+    if factor == 0.0:
+        # Every value is its summand (EMA over a period of one match).
+        return summands.copy()
+    if factor < 1.0:
+        block = max(1, int(math.log(1e4) / -math.log(factor)))
+    else:
+        block = len(summands)
+
+    result = np.empty(len(summands))
+    for start in range(0, len(summands), block):
+        values = summands[start:start + block]
+        restart = resets[start:start + block]
+        position = np.arange(len(values))
+        segment = np.maximum.accumulate(np.where(restart, position, 0))
+        exponent = position - segment
+        scaled = values * factor ** -exponent
+        sums = np.cumsum(scaled)
+        sums -= sums[segment] - scaled[segment]
+        block_result = factor ** exponent * sums
+        if not restart[0]:
+            first = segment == 0
+            block_result[first] += \
+                factor ** (exponent[first] + 1) * initial
+        result[start:start + block] = block_result
+        initial = block_result[-1]
+    return result
+
+
+def _compute_bulk_ema_python(player_ids, mmrs, alpha):
+    """Compute the EMA and EMVar of many players without NumPy."""
+    emas = []
+    emvars = []
+    player_id = ema = emvar = None
+    for current_id, mmr in zip(player_ids, mmrs):
+        if current_id != player_id:
+            player_id, ema, emvar = current_id, None, None
+        ema, emvar = update_ema(mmr, alpha, ema, emvar)
+        emas.append(ema)
+        emvars.append(emvar)
+    return emas, emvars
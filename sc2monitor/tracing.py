@@ -0,0 +1,156 @@
+"""Trace the work done for single players as spans."""
+import contextvars
+import json
+import logging
+import random
+import time
+from datetime import datetime
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar('sc2monitor_span', default=None)
+
+
+class Span:
+    """Timed section of a trace, e.g. an api request."""
+
+    __slots__ = ('trace', 'id', 'parent', 'name', 'tags', 'start',
+                 'duration', '_token')
+
+    def __init__(self, trace, parent, name, tags):
+        """Init a span of a trace."""
+        self.trace = trace
+        self.id = len(trace.spans)
+        self.parent = parent
+        self.name = name
+        self.tags = tags
+        self.start = 0.0
+        self.duration = None
+        trace.spans.append(self)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        _current.reset(self._token)
+        if exc_type is not None:
+            self.tags['error'] = exc_type.__name__
+        if self.parent is None:
+            self.trace.finish(self)
+
+    def as_dict(self, origin):
+        """Return the span as dict with times relative to origin."""
+        return dict(id=self.id, parent=self.parent, name=self.name,
+                    start=round(self.start - origin, 6),
+                    duration=round(self.duration, 6)
+                    if self.duration is not None else None,
+                    tags=self.tags)
+
+
+class _NoSpan:
+    """Span doing nothing, if the current player is not traced."""
+
+    __slots__ = ()
+    # Shared by all untraced spans, hence read-only.
+    tags = MappingProxyType({})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Trace:
+    """Spans of a player during a run."""
+
+    __slots__ = ('tracer', 'player', 'sampled', 'datetime', 'spans')
+
+    def __init__(self, tracer, player, sampled):
+        self.tracer = tracer
+        self.player = player
+        self.sampled = sampled
+        self.datetime = datetime.now()
+        self.spans = []
+
+    def finish(self, root):
+        """Keep the trace if sampled or slow."""
+        if self.sampled or root.duration >= self.tracer.slow_seconds:
+            self.tracer.traces.append(self)
+
+    def as_dict(self):
+        """Return the trace as dict."""
+        root = self.spans[0]
+        return dict(player=self.player,
+                    datetime=self.datetime.isoformat(),
+                    duration=round(root.duration, 6),
+                    spans=[span.as_dict(root.start) for span in self.spans])
+
+
+def span(name, **tags):
+    """Return a span of the current trace or a no-op if not traced."""
+    parent = _current.get()
+    if parent is None:
+        return _NO_SPAN
+    return Span(parent.trace, parent.id, name, tags)
+
+
+def record(name, start, **tags):
+    """Record a finished span of the current trace started at start."""
+    parent = _current.get()
+    if parent is not None:
+        done = Span(parent.trace, parent.id, name, tags)
+        done.start = start
+        done.duration = time.perf_counter() - start
+
+
+def tag(**tags):
+    """Tag the current span, if traced."""
+    current = _current.get()
+    if current is not None:
+        current.tags.update(tags)
+
+
+class Tracer:
+    """Collect the traces of players and write them as JSON lines.
+
+    A share of sample_rate of the players is traced and traces slower than
+    slow_seconds are always kept, so the slowest players of a run can be
+    inspected afterwards. Nothing is traced without a path.
+    """
+
+    def __init__(self, path='', sample_rate=0.1, slow_seconds=5.0):
+        """Init the tracer."""
+        self.path = path
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.traces = []
+
+    def trace(self, player, name='query_player'):
+        """Return the root span of the trace of a player."""
+        if not self.path:
+            return _NO_SPAN
+        # Unsampled players are traced as well, but only kept if slow.
+        trace = _Trace(self, player, random.random() < self.sample_rate)
+        return Span(trace, None, name, dict(player=player))
+
+    def flush(self):
+        """Append the kept traces to the file, slowest first."""
+        traces, self.traces = self.traces, []
+        if not traces:
+            return
+        traces.sort(key=lambda trace: trace.spans[0].duration, reverse=True)
+        try:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                for trace in traces:
+                    f.write(json.dumps(trace.as_dict(), default=str))
+                    f.write('\n')
+        except OSError:
+            logger.exception(f'Unable to write traces to {self.path}:')
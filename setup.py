@@ -29,6 +29,11 @@ setup(name='sc2monitor',
           'aiohttp >= 3.7.4',
           'sqlalchemy==1.3.23'
       ],
+      extras_require={
+          'numpy': ['numpy >= 1.19'],
+          'orjson': ['orjson >= 3.0'],
+          'ijson': ['ijson >= 3.1']
+      },
       zip_safe=False,
       classifiers=[
           'Development Status :: 4 - Beta',
@@ -1,5 +1,11 @@
 """Configure pytest input paramters."""
+import socket
+from contextlib import asynccontextmanager
+
 import pytest
+from mockapi import MockAPI
+
+from sc2monitor.controller import Controller
 
 
 def pytest_addoption(parser):
@@ -53,3 +59,44 @@ def passwd(request):
 def protocol(request):
     """Return dp protocol."""
     return request.config.getoption("--protocol")
+
+
+@pytest.fixture
+def free_port():
+    """Return a function returning a free local port."""
+    def port():
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
+    return port
+
+
+@pytest.fixture
+def mock_monitor(tmp_path, free_port):
+    """Return a context manager of a controller monitoring a mock api.
+
+    The players of the synthetic ladder are added to a controller with
+    the config passed, the api is served by a MockAPI (or none if api is
+    False), e.g.
+
+        async with mock_monitor(ladder, outbox='true') as ctrl:
+            await ctrl.run()
+    """
+    @asynccontextmanager
+    async def monitor(ladder, api=None, db='test', **config):
+        if api is not False:
+            api = api or MockAPI(ladder)
+            port = free_port()
+            config.setdefault('api_base_url', f'http://127.0.0.1:{port}')
+            await api.start(port=port)
+        try:
+            async with Controller(db=f'sqlite:///{tmp_path}/{db}.db',
+                                  api_key='key', api_secret='secret',
+                                  **config) as ctrl:
+                for url in ladder.profile_urls():
+                    ctrl.add_player(url)
+                yield ctrl
+        finally:
+            if api is not False:
+                await api.stop()
+    return monitor
@@ -0,0 +1,340 @@
+"""Local stand-in of the Blizzard api for offline load tests.
+
+Serves the endpoints used by sc2monitor.sc2api from a synthetic ladder of
+players playing games over time, with configurable latencies and injected
+faults. It is used by the tests and benchmarks and not installed with the
+package. Point the sc2monitor at it via the config key api_base_url:
+
+    python test/mockapi.py --players 1000 --port 8080
+"""
+import argparse
+import asyncio
+import logging
+import math
+import random
+import time
+from datetime import datetime, timedelta
+from operator import itemgetter
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+RACES = ['PROTOSS', 'TERRAN', 'ZERG']
+LEAGUES = ['BRONZE', 'SILVER', 'GOLD', 'PLATINUM', 'DIAMOND', 'MASTER',
+           'GRANDMASTER']
+REGION = 2
+REALM = 1
+TEAMS_PER_LADDER = 100
+HISTORY_LENGTH = 25
+
+
+class SyntheticLadder:
+    """Players of one region playing 1v1 games over time.
+
+    Every player has one or (less often) two races with a team each.
+    Teams are grouped into ladders of up to 100 teams like the real ladder.
+    """
+
+    def __init__(self, players=100, seed=0, start=None):
+        """Generate the players of the ladder."""
+        self.rng = random.Random(seed)
+        self.time = start or datetime.now() - timedelta(days=7)
+        self.season_start = self.time - timedelta(days=14)
+        self.players = {}
+        self.ladders = {}
+        for profile in range(1, players + 1):
+            races = self.rng.sample(RACES, self.rng.choice([1, 1, 1, 2]))
+            teams = []
+            for race in races:
+                ladder = max(self.ladders, default=1000)
+                if len(self.ladders.get(ladder, ())) >= TEAMS_PER_LADDER:
+                    ladder += 1
+                team = dict(profile=profile, race=race, ladder=ladder,
+                            mmr=int(self.rng.gauss(3500, 900)),
+                            wins=0, losses=0,
+                            joined=int(self.season_start.timestamp()))
+                self.ladders.setdefault(ladder, []).append(team)
+                teams.append(team)
+            self.players[profile] = dict(
+                profile=profile, name=f'player{profile}', teams=teams,
+                history=[], activity=self.rng.random())
+
+    def profile_urls(self):
+        """Return the profile urls to add the players to the sc2monitor."""
+        return [f'https://starcraft2.com/en-gb/profile/{REGION}/{REALM}/'
+                f'{profile}' for profile in self.players]
+
+    def step(self, minutes=15):
+        """Let the players play games for some minutes."""
+        end = self.time + timedelta(minutes=minutes)
+        for player in self.players.values():
+            # Active players play up to a game every 15 minutes.
+            games = sum(self.rng.random() < player['activity'] / 2
+                        for _ in range(max(1, minutes // 15)))
+            history = player['history']
+            for _ in range(games):
+                team = self.rng.choice(player['teams'])
+                played = self.time + timedelta(
+                    seconds=self.rng.randint(0, minutes * 60))
+                win = self.rng.random() < 0.5
+                team['wins' if win else 'losses'] += 1
+                team['mmr'] += (1 if win else -1) * self.rng.randint(10, 30)
+                history.insert(0, dict(
+                    type='1v1', decision='WIN' if win else 'LOSS',
+                    date=int(played.timestamp())))
+                if self.rng.random() < 0.1:
+                    history.insert(0, dict(type='2v2', decision='WIN',
+                                           date=int(played.timestamp())))
+            # Like the api, the history holds the newest games first.
+            history.sort(key=itemgetter('date'), reverse=True)
+            del history[HISTORY_LENGTH:]
+        self.time = end
+
+    def season(self):
+        """Return the current season."""
+        return dict(seasonId=50, number=1, year=self.season_start.year,
+                    startDate=int(self.season_start.timestamp()),
+                    endDate=int((self.season_start
+                                 + timedelta(days=90)).timestamp()))
+
+    def metadata(self, profile):
+        """Return the meta data of a player."""
+        player = self.players[profile]
+        return dict(name=player['name'], profileId=str(profile),
+                    regionId=REGION, realmId=REALM)
+
+    def summary(self, profile):
+        """Return the ladder summary of a player."""
+        return dict(allLadderMemberships=[
+            dict(ladderId=team['ladder'],
+                 localizedGameMode=f'1v1 {self._league(team).title()}')
+            for team in self.players[profile]['teams']
+            if team['wins'] + team['losses'] > 0])
+
+    def ladder(self, profile, ladder_id):
+        """Return a ladder with the ranks of a player."""
+        teams = sorted(self.ladders[ladder_id],
+                       key=lambda team: team['mmr'], reverse=True)
+        ladder_teams = []
+        ranks = []
+        for rank, team in enumerate(teams, start=1):
+            player = self.players[team['profile']]
+            ladder_teams.append(dict(
+                teamMembers=[dict(id=str(team['profile']), realm=REALM,
+                                  region=REGION,
+                                  displayName=player['name'],
+                                  favoriteRace=team['race'].lower())],
+                previousRank=rank, points=team['wins'] * 10,
+                wins=team['wins'], losses=team['losses'], mmr=team['mmr'],
+                joinTimestamp=team['joined']))
+            if team['profile'] == profile:
+                ranks.append(dict(rank=rank, mmr=team['mmr'], bonusPool=0))
+        return dict(league=self._league(teams[-1]),
+                    ranksAndPools=ranks, ladderTeams=ladder_teams)
+
+    def matches(self, profile):
+        """Return the legacy match history of a player."""
+        return dict(matches=[
+            dict(map='Synthetic LE', speed='FASTER', **match)
+            for match in self.players[profile]['history']])
+
+    @staticmethod
+    def _league(team):
+        idx = (team['mmr'] - 1500) // 700
+        return LEAGUES[min(max(idx, 0), len(LEAGUES) - 1)]
+
+
+def latency(spec):
+    """Return a function drawing latencies in seconds from a spec.
+
+    Specs are 'constant:SECONDS', 'uniform:LOW:HIGH' or
+    'lognormal:MEDIAN:SIGMA', e.g. 'lognormal:0.08:0.5'.
+    """
+    name, *params = spec.split(':')
+    params = [float(param) for param in params]
+    if name == 'constant':
+        return lambda rng: params[0]
+    if name == 'uniform':
+        return lambda rng: rng.uniform(params[0], params[1])
+    if name == 'lognormal':
+        return lambda rng: rng.lognormvariate(math.log(params[0]),
+                                              params[1])
+    raise ValueError(f"Invalid latency '{spec}'")
+
+
+class MockAPI:
+    """aiohttp application serving a synthetic ladder like the api."""
+
+    def __init__(self, ladder, latency_spec='constant:0', error_504=0.0,
+                 error_429=0.0, malformed=0.0, step_interval=0, seed=0):
+        """Init the api with the rates of the injected faults."""
+        self.ladder = ladder
+        self.latency = latency(latency_spec)
+        self.error_504 = error_504
+        self.error_429 = error_429
+        self.malformed = malformed
+        self.step_interval = step_interval
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.faults = 0
+        self._runner = None
+        self._stepper = None
+
+    def app(self):
+        """Return the aiohttp application."""
+        app = web.Application(middlewares=[self._faults])
+        app.router.add_post('/oauth/token', self.token)
+        app.router.add_get('/oauth/check_token', self.check_token)
+        app.router.add_get('/sc2/ladder/season/{region}', self.season)
+        app.router.add_get(
+            '/sc2/metadata/profile/{region}/{realm}/{profile}',
+            self.metadata)
+        app.router.add_get(
+            '/sc2/profile/{region}/{realm}/{profile}/ladder/summary',
+            self.summary)
+        app.router.add_get(
+            '/sc2/profile/{region}/{realm}/{profile}/ladder/{ladder}',
+            self.ladder_data)
+        app.router.add_get(
+            '/sc2/legacy/profile/{region}/{realm}/{profile}/matches',
+            self.matches)
+        return app
+
+    @web.middleware
+    async def _faults(self, request, handler):
+        self.requests += 1
+        await asyncio.sleep(self.latency(self.rng))
+        fault = self.rng.random()
+        if fault < self.error_504:
+            self.faults += 1
+            return web.Response(status=504, text='Gateway Timeout')
+        fault -= self.error_504
+        if fault < self.error_429:
+            self.faults += 1
+            return web.Response(status=429, headers={'Retry-After': '1'},
+                                text='Too Many Requests')
+        response = await handler(request)
+        fault -= self.error_429
+        if fault < self.malformed and response.status == 200:
+            self.faults += 1
+            body = response.body[:len(response.body) // 2]
+            return web.Response(body=body, content_type='application/json')
+        return response
+
+    @staticmethod
+    def _profile(request):
+        try:
+            return int(request.match_info['profile'])
+        except ValueError:
+            raise web.HTTPNotFound()
+
+    def _player(self, request):
+        profile = self._profile(request)
+        if profile not in self.ladder.players:
+            raise web.HTTPNotFound()
+        return profile
+
+    async def token(self, request):
+        """Grant an access token."""
+        return web.json_response(dict(access_token='mock-token',
+                                      token_type='bearer',
+                                      expires_in=86399))
+
+    async def check_token(self, request):
+        """Report the access token as valid for a day."""
+        return web.json_response(dict(exp=int(time.time()) + 86400))
+
+    async def season(self, request):
+        """Serve the current season."""
+        return web.json_response(self.ladder.season())
+
+    async def metadata(self, request):
+        """Serve the meta data of a player."""
+        return web.json_response(self.ladder.metadata(self._player(request)))
+
+    async def summary(self, request):
+        """Serve the ladder summary of a player."""
+        return web.json_response(self.ladder.summary(self._player(request)))
+
+    async def ladder_data(self, request):
+        """Serve a ladder of a player."""
+        profile = self._player(request)
+        try:
+            ladder_id = int(request.match_info['ladder'])
+            data = self.ladder.ladder(profile, ladder_id)
+        except (KeyError, ValueError):
+            raise web.HTTPNotFound()
+        return web.json_response(data)
+
+    async def matches(self, request):
+        """Serve the match history of a player."""
+        return web.json_response(self.ladder.matches(self._player(request)))
+
+    async def start(self, host='127.0.0.1', port=8080):
+        """Serve the api and advance the ladder every step_interval."""
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        if self.step_interval > 0:
+            self._stepper = asyncio.create_task(self._step())
+        logger.info(f'Serving mock api on http://{host}:{port}')
+
+    async def stop(self):
+        """Stop serving the api."""
+        if self._stepper is not None:
+            self._stepper.cancel()
+            self._stepper = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _step(self):
+        while True:
+            await asyncio.sleep(self.step_interval)
+            self.ladder.step()
+
+
+def main():
+    """Run the mock api from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--players', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', default='constant:0',
+                        help='constant:S, uniform:LOW:HIGH or '
+                        'lognormal:MEDIAN:SIGMA (seconds)')
+    parser.add_argument('--error-504', type=float, default=0.0)
+    parser.add_argument('--error-429', type=float, default=0.0)
+    parser.add_argument('--malformed', type=float, default=0.0)
+    parser.add_argument('--step-interval', type=float, default=60,
+                        help='seconds between games of the players')
+    parser.add_argument('--urls', action='store_true',
+                        help='print the profile urls of the players')
+    args = parser.parse_args()
+
+    ladder = SyntheticLadder(args.players, args.seed)
+    if args.urls:
+        print('\n'.join(ladder.profile_urls()))
+        return
+    ladder.step(60)
+    api = MockAPI(ladder, args.latency, args.error_504, args.error_429,
+                  args.malformed, args.step_interval, args.seed)
+
+    async def serve():
+        await api.start(args.host, args.port)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await api.stop()
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
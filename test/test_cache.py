@@ -0,0 +1,70 @@
+"""Test the in-memory caches of the sc2monitor."""
+import pytest
+
+from sc2monitor.cache import ConfigCache, PlayerIndex
+from sc2monitor.model import Player, Race, Server, create_db_session
+
+
+def test_config_cache(tmp_path):
+    db = f'sqlite:///{tmp_path}/cache.db'
+    cache = ConfigCache(create_db_session(db))
+    other = ConfigCache(create_db_session(db), ttl=None)
+
+    with pytest.raises(KeyError):
+        cache.get('analyze_matches')
+
+    cache.set('analyze_matches', 50)
+    cache.db_session.commit()
+    assert cache.get('analyze_matches') == '50'
+
+    assert other.get('analyze_matches') == '50'
+    assert not other.refresh()
+
+    cache.set('analyze_matches', 52)
+    cache.db_session.commit()
+    assert other.get('analyze_matches') == '50'
+    assert other.refresh()
+    assert other.get('analyze_matches') == '52'
+
+    other.invalidate()
+    assert other.get('analyze_matches') == '52'
+
+    # Internal keys and further keys of a transaction keep the version.
+    version = cache.get('config_version')
+    cache.set('retention_checked', 'now')
+    cache.set('profile_run', '')
+    cache.set('access_token', 'token')
+    cache.db_session.commit()
+    assert cache.get('config_version') == version
+    assert not other.refresh()
+    cache.set('analyze_matches', 53)
+    version = cache.get('config_version')
+    cache.set('cache_matches', 500)
+    cache.db_session.commit()
+    assert cache.get('config_version') == version
+    assert other.refresh()
+
+
+def test_player_index():
+    zerg = Player(player_id=1, realm=1, server=Server.Europe, race=Race.Zerg)
+    terran = Player(player_id=1, realm=1, server=Server.Europe,
+                    race=Race.Terran)
+    other = Player(player_id=2, realm=1, server=Server.Europe,
+                   race=Race.Random)
+    index = PlayerIndex([zerg, terran, other])
+
+    assert len(index) == 3
+    assert index.players() == [zerg, other]
+    assert index.get(1, 1, Server.Europe, Race.Terran) is terran
+    assert index.get(1, 1, Server.Europe, Race.Protoss) is None
+    assert index.races(zerg) == [zerg, terran]
+
+    index.change_race(other, Race.Protoss)
+    assert other.race == Race.Protoss
+    assert index.get(2, 1, Server.Europe, Race.Random) is None
+    assert index.get(2, 1, Server.Europe, Race.Protoss) is other
+
+    index.discard(zerg)
+    assert index.races(terran) == [terran]
+    index.discard(other)
+    assert index.players() == [terran]
@@ -0,0 +1,36 @@
+"""Test recording and replaying the api traffic of the sc2monitor."""
+import asyncio
+import gzip
+import json
+
+from mockapi import SyntheticLadder
+
+from sc2monitor.model import Match, Player
+
+
+def test_cassette(tmp_path, mock_monitor):
+    ladder = SyntheticLadder(players=10, seed=2)
+    ladder.step(120)
+    cassette = str(tmp_path / 'run.jsonl.gz')
+
+    async def run(mode, api=None):
+        async with mock_monitor(ladder, api, db=mode, cassette=cassette,
+                                cassette_mode=mode) as ctrl:
+            await ctrl.run()
+            players = sorted(
+                (player.player_id, player.race.name, player.mmr,
+                 player.wins, player.losses)
+                for player in ctrl.db_session.query(Player))
+            return (players, ctrl.db_session.query(Match).count(),
+                    ctrl.sc2api.request_count)
+
+    recorded = asyncio.run(run('record'))
+    with gzip.open(cassette, 'rt') as f:
+        lines = [json.loads(line) for line in f]
+    assert lines[0]['version'] == 1
+    assert all('access_token' not in line['params'] for line in lines[1:])
+
+    # Without the mock api the replay cannot reach it.
+    replayed = asyncio.run(run('replay-fast', api=False))
+    assert replayed[:2] == recorded[:2]
+    assert replayed[2] == len(lines) - 1
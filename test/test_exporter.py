@@ -0,0 +1,67 @@
+"""Test the metrics exporter of the sc2monitor."""
+import asyncio
+
+import aiohttp
+
+from sc2monitor.controller import Controller
+
+
+def test_exporter(tmp_path, free_port):
+    controller = Controller(db=f'sqlite:///{tmp_path}/exporter.db')
+    controller.create_db_session()
+    exporter = controller.exporter
+    exporter.load_players([])
+    exporter.players_queued = 3
+    exporter.request('ladder', 200)
+    exporter.request('ladder', 504)
+    exporter.retry('ladder', 'timeout')
+    exporter.player_done(1, True)
+    exporter.player_done(2, False)
+    exporter.player_failed(3)
+    controller.set_config('metrics_port', 0)
+    exporter.run_done(1.5)
+
+    text = exporter.render()
+    assert 'sc2monitor_api_requests_total{endpoint="ladder",status="5xx"} 1' \
+        in text
+    assert 'sc2monitor_api_retries_total{endpoint="ladder",reason="timeout"}'\
+        ' 1' in text
+    assert 'sc2monitor_players_total{outcome="skipped"} 1' in text
+    assert 'sc2monitor_players_queued 0' in text
+    assert 'sc2monitor_players_data_age_seconds{quantile="0.99"}' in text
+    assert 'sc2monitor_players_data_age_max_seconds' in text
+    assert 'sc2monitor_player_data_age_seconds' not in text
+    assert 'sc2monitor_db_commit_seconds_bucket{le="+Inf"} 1' in text
+    assert 'sc2monitor_db_commit_seconds_count 1' in text
+    assert '# TYPE sc2monitor_runs_total counter' in text
+
+    openmetrics = exporter.render(openmetrics=True)
+    assert '# TYPE sc2monitor_runs counter' in openmetrics
+    assert openmetrics.endswith('# EOF\n')
+
+    # The age of each player only on request, as it adds a series each.
+    controller.set_config('metrics_player_age', 'true')
+    controller.read_config()
+    assert 'sc2monitor_player_data_age_seconds{player="1"}' \
+        in exporter.render()
+
+    path = tmp_path / 'sc2monitor.prom'
+    exporter.write_textfile(str(path))
+    assert path.read_text().startswith('# HELP')
+
+    async def scrape():
+        port = free_port()
+        await exporter.start(port=port)
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(
+                        f'http://127.0.0.1:{port}/metrics',
+                        headers={'Accept': 'application/openmetrics-text'}
+                ) as resp:
+                    assert resp.content_type == 'application/openmetrics-text'
+                    return await resp.text()
+        finally:
+            await exporter.stop()
+
+    assert asyncio.run(scrape()).endswith('# EOF\n')
+    controller.close_db_session()
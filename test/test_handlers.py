@@ -0,0 +1,94 @@
+"""Test the database log handler of the sc2monitor."""
+import logging
+
+import pytest
+
+from sc2monitor.handlers import SQLAlchemyHandler
+from sc2monitor.model import Config, Log, create_db_session
+
+
+@pytest.mark.parametrize('memory', [True, False])
+def test_handler(tmp_path, memory):
+    db = 'sqlite://' if memory else f'sqlite:///{tmp_path}/handler.db'
+    db_session = create_db_session(db)
+    handler = SQLAlchemyHandler(db_session, capacity=3, flush_interval=60)
+    logger = logging.getLogger(f'test_handler_{memory}')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+
+    logger.info('one')
+    logger.warning('two')
+    assert db_session.query(Log).count() == 0
+    logger.error('three')
+    logger.info('four')
+    handler.flush()
+    db_session.commit()
+    assert [log.msg for log in db_session.query(Log).order_by(Log.id)] \
+        == ['one', 'two', 'three', 'four']
+    assert (handler.warnings, handler.errors) == (1, 1)
+
+    logger.info('five')
+    logger.removeHandler(handler)
+    handler.close()
+    db_session.commit()
+    assert db_session.query(Log).count() == 5
+
+
+def test_handler_failures(tmp_path):
+    db_session = create_db_session(f'sqlite:///{tmp_path}/handler.db')
+    handler = SQLAlchemyHandler(db_session, capacity=100, max_retries=2,
+                                max_buffer=3)
+    logger = logging.getLogger('test_handler_failures')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+
+    logger.info('x' * 1000)
+    handler.flush()
+    db_session.commit()
+    assert len(db_session.query(Log).one().msg) == 255
+
+    # Failing batches are retried, but neither kept nor buffered forever.
+    Log.__table__.drop(db_session.get_bind())
+    for idx in range(5):
+        logger.info(f'lost {idx}')
+    handler.flush()
+    assert handler.buffered == 3 and handler.dropped == 2
+    handler.flush()
+    handler.flush()
+    assert handler.buffered == 0 and handler.dropped == 5
+
+    db_session.commit()
+    Log.__table__.create(db_session.get_bind())
+    logger.info('written')
+    logger.removeHandler(handler)
+    handler.close()
+    db_session.commit()
+    assert [log.msg for log in db_session.query(Log)] == ['written']
+
+
+def test_handler_transaction(tmp_path):
+    db_session = create_db_session(f'sqlite:///{tmp_path}/handler.db')
+    handler = SQLAlchemyHandler(db_session, capacity=1, busy_timeout=0.01)
+    logger = logging.getLogger('test_handler_transaction')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+
+    # The records are committed on their own, not with the session.
+    logger.info('one')
+    db_session.rollback()
+    assert [log.msg for log in db_session.query(Log)] == ['one']
+
+    # While the session writes, the records wait for the next flush.
+    db_session.add(Config(key='pending', value='1'))
+    db_session.flush()
+    logger.error('two')
+    assert handler.buffered == 1 and handler.dropped == 0
+    db_session.rollback()
+    logger.info('three')
+    logger.removeHandler(handler)
+    handler.close()
+    assert [log.msg for log in db_session.query(Log).order_by(Log.id)] \
+        == ['one', 'two', 'three']
@@ -0,0 +1,30 @@
+"""Test the run metrics of the sc2monitor."""
+from sc2monitor.metrics import Histogram, RunMetrics
+
+
+def test_histogram():
+    histogram = Histogram()
+    assert histogram.percentile(50) is None
+    for ms in range(1, 101):
+        histogram.record(ms / 1000, 10)
+    assert histogram.count == 100
+    assert histogram.bytes == 1000
+    assert abs(histogram.percentile(50) - 0.05) < 0.05 * 0.05
+    assert abs(histogram.percentile(90) - 0.09) < 0.09 * 0.05
+    assert 0.095 < histogram.percentile(100) <= 0.1
+
+
+def test_run_metrics():
+    metrics = RunMetrics()
+    for _ in range(2):
+        with metrics.phase('statistics'):
+            pass
+    metrics.request('ladder', 0.2, 100)
+    rows = {row['name']: row for row in metrics.rows()}
+    assert rows['statistics']['kind'] == 'phase'
+    assert rows['statistics']['count'] == 2
+    assert rows['ladder']['kind'] == 'endpoint'
+    assert rows['ladder']['p99'] == 0.2
+    assert rows['ladder']['bytes'] == 100
+    metrics.reset()
+    assert metrics.rows() == []
@@ -0,0 +1,89 @@
+"""Test the sc2monitor against the mock api."""
+import asyncio
+
+from mockapi import HISTORY_LENGTH, MockAPI, SyntheticLadder
+from sqlalchemy import create_engine
+
+from sc2monitor.model import Config, Match, Player, Run
+
+
+def test_mockapi(mock_monitor):
+    ladder = SyntheticLadder(players=30, seed=1)
+    ladder.step(120)
+    api = MockAPI(ladder, 'uniform:0:0.002', error_504=0.05, error_429=0.05,
+                  malformed=0.05, seed=1)
+
+    async def main():
+        async with mock_monitor(ladder, api, db='mock') as ctrl:
+            await ctrl.run()
+            ladder.step(120)
+            await ctrl.run()
+            players = ctrl.db_session.query(Player).filter(
+                Player.mmr > 0).count()
+            matches = ctrl.db_session.query(Match).count()
+            runs = ctrl.db_session.query(Run).all()
+            return players, matches, runs
+
+    players, matches, runs = asyncio.run(main())
+    assert api.faults > 0
+    assert players > 20
+    assert matches > 0
+    assert len(runs) == 2
+    assert sum(run.api_retries for run in runs) > 0
+
+
+def test_ladder_cache(mock_monitor):
+    ladder = SyntheticLadder(players=30, seed=2)
+    ladder.step(120)
+    ladders = {team['ladder'] for player in ladder.players.values()
+               for team in player['teams']
+               if team['wins'] + team['losses'] > 0}
+
+    async def main():
+        async with mock_monitor(ladder, db='mock') as ctrl:
+            await ctrl.run()
+            first = ctrl.exporter.requests['ladder', '2xx']
+            assert not ctrl.sc2api._ladders
+            await ctrl.run()
+            return first, ctrl.exporter.requests['ladder', '2xx']
+
+    first, total = asyncio.run(main())
+    # Every ladder is requested once per run for all of its players.
+    assert first == len(ladders) < 30
+    assert total == 2 * first
+
+
+def test_history_order():
+    ladder = SyntheticLadder(players=20, seed=3)
+    for _ in range(5):
+        ladder.step(120)
+        for player in ladder.players.values():
+            dates = [match['date'] for match in player['history']]
+            assert dates == sorted(dates, reverse=True)
+            assert len(dates) <= HISTORY_LENGTH
+
+
+def test_run_reloads(mock_monitor, tmp_path):
+    ladder = SyntheticLadder(players=5, seed=4)
+    ladder.step(120)
+
+    async def main():
+        async with mock_monitor(ladder, profile_dir=str(tmp_path)) as ctrl:
+            await ctrl.run()
+            player = ctrl.db_session.query(Player).first()
+            # Another process changes the player and requests a profiled
+            # run meanwhile.
+            engine = create_engine(f'sqlite:///{tmp_path}/test.db')
+            with engine.begin() as connection:
+                connection.execute(Player.__table__.update().where(
+                    Player.__table__.c.id == player.id).values(
+                    name='renamed'))
+                connection.execute(Config.__table__.insert().values(
+                    key='profile_run', value='sampling'))
+            engine.dispose()
+            assert player.name != 'renamed'
+            await ctrl.run()
+            return player.name, ctrl.get_config('profile_run')
+
+    assert asyncio.run(main()) == ('renamed', '')
+    assert list(tmp_path.glob('sc2monitor-*.folded'))
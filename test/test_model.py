@@ -1,7 +1,12 @@
 """Test the sc2monitor model."""
+import string
+
 import pytest
+from sqlalchemy import MetaData, Table, create_engine, func, inspect, select
 
-from sc2monitor.model import League, Race, Result, Server
+from sc2monitor.model import (SCHEMA_VERSION, Base, Config, League, Race,
+                              Result, Server, create_db_session, migrate,
+                              read_schema_version, write_schema_version)
 
 
 def test_result_win():
@@ -123,6 +128,30 @@ def test_league():
     assert_league('grandmaster', League.Grandmaster, 6)
 
     assert League.get('') == League.Unranked
+
+
+def test_prefix_tables():
+    # The lookup tables resolve names like a scan of the members in order.
+    def scan(cls, value, length):
+        for name, member in cls.__members__.items():
+            if name[:length].lower() == value[:length].lower():
+                return member
+
+    def get(cls, value):
+        try:
+            return cls.get(value)
+        except ValueError:
+            return None
+
+    for first in string.ascii_letters:
+        for second in string.ascii_letters + ' ':
+            value = first + second
+            assert Result.get(value) \
+                == (scan(Result, value, 1) or Result.Unknown)
+            assert get(Race, value) == scan(Race, value, 1)
+            assert get(League, value) == (
+                League.Grandmaster if value.lower() == 'gm'
+                else scan(League, value, 2) or scan(League, value, 1))
     with pytest.raises(ValueError):
         League.get('Test')
     with pytest.raises(ValueError):
@@ -145,3 +174,52 @@ def test_league():
         League.Master >= 5 == NotImplemented
     with pytest.raises(TypeError):
         League.Master <= 'Diamond' == NotImplemented
+
+
+def test_migrate(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path}/old.db')
+    # The tables of a database created before the indexes and constraints.
+    metadata = MetaData()
+    for table in Base.metadata.sorted_tables:
+        Table(table.name, metadata,
+              *[column.copy() for column in table.columns])
+    metadata.create_all(engine)
+    migrate(engine)
+    migrate(engine)
+
+    inspector = inspect(engine)
+    indexes = {index['name']: index['unique']
+               for table in inspector.get_table_names()
+               for index in inspector.get_indexes(table)}
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            assert index.name in indexes
+    assert indexes['uq_player_identity']
+    assert indexes['uq_horizon_statistics_player_horizon']
+
+
+def test_schema_version(tmp_path):
+    # A fresh database is created and stamped with the current version.
+    db = f'sqlite:///{tmp_path}/fresh.db'
+    create_db_session(db).close()
+    engine = create_engine(db)
+    assert read_schema_version(engine) == SCHEMA_VERSION
+
+    # A legacy database has tables, but no stamp.
+    db = f'sqlite:///{tmp_path}/legacy.db'
+    engine = create_engine(db)
+    assert read_schema_version(engine) == 0
+    Base.metadata.create_all(engine)
+    assert read_schema_version(engine) == 0
+    create_db_session(db).close()
+    assert read_schema_version(engine) == SCHEMA_VERSION
+
+    # An older stamp is bumped to the current version in place.
+    write_schema_version(engine, SCHEMA_VERSION - 1)
+    assert read_schema_version(engine) == SCHEMA_VERSION - 1
+    create_db_session(db).close()
+    assert read_schema_version(engine) == SCHEMA_VERSION
+    with engine.connect() as conn:
+        assert conn.execute(
+            select([func.count()]).where(
+                Config.key == 'schema_version')).scalar() == 1
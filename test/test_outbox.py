@@ -0,0 +1,38 @@
+"""Test the outbox of changes of players."""
+import asyncio
+
+from mockapi import SyntheticLadder
+
+from sc2monitor.model import Match, Player
+from sc2monitor.outbox import read
+
+
+def test_outbox(mock_monitor):
+    ladder = SyntheticLadder(players=10, seed=4)
+    ladder.step(120)
+
+    async def run():
+        async with mock_monitor(ladder, outbox='true') as ctrl:
+            await ctrl.run()
+            first = read(ctrl.db_session)
+            ladder.step(60)
+            await ctrl.run()
+            events = read(ctrl.db_session, cursor=first[-1]['seq'])
+            matches = ctrl.db_session.query(Match).count()
+            players = {player.id: player
+                       for player in ctrl.db_session.query(Player)}
+            assert read(ctrl.db_session, cursor=events[-1]['seq']) == []
+            assert read(ctrl.db_session, limit=3) == first[:3]
+            return first, events, matches, players
+
+    first, events, matches, players = asyncio.run(run())
+    seqs = [event['seq'] for event in first + events]
+    assert seqs == sorted(set(seqs))
+    assert sum(event['kind'] == 'match' for event in first + events) \
+        == matches
+    names = [event for event in first if event['kind'] == 'name']
+    assert names and all(players[event['player']].name == event['new']
+                         for event in names)
+    for event in events:
+        if event['kind'] == 'mmr':
+            assert event['old'] != event['new']
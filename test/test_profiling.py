@@ -0,0 +1,42 @@
+"""Test the profiling of runs of the sc2monitor."""
+import asyncio
+import time
+
+import pytest
+
+from sc2monitor.handlers import MSG_LENGTH
+from sc2monitor.profiling import create_profiler
+
+
+async def busy():
+    await asyncio.sleep(0.05)
+    end = time.perf_counter() + 0.05
+    while time.perf_counter() < end:
+        pass
+
+
+@pytest.mark.parametrize('name', ['cprofile', 'sampling'])
+def test_profiler(tmp_path, caplog, name):
+    profiler = create_profiler(name, str(tmp_path), top=5)
+    with caplog.at_level('INFO', logger='sc2monitor.profiling'):
+        with profiler:
+            asyncio.run(busy())
+    assert profiler.path.startswith(str(tmp_path))
+    with open(profiler.path, 'rb') as f:
+        assert f.read()
+    with open(profiler.summary_path, encoding='utf-8') as f:
+        summary = f.read()
+    assert 'waiting for I/O' in summary
+    assert 'calc_statistics' in summary
+    assert 'busy' in summary
+    # The summary is logged line by line, each fitting into the log table.
+    messages = [record.getMessage() for record in caplog.records]
+    assert len(messages) == len(summary.splitlines()) + 1
+    assert all(len(message) <= MSG_LENGTH for message in messages)
+    assert any('waiting for I/O' in message for message in messages)
+    assert profiler.summary_path in messages[-1]
+
+
+def test_invalid_profiler():
+    with pytest.raises(ValueError):
+        create_profiler('perf')
@@ -0,0 +1,84 @@
+"""Test pushing the events of players to subscribers."""
+import asyncio
+import json
+
+import aiohttp
+from mockapi import SyntheticLadder
+
+from sc2monitor.model import Player
+from sc2monitor.outbox import read
+from sc2monitor.push import Hub, PushServer
+
+
+def test_hub():
+    async def fan_out():
+        hub = Hub(queue_size=2)
+        fast = hub.connect([1, 2])
+        slow = hub.connect([2])
+        other = hub.connect([3])
+        hub.publish([dict(player=2, kind='mmr', new=1)])
+        assert json.loads(await fast.get())['new'] == 1
+        # The slow subscriber does not read and is dropped once full.
+        hub.publish([dict(player=2, kind='mmr', new=value)
+                     for value in range(2, 4)])
+        assert hub.dropped == 1 and slow not in hub.subscribers
+        assert await slow.get() is None
+        assert [json.loads(await fast.get())['new']
+                for _ in range(2)] == [2, 3]
+        assert other.queue.empty()
+        hub.unsubscribe(fast, [2])
+        hub.publish([dict(player=2, kind='mmr', new=5)])
+        assert hub.subscribers == {fast, other}
+        hub.disconnect(fast)
+        assert await fast.get() is None
+
+    asyncio.run(fan_out())
+
+
+def test_push(mock_monitor, free_port):
+    ladder = SyntheticLadder(players=5, seed=5)
+    ladder.step(120)
+    push = PushServer()
+    push_port = free_port()
+
+    async def run():
+        await push.start(port=push_port)
+        try:
+            async with mock_monitor(ladder, outbox='true') as ctrl, \
+                    aiohttp.ClientSession() as session:
+                await ctrl.run()
+                players = [player.id
+                           for player in ctrl.db_session.query(Player)]
+                url = f'http://127.0.0.1:{push_port}'
+                ws = await session.ws_connect(f'{url}/ws?players={players[0]}')
+                await ws.send_json(dict(subscribe=players[1:]))
+                sse = await session.get(
+                    f'{url}/events?players={players[0]}')
+                await asyncio.sleep(0.1)
+                assert len(push.hub.subscribers) == 2
+
+                cursor = read(ctrl.db_session)[-1]['seq']
+                ctrl.outbox.listeners.append(push.hub.publish)
+                ladder.step(60)
+                await ctrl.run()
+                expected = read(ctrl.db_session, cursor)
+                assert expected
+
+                received = [await ws.receive_json(timeout=5)
+                            for _ in expected]
+                first = [change for change in expected
+                         if change['player'] == players[0]]
+                streamed = []
+                while len(streamed) < len(first):
+                    line = await asyncio.wait_for(sse.content.readline(), 5)
+                    if line.startswith(b'data: '):
+                        streamed.append(json.loads(line[6:]))
+                await ws.close()
+                sse.close()
+                return expected, received, first, streamed
+        finally:
+            await push.stop()
+
+    expected, received, first, streamed = asyncio.run(run())
+    assert received == expected
+    assert first and streamed == first
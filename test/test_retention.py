@@ -0,0 +1,54 @@
+"""Test the retention of logs and runs of the sc2monitor."""
+from datetime import date, datetime, timedelta
+
+import sc2monitor.retention as retention
+from sc2monitor.model import Log, Run, RunMetric, create_db_session
+
+
+def test_retention(tmp_path):
+    db_session = create_db_session(f'sqlite:///{tmp_path}/retention.db')
+    table = Log.__table__
+    now = datetime(2020, 1, 10)
+    # Pairs of log entries at the same time.
+    db_session.execute(table.insert(), [
+        dict(msg=str(idx), datetime=now - timedelta(hours=idx // 2))
+        for idx in range(100)])
+    db_session.commit()
+
+    def messages():
+        return sorted(int(log.msg) for log in db_session.query(Log))
+
+    condition = retention.age_condition(table, now, 1)
+    assert retention.delete_in_chunks(
+        db_session, table, condition, chunk_size=7) == 50
+    assert messages() == list(range(50))
+
+    condition = retention.count_condition(db_session, table, 25)
+    assert retention.delete_in_chunks(
+        db_session, table, condition, chunk_size=7) == 25
+    assert len(messages()) == 25
+    assert max(messages()) <= 25
+
+    assert retention.count_condition(db_session, table, 25) is None
+    assert retention.partition_name(date(2020, 1, 2)) == 'p20200102'
+
+
+def test_retention_children(tmp_path):
+    db_session = create_db_session(f'sqlite:///{tmp_path}/children.db')
+    now = datetime(2020, 1, 10)
+    for days in range(3, -1, -1):
+        db_session.add(Run(datetime=now - timedelta(days=days), metrics=[
+            RunMetric(kind='phase', name='total', count=1, seconds=days)]))
+    db_session.commit()
+
+    table = Run.__table__
+    assert retention.delete_in_chunks(
+        db_session, table, retention.age_condition(table, now, 2),
+        children=[RunMetric.__table__.c.run_id]) == 1
+    assert db_session.query(RunMetric).count() == 3
+
+    db_session.execute(table.delete().where(table.c.id == 2))
+    assert retention.delete_orphans(
+        db_session, RunMetric.__table__.c.run_id, table.c.id) == 1
+    assert sorted(metric.seconds for metric in db_session.query(RunMetric)) \
+        == [0, 1]
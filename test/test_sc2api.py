@@ -0,0 +1,161 @@
+"""Test the parsing of api responses of the sc2monitor."""
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from sc2monitor.controller import Controller, RaceUpdate
+from sc2monitor.decoding import LADDER_FIELDS, Projection
+from sc2monitor.model import League, Player, Race, Result, Server
+from sc2monitor.sc2api import SC2API, LadderEntry, LadderIndex, MatchEntry
+
+
+def ladder_team(profile, race, mmr, realm=1):
+    return {'teamMembers': [{'id': str(profile), 'realm': realm,
+                             'displayName': f'player{profile}',
+                             'favoriteRace': race}],
+            'mmr': mmr, 'wins': 10, 'losses': 5, 'joinTimestamp': 0}
+
+
+def parse_events(data):
+    """Yield the parse events of ijson for decoded data."""
+    if isinstance(data, dict):
+        yield 'start_map', None
+        for key, value in data.items():
+            yield 'map_key', key
+            yield from parse_events(value)
+        yield 'end_map', None
+    elif isinstance(data, list):
+        yield 'start_array', None
+        for item in data:
+            yield from parse_events(item)
+        yield 'end_array', None
+    else:
+        yield 'number', data
+
+
+def test_projection():
+    team = ladder_team(1, 'ZERG', 5000)
+    team['teamMembers'][0]['clanTag'] = 'TAG'
+    team['teamMembers'].append({'id': '2', 'clan': {'name': 'clan'}})
+    team['previousRank'] = 3
+    data = {'ladderTeams': [team, ladder_team(2, 'ZERG', 4000)],
+            'allLadderTeams': [{'teams': [[1, 2], {}]}],
+            'league': {'name': 'DIAMOND', 'tier': [1]},
+            'ranksAndPools': [{'rank': 1, 'mmr': 5000, 'bonusPool': 0}]}
+    expected = {
+        'ladderTeams': [ladder_team(1, 'ZERG', 5000),
+                        ladder_team(2, 'ZERG', 4000)],
+        'league': {'name': 'DIAMOND', 'tier': [1]},
+        'ranksAndPools': [{'rank': 1, 'mmr': 5000}]}
+    expected['ladderTeams'][0]['teamMembers'].append({'id': '2'})
+
+    projection = Projection(LADDER_FIELDS)
+    for event, value in parse_events(data):
+        projection.feed(event, value)
+    assert projection.result == expected
+
+
+def test_ladder_index():
+    teams = [ladder_team(1, 'ZERG', 5000), ladder_team(2, 'ZERG', 4900),
+             ladder_team(1, 'TERRAN', 4800), ladder_team(1, 'ZERG', 4700, 2)]
+    index = LadderIndex(teams)
+
+    assert index.find(1, 1) == 0
+    assert index.find(1, 1, used={0}) == 2
+    assert index.find(1, 1, start=1) == 2
+    assert index.find(1, 1, start=3) is None
+    assert index.find(1, 2) == 3
+    assert index.find(3, 1) is None
+
+
+def test_ladder_data(tmp_path):
+    controller = Controller(db=f'sqlite:///{tmp_path}/sc2api.db')
+    controller.create_db_session()
+    api = controller.sc2api
+    teams = [ladder_team(2, 'ZERG', 5000), ladder_team(1, 'PROTOSS', 4900),
+             ladder_team(3, 'ZERG', 4800), ladder_team(1, 'TERRAN', 4700)]
+
+    async def perform_api_request(url, **kwargs):
+        # Stale ranks point at the wrong teams.
+        return {'league': 'DIAMOND', 'ladderTeams': teams,
+                'ranksAndPools': [{'rank': 1, 'mmr': 4900},
+                                  {'rank': 3, 'mmr': 4700}]}, 200
+
+    async def get_access_token():
+        return 'token'
+
+    api._perform_api_request = perform_api_request
+    api.get_access_token = get_access_token
+
+    async def ladder_data():
+        return [entry async for entry in api._get_ladder_data(
+            Server.Europe, 1, 1, 123)]
+
+    entries = asyncio.run(ladder_data())
+    assert [(entry.race, entry.mmr) for entry in entries] == [
+        (Race.Protoss, 4900), (Race.Terran, 4700)]
+    assert entries[0].ladder_id == 123
+    assert entries[0].games == 15
+
+
+def test_ladder_entry():
+    team = ladder_team(1, 'ZERG', 5000)
+    team['joinTimestamp'] = 1577880000
+    assert SC2API._ladder_entry(team, 4900, '123', League.get('MASTER')) \
+        == LadderEntry(mmr=5000, race=Race.Zerg, games=15, wins=10,
+                       losses=5, name='player1',
+                       joined=datetime.fromtimestamp(1577880000),
+                       ladder_id=123, league=League.Master)
+    del team['mmr']
+    assert SC2API._ladder_entry(team, 4900, 123, League.Master).mmr == 4900
+
+    # Unknown races and leagues are rejected, unknown results kept.
+    with pytest.raises(ValueError):
+        SC2API._ladder_entry(ladder_team(1, 'HUMAN', 5000), 5000, 123,
+                             League.Master)
+    with pytest.raises(ValueError):
+        League.get('WOOD')
+    assert League.get('UNRANKED') == League.Unranked
+
+
+def test_match_history(tmp_path):
+    controller = Controller(db=f'sqlite:///{tmp_path}/sc2api.db')
+    controller.create_db_session()
+    api = controller.sc2api
+
+    async def perform_api_request(url, **kwargs):
+        return {'matches': [
+            {'map': 'map', 'type': '1v1', 'decision': 'WIN',
+             'speed': 'FASTER', 'date': 1577880000},
+            {'map': 'map', 'type': '2v2', 'decision': 'LOSS',
+             'speed': 'FASTER', 'date': 1577879000},
+            {'map': 'map', 'type': '1v1', 'decision': 'LEFT',
+             'speed': 'FASTER', 'date': 1577878000},
+            {'map': 'map', 'type': '1v1', 'decision': 'OBSERVER',
+             'speed': 'FASTER', 'date': 1577877000}]}, 200
+
+    async def get_access_token():
+        return 'token'
+
+    api._perform_api_request = perform_api_request
+    api.get_access_token = get_access_token
+
+    matches = asyncio.run(api._get_match_history(Server.Europe, 1, 1))
+    assert matches == [
+        MatchEntry(Result.Win, datetime.fromtimestamp(1577880000)),
+        MatchEntry(Result.Loss, datetime.fromtimestamp(1577878000)),
+        MatchEntry(Result.Unknown, datetime.fromtimestamp(1577877000))]
+    controller.close_db_session()
+
+
+def test_race_update():
+    entry = SC2API._ladder_entry(ladder_team(1, 'TERRAN', 4000), 4000, 1,
+                                 League.Gold)
+    update = RaceUpdate(Player(race=Race.Terran), entry, 2, 1)
+    assert update.missing_total == 3
+    update.assign(Result.Win)
+    update.assign(Result.Unknown)
+    assert (update.missing(Result.Win), update.missing(Result.Loss),
+            update.missing(Result.Tie)) == (1, 1, 0)
+    assert (update.wins, update.losses, update.missing_total) == (1, 0, 2)
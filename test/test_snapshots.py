@@ -0,0 +1,70 @@
+"""Test the snapshots of api data and reprocessing them."""
+import asyncio
+from datetime import datetime
+
+from mockapi import SyntheticLadder
+
+from sc2monitor.model import (League, Match, Player, Race, Result, Snapshot,
+                              Statistics)
+from sc2monitor.sc2api import LadderEntry, MatchEntry
+from sc2monitor.snapshots import decode, digest, encode
+
+
+def test_encode():
+    entries = [LadderEntry(4000, Race.Zerg, 10, 6, 4, 'player',
+                           datetime(2020, 1, 1, 12), 1234,
+                           League.Diamond)]
+    history = [MatchEntry(Result.Win, datetime(2020, 1, 2, 12, 30))]
+    assert decode(encode(42, entries, history, True)) \
+        == (42, entries, history, True)
+    assert decode(encode(42, entries))[2] is None
+    assert digest(entries) == digest(list(entries))
+    assert digest(entries) != digest([entries[0]._replace(wins=7)])
+
+
+def test_reprocess(mock_monitor):
+    ladder = SyntheticLadder(players=10, seed=3)
+    ladder.step(120)
+
+    # Reprocessing creates the rows of further races like the runs did.
+    assert any(len(player['teams']) > 1 for player in ladder.players.values())
+
+    def state(ctrl):
+        matches = sorted(
+            (match.player.player_id, match.player.race.name, match.datetime,
+             match.result.name, match.mmr, match.mmr_change, match.guess,
+             round(match.ema_mmr, 6), round(match.emvar_mmr, 6))
+            for match in ctrl.db_session.query(Match))
+        statistics = sorted(
+            (stats.player.player_id, stats.player.race.name, stats.wins,
+             stats.losses, stats.current_mmr, stats.max_mmr,
+             stats.guessed_games)
+            for stats in ctrl.db_session.query(Statistics))
+        players = sorted(
+            (player.player_id, player.race.name, player.ladder_id,
+             player.mmr, player.wins, player.losses)
+            for player in ctrl.db_session.query(Player))
+        return matches, statistics, players
+
+    async def run():
+        async with mock_monitor(ladder, snapshots='true') as ctrl:
+            for _ in range(3):
+                ladder.step(60)
+                await ctrl.run()
+            # Unchanged ladder data is not stored again.
+            snapshots = ctrl.db_session.query(Snapshot).count()
+            await ctrl.run()
+            assert ctrl.db_session.query(Snapshot).count() == snapshots
+            recorded = state(ctrl)
+            # The EMA of the runs follows the (datetime, id) order.
+            ctrl.rebuild_ema()
+            assert state(ctrl) == recorded
+
+            requests = ctrl.sc2api.request_count
+            await ctrl.reprocess()
+            assert ctrl.sc2api.request_count == requests
+            return recorded, state(ctrl)
+
+    recorded, reprocessed = asyncio.run(run())
+    assert recorded[0]
+    assert reprocessed == recorded
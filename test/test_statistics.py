@@ -0,0 +1,289 @@
+"""Test the statistics of the sc2monitor."""
+import math
+import random
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import pytest
+
+import sc2monitor.model as model
+import sc2monitor.statistics as statistics
+from sc2monitor.controller import Controller
+from sc2monitor.model import Result
+from sc2monitor.statistics import (RollingStatistics, StatisticsAccumulator,
+                                   compute_bulk_ema, compute_bulk_statistics,
+                                   compute_horizons, ema_alpha,
+                                   parse_horizons, same_statistics,
+                                   update_ema)
+
+
+def naive_statistics(matches, current_mmr):
+    """Compute statistics of matches (newest first) the straight way."""
+    games = len(matches)
+    mmrs = [mmr for mmr, _, _, _ in matches]
+    values = dict(current_mmr=current_mmr,
+                  max_mmr=max(mmrs + [current_mmr]),
+                  min_mmr=min(mmrs + [current_mmr]),
+                  wins=0, losses=0, guessed_games=0, instant_left_games=0,
+                  longest_wining_streak=0, longest_losing_streak=0)
+    streak = {Result.Win: 0, Result.Loss: 0}
+    for _, result, guess, max_length in matches:
+        values['guessed_games'] += guess
+        if result == Result.Win:
+            values['wins'] += 1
+            streak[Result.Win] += 1
+            streak[Result.Loss] = 0
+        elif result == Result.Loss:
+            values['losses'] += 1
+            values['instant_left_games'] += max_length <= 120
+            streak[Result.Loss] += 1
+            streak[Result.Win] = 0
+        values['longest_wining_streak'] = max(
+            values['longest_wining_streak'], streak[Result.Win])
+        values['longest_losing_streak'] = max(
+            values['longest_losing_streak'], streak[Result.Loss])
+
+    avg = sum(mmrs) / games
+    values['avg_mmr'] = avg
+    values['wma_mmr'] = sum(mmr * (games - idx) for idx, mmr
+                            in enumerate(mmrs)) / (games * (games + 1) / 2)
+    values['sd_mmr'] = round(math.sqrt(
+        sum(mmr * mmr for mmr in mmrs) / games - avg * avg))
+    if games <= 1:
+        values['lr_mmr_slope'] = 0.0
+        values['lr_mmr_intercept'] = avg
+    else:
+        xbar = -0.5 * (games - 1)
+        numerator = sum((-idx - xbar) * (mmr - avg)
+                        for idx, mmr in enumerate(mmrs))
+        denominator = sum((-idx - xbar) ** 2 for idx in range(games))
+        values['lr_mmr_slope'] = numerator / denominator
+        values['lr_mmr_intercept'] = avg - values['lr_mmr_slope'] * xbar
+    return values
+
+
+def random_matches(count, seed=0):
+    rng = random.Random(seed)
+    results = [Result.Win, Result.Win, Result.Loss, Result.Loss, Result.Tie]
+    return [(rng.randint(3000, 5000), rng.choice(results),
+             rng.random() < 0.2, rng.choice([60, 180, 600]))
+            for _ in range(count)]
+
+
+def test_accumulator():
+    matches = random_matches(200)
+    accumulator = StatisticsAccumulator()
+    for games, match in enumerate(matches, start=1):
+        accumulator.add(*match)
+        assert same_statistics(accumulator.values(4000),
+                               naive_statistics(matches[:games], 4000),
+                               rel_tol=1e-7)
+
+    assert StatisticsAccumulator().values(None)['wma_mmr'] == 0.0
+
+
+def test_rolling_statistics():
+    for size in [1, 2, 7, 50]:
+        matches = random_matches(300, seed=size)
+        window = RollingStatistics(size)
+        for pushed, match in enumerate(matches, start=1):
+            window.push(*match)
+            newest_first = matches[max(0, pushed - size):pushed][::-1]
+            assert len(window.matches) == min(pushed, size)
+            assert same_statistics(window.values(4000),
+                                   naive_statistics(newest_first, 4000),
+                                   rel_tol=1e-7)
+
+
+@pytest.mark.parametrize('numpy', [True, False])
+def test_bulk_statistics(monkeypatch, numpy):
+    if not numpy:
+        monkeypatch.setattr(statistics, 'np', None)
+    elif statistics.np is None:
+        pytest.skip('NumPy is not installed')
+
+    players = {player_id: random_matches(count, seed=player_id)
+               for player_id, count in [(3, 1), (5, 40), (8, 120), (9, 7)]}
+    columns = [(player_id, mmr, result.value, guess, max_length)
+               for player_id, matches in players.items()
+               for mmr, result, guess, max_length in matches]
+    current_mmrs = {3: 4000, 5: 0, 8: 3500, 9: None}
+
+    bulk = compute_bulk_statistics(*zip(*columns), current_mmrs, limit=50)
+
+    assert bulk.keys() == players.keys()
+    for player_id, matches in players.items():
+        assert same_statistics(
+            bulk[player_id],
+            naive_statistics(matches[:50], current_mmrs[player_id] or 0),
+            rel_tol=1e-7)
+
+
+@pytest.mark.parametrize('numpy', [True, False])
+@pytest.mark.parametrize('period', [1, 10, 100])
+def test_bulk_ema(monkeypatch, numpy, period):
+    if not numpy:
+        monkeypatch.setattr(statistics, 'np', None)
+    elif statistics.np is None:
+        pytest.skip('NumPy is not installed')
+
+    rng = random.Random(period)
+    player_ids = sorted(rng.choice([1, 2, 5]) for _ in range(500))
+    mmrs = [rng.randint(3000, 5000) for _ in player_ids]
+    # The EMA restarts after an EMA of at most zero.
+    player_ids += [6, 6, 6, 6, 6, 7, 7]
+    mmrs += [0, 100, 0, -3, 200, -5, 10]
+    alpha = ema_alpha(period)
+
+    expected = []
+    previous_id = ema = emvar = None
+    for player_id, mmr in zip(player_ids, mmrs):
+        if player_id != previous_id:
+            ema = emvar = None
+        ema, emvar = update_ema(mmr, alpha, ema, emvar)
+        expected.append((ema, emvar))
+        previous_id = player_id
+
+    emas, emvars = compute_bulk_ema(player_ids, mmrs, alpha)
+    for ema, emvar, (expected_ema, expected_emvar) in zip(
+            emas, emvars, expected):
+        assert math.isclose(ema, expected_ema, rel_tol=1e-9)
+        assert math.isclose(emvar, expected_emvar,
+                            rel_tol=1e-6, abs_tol=1e-6)
+    assert list(emas[-2:]) == [-5, 10]
+
+    with pytest.raises(ValueError):
+        ema_alpha(0.5)
+    with pytest.raises(ValueError):
+        ema_alpha(-1)
+
+
+def test_horizons():
+    Match = namedtuple('Match', 'mmr result guess max_length datetime')
+    start = datetime(2020, 1, 1)
+    matches = [Match(*match, start - timedelta(hours=idx))
+               for idx, match in enumerate(random_matches(80))]
+
+    assert parse_horizons(' 25, season,100') == [25, 'season', 100]
+    with pytest.raises(ValueError):
+        parse_horizons('25,year')
+
+    values = compute_horizons(matches, 4000, [25, 100, 'season', 10],
+                              season_start=start - timedelta(hours=29.5))
+    assert values.keys() == {'10', '25', '100', 'season'}
+    for horizon, games in [('10', 10), ('25', 25), ('100', 80),
+                           ('season', 30)]:
+        expected = naive_statistics(
+            [match[:4] for match in matches[:games]], 4000)
+        assert values[horizon].pop('games') == games
+        assert values[horizon].pop('winrate') == \
+            expected['wins'] / (expected['wins'] + expected['losses'])
+        assert same_statistics(values[horizon], expected, rel_tol=1e-7)
+
+    assert 'season' not in compute_horizons(matches, 4000, ['season'])
+
+
+def test_horizon_statistics(tmp_path):
+    controller = Controller(db=f'sqlite:///{tmp_path}/horizons.db',
+                            analyze_matches=25,
+                            statistics_horizons='10,season')
+    controller.create_db_session()
+    session = controller.db_session
+    start = datetime(2020, 1, 1)
+    player = model.Player(player_id=1, server=model.Server.Europe, mmr=4000)
+    session.add(player)
+    for idx, (mmr, result, guess, max_length) in enumerate(
+            random_matches(30)):
+        session.add(model.Match(
+            player=player, mmr=mmr, result=result, guess=guess,
+            max_length=max_length, datetime=start + timedelta(hours=idx)))
+    session.commit()
+
+    def rows():
+        return {row.horizon: (row.games, row.max_mmr)
+                for row in session.query(model.HorizonStatistics)}
+
+    controller.current_season[player.server.id()] = model.Season(
+        server=player.server, start=start + timedelta(hours=20))
+    controller.calc_horizon_statistics(player)
+    expected = rows()
+    assert {horizon: games for horizon, (games, _) in expected.items()} \
+        == {'10': 10, 'season': 10}
+
+    # The season row is kept while the current season is unknown.
+    controller.current_season.clear()
+    controller.calc_horizon_statistics(player)
+    assert rows() == expected
+
+    # Horizons within the rolling window are computed without a query.
+    controller.statistics_horizons = [10]
+    controller.calc_statistics(player)
+    controller.get_recent_matches = None
+    controller.calc_horizon_statistics(player)
+    assert rows() == {'10': expected['10']}
+    controller.close_db_session()
+
+
+def test_last_matches(tmp_path):
+    controller = Controller(db=f'sqlite:///{tmp_path}/last.db')
+    controller.create_db_session()
+    session = controller.db_session
+    start = datetime(2020, 1, 1)
+    players = [model.Player(player_id=idx) for idx in range(2)]
+    session.add_all(players)
+    for player in players:
+        for hours in (0, 2, 2):
+            session.add(model.Match(player=player, mmr=4000,
+                                    datetime=start + timedelta(hours=hours)))
+    session.commit()
+
+    controller.load_last_matches()
+    assert len(controller.last_match) == 2
+    for player in players:
+        last = max(match.id for match in player.matches)
+        assert controller.last_match[player.id].id == last
+        assert controller.get_recent_matches(player, 1)[0].id == last
+    controller.last_match = None
+    assert controller.get_last_match(players[0]).id \
+        == max(match.id for match in players[0].matches)
+    controller.close_db_session()
+
+
+def test_analytics_processes(tmp_path):
+    controller = Controller(db=f'sqlite:///{tmp_path}/analytics.db')
+    controller.create_db_session()
+    session = controller.db_session
+    start = datetime(2020, 1, 1)
+    for player_id in range(1, 6):
+        player = model.Player(player_id=player_id, mmr=4000)
+        session.add(player)
+        for idx, (mmr, result, guess, max_length) in enumerate(
+                random_matches(30 * player_id, seed=player_id)):
+            session.add(model.Match(
+                player=player, mmr=mmr, result=result, guess=guess,
+                max_length=max_length,
+                datetime=start + timedelta(hours=idx)))
+    session.commit()
+
+    def snapshot():
+        session.expire_all()
+        return ({row.player_id: statistics_columns(row)
+                 for row in session.query(model.Statistics)},
+                {match.id: (match.ema_mmr, match.emvar_mmr)
+                 for match in session.query(model.Match)})
+
+    def statistics_columns(row):
+        return {column: getattr(row, column)
+                for column in ['wins', 'losses', 'max_mmr', 'sd_mmr',
+                               'lr_mmr_slope', 'longest_losing_streak']}
+
+    controller.recompute_statistics(chunk_size=40, processes=1)
+    controller.rebuild_ema(period=10, chunk_size=40, processes=1)
+    expected = snapshot()
+    session.query(model.Statistics).delete()
+    session.query(model.Match).update({'ema_mmr': 0.0, 'emvar_mmr': 0.0})
+    session.commit()
+
+    controller.recompute_statistics(chunk_size=40, processes=2)
+    controller.rebuild_ema(period=10, chunk_size=40, processes=2)
+    assert snapshot() == expected
@@ -0,0 +1,46 @@
+"""Test the tracing of players of the sc2monitor."""
+import asyncio
+import json
+import time
+
+import pytest
+
+import sc2monitor.tracing as tracing
+
+
+def test_tracing(tmp_path):
+    path = tmp_path / 'traces.jsonl'
+    tracer = tracing.Tracer(str(path), sample_rate=0.0, slow_seconds=0.02)
+
+    async def query_player(player, delay):
+        with tracer.trace(player):
+            start = time.perf_counter()
+            await asyncio.sleep(delay)
+            tracing.record('ladder', start, status=200)
+            with tracing.span('update_player', player=player):
+                tracing.tag(race_split=True)
+                await asyncio.sleep(delay)
+
+    async def main():
+        await asyncio.gather(query_player(1, 0.001), query_player(2, 0.02))
+
+    with tracing.span('outside') as untraced:
+        tracing.tag(ignored=True)
+    # Untraced spans share their tags, which cannot be written.
+    with pytest.raises(TypeError):
+        untraced.tags['leaked'] = True
+    assert not tracing.span('other').tags
+    asyncio.run(main())
+    tracer.flush()
+
+    traces = [json.loads(line) for line in path.read_text().splitlines()]
+    # Only the slow player is kept without sampling.
+    assert [trace['player'] for trace in traces] == [2]
+    spans = traces[0]['spans']
+    assert [(span['name'], span['parent']) for span in spans] \
+        == [('query_player', None), ('ladder', 0), ('update_player', 0)]
+    assert spans[1]['tags'] == {'status': 200}
+    assert spans[2]['tags'] == {'player': 2, 'race_split': True}
+    assert spans[2]['start'] >= spans[1]['start'] + spans[1]['duration']
+
+    assert tracing.Tracer().trace(1) is tracing.span('outside')